@@ -0,0 +1,363 @@
+# bench_bank.py
+# Load generator and failover benchmark for dist_bank.
+# Starts an N-node local cluster in subprocesses, drives transfers against it,
+# kills the leader partway through and reports throughput, latency,
+# election duration and catch-up time of the restarted node.
+# pip install flask requests (aiohttp too for --script dist_bank_async.py)
+
+import argparse, json, os, random, shutil, subprocess, sys, tempfile, threading, time
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# latency histogram bucket upper bounds, milliseconds
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf")]
+
+OP_DEADLINE = 10.0     # a transfer is retried (same client_txid) for at most this long
+RETRY_DELAY = 0.05
+POLL_INTERVAL = 0.02
+
+
+class Cluster:
+    """N dist_bank processes on consecutive ports, logs under workdir."""
+
+    def __init__(self, n, base_port, script, workdir, extra_args):
+        self.ports = [base_port + i for i in range(n)]
+        self.script = script
+        self.workdir = workdir
+        self.extra_args = extra_args
+        self.procs = {}
+        self.procs_lock = threading.Lock()   # workers read alive() while the leader is killed
+
+    def url(self, node_id):
+        return f"http://127.0.0.1:{self.ports[node_id - 1]}"
+
+    def node_ids(self):
+        return list(range(1, len(self.ports) + 1))
+
+    def start(self, node_id):
+        peers = ",".join(self.url(i) for i in self.node_ids() if i != node_id)
+        cmd = [sys.executable, self.script, "--id", str(node_id), "--port", str(self.ports[node_id - 1]),
+               "--peers", peers] + self.extra_args
+        log = open(os.path.join(self.workdir, f"node{node_id}.log"), "a")
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=HERE)
+        with self.procs_lock:
+            self.procs[node_id] = proc
+
+    def kill(self, node_id):
+        with self.procs_lock:
+            proc = self.procs.pop(node_id)
+        proc.kill()
+        proc.wait()
+
+    def stop(self):
+        for proc in self.procs.values():
+            proc.terminate()
+        for proc in self.procs.values():
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        self.procs.clear()
+
+    def alive(self):
+        with self.procs_lock:
+            return sorted(self.procs)
+
+    def heartbeat(self, node_id, timeout=0.5):
+        try:
+            return requests.get(self.url(node_id) + "/heartbeat", timeout=timeout).json()
+        except Exception:
+            return None
+
+    def leader(self, among=None):
+        """Node id every live node (or `among`) agrees is leader, else None."""
+        ids = among if among is not None else self.alive()
+        beats = [self.heartbeat(i) for i in ids]
+        if any(b is None for b in beats):
+            return None
+        leaders = {b["id"] for b in beats if b.get("is_leader")}
+        if len(leaders) != 1:
+            return None
+        leader = leaders.pop()
+        if any(b["leader"] != self.url(leader) for b in beats):
+            return None
+        return leader
+
+    def wait_leader(self, timeout, among=None):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            leader = self.leader(among)
+            if leader is not None:
+                return leader
+            time.sleep(POLL_INTERVAL)
+        return None
+
+
+class Workload:
+    """Picks (from, to) pairs: uniform over all accounts, or skewed toward a few hot ones."""
+
+    def __init__(self, kind, accounts, hot_accounts, hot_ratio, seed):
+        self.names = [f"acct{i}" for i in range(accounts)]
+        self.hot = self.names[:max(1, hot_accounts)]
+        self.kind = kind
+        self.hot_ratio = hot_ratio
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def pick(self):
+        with self.lock:
+            if self.kind == "hot" and self.rng.random() < self.hot_ratio:
+                a = self.rng.choice(self.hot)
+            else:
+                a = self.rng.choice(self.names)
+            b = self.rng.choice(self.names)
+            while b == a:
+                b = self.rng.choice(self.names)
+            return a, b, self.rng.randint(1, 9)
+
+
+class Recorder:
+    """Per-worker result lists, merged at the end; no shared lock on the hot path."""
+
+    def __init__(self):
+        self.samples = []    # (finish time, latency seconds, transfers committed)
+        self.errors = 0      # failed attempts (retried)
+        self.abandoned = 0   # gave up after OP_DEADLINE
+
+    @staticmethod
+    def merge(recorders):
+        total = Recorder()
+        for r in recorders:
+            total.samples.extend(r.samples)
+            total.errors += r.errors
+            total.abandoned += r.abandoned
+        total.samples.sort()
+        return total
+
+
+def worker(cluster, workload, args, stop, rec, tag):
+    s = requests.Session()
+    i = 0
+    while not stop.is_set():
+        txs = []
+        for _ in range(args.batch):
+            a, b, amount = workload.pick()
+            txs.append({"from": a, "to": b, "amount": amount, "client_txid": f"{tag}-{i}"})
+            i += 1
+        if args.batch == 1:
+            path, payload = "/transaction", txs[0]
+        else:
+            path, payload = "/transactions", {"transactions": txs}
+        start = time.time()
+        while True:
+            # clients do not track the leader: any live node forwards
+            alive = cluster.alive()
+            node_id = random.choice(alive) if alive else 1
+            try:
+                r = s.post(cluster.url(node_id) + path, json=payload, timeout=2.0)
+                if r.status_code == 200:
+                    rec.samples.append((time.time(), time.time() - start, len(txs)))
+                    break
+            except Exception:
+                pass
+            rec.errors += 1
+            if time.time() - start > OP_DEADLINE or stop.is_set():
+                rec.abandoned += 1
+                break
+            time.sleep(RETRY_DELAY)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def histogram(latencies_ms):
+    counts = [0] * len(LATENCY_BUCKETS)
+    for v in latencies_ms:
+        for b, upper in enumerate(LATENCY_BUCKETS):
+            if v <= upper:
+                counts[b] += 1
+                break
+    return counts
+
+
+def print_histogram(counts):
+    total = sum(counts) or 1
+    width = max(counts) or 1
+    lower = 0
+    for upper, c in zip(LATENCY_BUCKETS, counts):
+        label = f"{lower:>5}-{upper:<5}" if upper != float("inf") else f"{lower:>5}+     "
+        bar = "#" * int(40 * c / width)
+        print(f"  {label} ms {c:8d} {100.0 * c / total:6.2f}% {bar}")
+        lower = upper
+
+
+def measure_failover(cluster, start, restart_after, results):
+    """Kill the leader, time the election among survivors, restart it and time its catch-up."""
+    old = cluster.leader()
+    if old is None:
+        print("failover: no agreed leader at kill time, skipped")
+        return
+    killed_at = time.time()
+    cluster.kill(old)
+    print(f"[{killed_at - start:6.2f}s] killed leader node {old}")
+    survivors = cluster.alive()
+    new = cluster.wait_leader(30.0, among=survivors)
+    if new is None:
+        print("failover: no new leader within 30s")
+        return
+    elected_at = time.time()
+    results["killed_leader"] = old
+    results["killed_at"] = killed_at - start
+    results["new_leader"] = new
+    results["election_seconds"] = elected_at - killed_at
+    beat = requests.get(cluster.url(new) + "/status", timeout=2.0).json()
+    results["leader_reported_election_seconds"] = beat.get("last_election_seconds")
+    print(f"[{elected_at - start:6.2f}s] node {new} leads after {elected_at - killed_at:.3f}s")
+
+    time.sleep(restart_after)
+    target = max((cluster.heartbeat(i) or {}).get("applied_seq", 0) for i in survivors)
+    restarted_at = time.time()
+    cluster.start(old)
+    print(f"[{restarted_at - start:6.2f}s] restarted node {old}, catching up to seq {target}")
+    deadline = restarted_at + 60.0
+    while time.time() < deadline:
+        beat = cluster.heartbeat(old, timeout=0.2)
+        if beat and beat.get("applied_seq", 0) >= target:
+            results["catchup_seconds"] = time.time() - restarted_at
+            results["catchup_target_seq"] = target
+            print(f"[{time.time() - start:6.2f}s] node {old} caught up in {results['catchup_seconds']:.3f}s")
+            return
+        time.sleep(POLL_INTERVAL)
+    print(f"failover: node {old} did not catch up within 60s")
+
+
+def check_converged(cluster, timeout=10.0):
+    """True once every live node reports the same applied_seq and balances."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            states = [requests.get(cluster.url(i) + "/status", timeout=2.0).json() for i in cluster.alive()]
+        except Exception:
+            states = []
+        if states and all(st["applied_seq"] == states[0]["applied_seq"] and st["balances"] == states[0]["balances"]
+                          for st in states):
+            return True, states[0]["applied_seq"]
+        time.sleep(0.2)
+    return False, [(st["id"], st["applied_seq"], st["leader"]) for st in states]
+
+
+def report(rec, start, end, args, failover):
+    latencies = sorted(s[1] * 1000.0 for s in rec.samples)
+    committed = sum(s[2] for s in rec.samples)
+    elapsed = end - start
+    print()
+    print(f"workload       {args.workload}, {args.nodes} nodes, {args.concurrency} clients, batch {args.batch}, {args.script}")
+    print(f"duration       {elapsed:.2f}s")
+    print(f"committed      {committed} transfers in {len(rec.samples)} requests")
+    print(f"throughput     {committed / elapsed:.1f} commits/sec")
+    print(f"errors         {rec.errors} failed attempts, {rec.abandoned} abandoned")
+    print(f"latency ms     p50 {percentile(latencies, 50):.2f}  p90 {percentile(latencies, 90):.2f}  "
+          f"p99 {percentile(latencies, 99):.2f}  max {latencies[-1] if latencies else 0:.2f}")
+    counts = histogram(latencies)
+    print_histogram(counts)
+
+    # commits per second over the run, so the failover dip is visible
+    timeline = [0] * (int(elapsed) + 1)
+    for t, _, n in rec.samples:
+        if start <= t < end:
+            timeline[int(t - start)] += n
+    print("timeline       " + " ".join(str(c) for c in timeline))
+    if failover:
+        print(f"election       {failover.get('election_seconds', float('nan')):.3f}s observed, "
+              f"{failover.get('leader_reported_election_seconds')}s reported by the new leader")
+        print(f"catch-up       {failover.get('catchup_seconds', float('nan')):.3f}s "
+              f"to seq {failover.get('catchup_target_seq')}")
+    return {
+        "workload": args.workload, "nodes": args.nodes, "concurrency": args.concurrency,
+        "batch": args.batch, "script": args.script, "duration": elapsed,
+        "committed": committed, "commits_per_sec": committed / elapsed,
+        "errors": rec.errors, "abandoned": rec.abandoned,
+        "latency_ms": {"p50": percentile(latencies, 50), "p90": percentile(latencies, 90),
+                       "p99": percentile(latencies, 99), "max": latencies[-1] if latencies else 0},
+        "histogram_ms": {str(b): c for b, c in zip(LATENCY_BUCKETS, counts)},
+        "timeline": timeline,
+        "failover": failover,
+    }
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="dist_bank load and failover benchmark")
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=5101)
+    parser.add_argument("--script", default="dist_bank.py", help="dist_bank.py or dist_bank_async.py")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=32, help="client threads")
+    parser.add_argument("--batch", type=int, default=1, help="transfers per request (>1 uses /transactions)")
+    parser.add_argument("--workload", choices=["uniform", "hot"], default="uniform")
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--hot-accounts", type=int, default=4)
+    parser.add_argument("--hot-ratio", type=float, default=0.9, help="share of transfers touching a hot account")
+    parser.add_argument("--kill-at", type=float, default=None,
+                        help="seconds into the run to kill the leader (default: a third of the duration)")
+    parser.add_argument("--no-failover", action="store_true")
+    parser.add_argument("--restart-after", type=float, default=2.0,
+                        help="seconds after the new election before the old leader is restarted")
+    parser.add_argument("--persist", action="store_true", help="run nodes with --data-dir in the work directory")
+    parser.add_argument("--node-args", default="", help="extra arguments passed to every node")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (node logs)")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    workdir = tempfile.mkdtemp(prefix="bench_bank_")
+    extra = args.node_args.split()
+    if args.persist:
+        extra += ["--data-dir", os.path.join(workdir, "data")]
+    cluster = Cluster(args.nodes, args.base_port, args.script, workdir, extra)
+    for node_id in cluster.node_ids():
+        cluster.start(node_id)
+    try:
+        leader = cluster.wait_leader(30.0)
+        if leader is None:
+            sys.exit(f"no leader elected, see logs in {workdir}")
+        print(f"cluster up, leader node {leader}, logs in {workdir}")
+
+        workload = Workload(args.workload, args.accounts, args.hot_accounts, args.hot_ratio, args.seed)
+        stop = threading.Event()
+        recorders = [Recorder() for _ in range(args.concurrency)]
+        threads = [threading.Thread(target=worker, args=(cluster, workload, args, stop, rec, f"w{k}"), daemon=True)
+                   for k, rec in enumerate(recorders)]
+        start = time.time()
+        for t in threads:
+            t.start()
+
+        failover = {}
+        if not args.no_failover and args.nodes > 1:
+            kill_at = args.kill_at if args.kill_at is not None else args.duration / 3
+            time.sleep(kill_at)
+            measure_failover(cluster, start, args.restart_after, failover)
+        time.sleep(max(0.0, start + args.duration - time.time()))
+        stop.set()
+        for t in threads:
+            t.join(OP_DEADLINE + 5)
+        end = time.time()
+
+        results = report(Recorder.merge(recorders), start, end, args, failover)
+        converged, seq = check_converged(cluster)
+        results["converged"] = converged
+        print(f"converged      {'yes, applied_seq ' if converged else 'NO, (id, applied_seq, leader) '}{seq}")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+    finally:
+        cluster.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -3,12 +3,147 @@
 # pip install flask requests
 
 from flask import Flask, request, jsonify
-import threading, requests, time, argparse, sys
-from collections import defaultdict
-import json
+import threading, requests, time, argparse, sys, os
+from ledger import Ledger, ColumnarLog
+import json, bisect, itertools, struct
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
 
 app = Flask(__name__)
 
+# Metrics: Prometheus text format on /metrics
+N_METRIC_SHARDS = 16
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Metrics:
+    """
+    Counters and histograms, sharded like the account locks: each thread
+    records into one of N_METRIC_SHARDS shards under that shard's own lock,
+    so concurrent requests rarely touch the same lock. Scrapes sum the shards.
+    Gauges are callbacks evaluated at scrape time.
+    """
+    def __init__(self):
+        self.meta = {}   # name -> (type, help, label name, buckets or callback)
+        self.shards = [(threading.Lock(), {}) for _ in range(N_METRIC_SHARDS)]
+        self.next_shard = itertools.count()
+        self.local = threading.local()
+
+    def counter(self, name, help, label=None):
+        self.meta[name] = ("counter", help, label, None)
+
+    def histogram(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        self.meta[name] = ("histogram", help, label, buckets)
+
+    def gauge(self, name, help, fn, label=None):
+        """fn() returns a number, or {label value: number} when label is set."""
+        self.meta[name] = ("gauge", help, label, fn)
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            # threads are spread round-robin; a new thread picks its shard once
+            shard = self.local.shard = self.shards[next(self.next_shard) % N_METRIC_SHARDS]
+            return shard
+
+    def inc(self, name, value=1, label=None):
+        lock, data = self.shard()
+        with lock:
+            data[(name, label)] = data.get((name, label), 0) + value
+
+    def observe(self, name, value, label=None):
+        buckets = self.meta[name][3]
+        i = bisect.bisect_left(buckets, value)
+        lock, data = self.shard()
+        with lock:
+            h = data.get((name, label))
+            if h is None:
+                # per-bucket counts, +Inf count, sum
+                h = data[(name, label)] = [0] * (len(buckets) + 2)
+            h[i] += 1
+            h[-1] += value
+
+    def collect(self):
+        """Shard totals: (name, label) -> count or histogram list."""
+        totals = {}
+        for lock, data in self.shards:
+            with lock:
+                items = [(k, list(v) if isinstance(v, list) else v) for k, v in data.items()]
+            for k, v in items:
+                if k not in totals:
+                    totals[k] = v
+                elif isinstance(v, list):
+                    totals[k] = [a + b for a, b in zip(totals[k], v)]
+                else:
+                    totals[k] += v
+        return totals
+
+    def render(self):
+        totals = self.collect()
+        by_name = {}
+        for (name, label), v in totals.items():
+            by_name.setdefault(name, []).append((label, v))
+        out = []
+        for name, (kind, help, label_name, extra) in self.meta.items():
+            out.append(f"# HELP {name} {help}")
+            out.append(f"# TYPE {name} {kind}")
+            if kind == "gauge":
+                values = extra()
+                series = values.items() if label_name else [(None, values)]
+            else:
+                series = sorted(by_name.get(name, []), key=lambda lv: str(lv[0]))
+            for label, v in series:
+                lbl = f'{label_name}="{label}"' if label_name and label is not None else ""
+                if kind != "histogram":
+                    out.append(f"{name}{{{lbl}}} {v}" if lbl else f"{name} {v}")
+                    continue
+                sep = "," if lbl else ""
+                cumulative = 0
+                for upper, c in zip(list(extra) + ["+Inf"], v):
+                    cumulative += c
+                    out.append(f'{name}_bucket{{{lbl}{sep}le="{upper}"}} {cumulative}')
+                out.append(f"{name}_sum{{{lbl}}} {v[-1]}" if lbl else f"{name}_sum {v[-1]}")
+                out.append(f"{name}_count{{{lbl}}} {cumulative}" if lbl else f"{name}_count {cumulative}")
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+metrics.counter("dist_bank_transactions_committed_total", "Transfers committed by this node as leader", label="kind")
+metrics.counter("dist_bank_transactions_forwarded_total", "Client requests forwarded to the leader", label="outcome")
+metrics.histogram("dist_bank_commit_seconds", "Leader time to sequence and apply a client request", label="kind")
+metrics.histogram("dist_bank_forward_seconds", "Follower round trip forwarding a client request to the leader")
+metrics.histogram("dist_bank_append_log_seconds",
+                  "Log append plus balance apply (insert: one entry by seq, extend: a settled run)", label="path")
+metrics.histogram("dist_bank_lock_wait_seconds", "Time spent waiting to acquire a lock", label="lock")
+metrics.histogram("dist_bank_replication_batch_seconds", "Leader round trip of one /commit_batch", label="follower")
+metrics.counter("dist_bank_replication_entries_total", "Entries acknowledged by a follower", label="follower")
+metrics.counter("dist_bank_elections_total", "Election rounds run by this node", label="result")
+metrics.histogram("dist_bank_election_seconds", "Duration of this node's election rounds",
+                  buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0))
+
+class TimedLock:
+    """threading.Lock that records its acquisition wait in dist_bank_lock_wait_seconds."""
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.lock.acquire(False):
+            start = time.perf_counter()
+            self.lock.acquire()
+            metrics.observe("dist_bank_lock_wait_seconds", time.perf_counter() - start, self.name)
+        else:
+            metrics.observe("dist_bank_lock_wait_seconds", 0.0, self.name)
+        return True
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
 # Node runtime state (will be overwritten per instance via args)
 NODE_ID = None
 PORT = None
@@ -24,18 +159,107 @@ lamport_lock = threading.Lock()
 seq_counter = 1
 seq_lock = threading.Lock()
 
-# Transaction log: list of dicts {seq, lamport, from, to, amount, client_txid}
-transaction_log = []
-log_lock = threading.Lock()
+# Balances (account id -> amount) and the transaction log share one account
+# intern table; both are array-backed behind dict / list-of-dicts facades (ledger.py)
+balances = Ledger()
 
-# Balances
-balances = defaultdict(int)
-balances_lock = threading.Lock()
+# Transaction log: applied entries in seq order, read back as dicts {seq, lamport, from, to, amount, client_txid}
+transaction_log = ColumnarLog(balances)
+pending_entries = {}  # seq -> entry that arrived ahead of a gap, applied once the gap fills
+txid_index = {}       # client_txid -> seq, so a retried client request is never applied twice
+TXID_WINDOW = 1000000 # seqs back from the last snapshot whose txids are kept (about 150 bytes each)
+                      # once compacted; a retry older than that is committed as a new transfer
+applied_seq = 0       # watermark: every seq <= applied_seq has been applied to balances
+log_lock = TimedLock("log_lock")
+
+# Balances are guarded by striped per-account locks so transfers on disjoint accounts apply in parallel
+N_LOCK_STRIPES = 64
+account_locks = [threading.Lock() for _ in range(N_LOCK_STRIPES)]
+REPLAY_MIN_RUN = 64   # settled runs at least this long are applied as per-account net deltas
+
+class AllAccountsLock:
+    """Holds every account stripe (in index order), for rare whole-state rewrites."""
+    def __enter__(self):
+        start = time.perf_counter()
+        for l in account_locks:
+            l.acquire()
+        metrics.observe("dist_bank_lock_wait_seconds", time.perf_counter() - start, "balances_lock")
+
+    def __exit__(self, *exc):
+        for l in reversed(account_locks):
+            l.release()
+
+balances_lock = AllAccountsLock()
+applying = set()                     # settled seqs whose balance update is still running
+applying_cond = threading.Condition()
+snapshot_lock = threading.Lock()     # one copy-on-write snapshot at a time
+cow_seq = None                       # while a snapshot runs: entries above this seq save old balances first
+cow_saved = {}                       # account -> balance as of cow_seq (None if it did not exist yet)
 
 # For heartbeat monitoring
 last_leader_heartbeat = time.time()
 HEARTBEAT_INTERVAL = 1.0
 HEARTBEAT_TIMEOUT = 3.0
+heartbeat_session = requests.Session()  # pooled connections for leader -> follower heartbeats
+
+# Reads
+READ_WAIT = 1.0               # seconds a read may wait for the local watermark to reach min_seq
+LEASE_DURATION = 2.0          # read lease after a majority-acked heartbeat; below HEARTBEAT_TIMEOUT,
+                              # so no follower starts an election while the lease holds
+lease_until = 0.0             # leader: linearizable reads are served locally until this time
+reads_from = 0.0              # new leader: no lease reads before this time, when the deposed
+                              # leader's lease has surely run out
+caught_up_at = 0.0            # follower: last time we held everything the leader had committed
+
+# Replication pipeline (leader -> followers)
+REPL_BATCH_SIZE = 256       # max entries per /commit_batch request
+REPL_BATCH_WINDOW = 0.005   # seconds to wait for more commits before sending a partial batch
+REPL_RETRY_DELAY = 0.5      # back-off after a failed send to a follower
+replicators = {}            # peer url -> Replicator (leader only)
+repl_cond = threading.Condition()  # notified whenever the leader commits new entries
+batch_starts = []           # first seq of each client batch (leader only), so replication never splits one
+batch_ends = []             # matching last seq
+leader_session = requests.Session()  # pooled connection for forwarding client requests to the leader
+
+# Durability: write-ahead log + compacted snapshots (enabled with --data-dir)
+DATA_DIR = None
+GROUP_COMMIT_INTERVAL = 0.01  # seconds between WAL fsyncs; commits in between share one fsync and
+                              # are acknowledged once it is done
+SNAPSHOT_EVERY = 10000        # applied entries between compacted snapshots
+wal_file = None               # open WAL, None while persistence is off or recovery is running
+wal_buffer = []               # encoded entries applied but not yet written, guarded by log_lock
+wal_lock = threading.Lock()   # serializes WAL writes and rotation
+durable_seq = 0               # every entry up to this seq has been fsynced (WAL or snapshot)
+durable_cond = threading.Condition()  # notified whenever durable_seq moves
+durable_hooks = []            # called (no arguments, any thread) whenever durable_seq moves
+snapshot_seq = 0              # entries up to this seq live only in the snapshot
+
+# Catch-up
+LOG_PAGE_SIZE = 1000          # entries per /log?since_seq page
+
+# Replication wire format: leader -> follower traffic may use a compact binary
+# encoding (fixed-size entry records, account ids interned per message);
+# client endpoints stay JSON
+BINARY_TYPE = "application/x-dist-bank"
+WIRE = "binary"               # preferred encoding for replication we send (--wire)
+peer_wire = {}                # peer url -> True once it advertised binary support in a heartbeat
+BATCH_HEADER = struct.Struct("<4sqqqIII")      # magic, prev_seq, upto, commit_seq, entries, names len, txids len
+SNAPSHOT_HEADER = struct.Struct("<4sqqqIIII")  # magic, lamport, seq_counter, applied_seq, balances, entries, names len, txids len
+DEDUP_HEADER = struct.Struct("<II")            # after a DBS2 snapshot: compacted txids, their NUL-joined length
+ENTRY_RECORD = struct.Struct("<qqIIqB")        # seq, lamport, from index, to index, amount, flags
+BALANCE_RECORD = struct.Struct("<IqB")         # account index, balance, flags
+F_FLOAT = 1                   # the number field holds the bits of a double
+F_NO_TXID = 2                 # entry has no client_txid
+
+# Election / reconciliation fan-out
+ELECTION_DEADLINE = 2.0       # seconds for the whole probe + /election round
+RECONCILE_DEADLINE = 5.0      # seconds for a new leader to collect peer log suffixes
+fanout_pool = ThreadPoolExecutor(max_workers=32)
+peer_ids = {}                 # peer url -> node id, learned once from /status or /election
+last_election_seconds = None  # duration of this node's last election round
+leader_ready = threading.Event()  # set once a new leader has reconciled; writes wait for it
+reconcile_round = 0           # bumped (under log_lock) when a new leader starts or ends collecting
+                              # peer logs; fetches of an ended round may no longer touch state
 
 # Utility functions
 def increment_lamport(received=None):
@@ -47,51 +271,1047 @@ def increment_lamport(received=None):
             lamport = max(lamport, received) + 1
         return lamport
 
+def account_stripes(entry):
+    """Stripe locks covering both accounts of an entry, in acquisition order."""
+    i = hash(entry['from']) % N_LOCK_STRIPES
+    j = hash(entry['to']) % N_LOCK_STRIPES
+    if i == j:
+        return (account_locks[i],)
+    return (account_locks[min(i, j)], account_locks[max(i, j)])
+
 def apply_transaction_entry(entry):
-    """Apply an entry from log to balances (idempotent if applied once)."""
-    with balances_lock:
-        balances[entry['from']] -= entry['amount']
-        balances[entry['to']] += entry['amount']
+    """Apply an entry from log to balances under its accounts' stripe locks."""
+    locks = account_stripes(entry)
+    start = time.perf_counter()
+    for l in locks:
+        l.acquire()
+    metrics.observe("dist_bank_lock_wait_seconds", time.perf_counter() - start, "account_stripe")
+    try:
+        if cow_seq is not None and entry['seq'] > cow_seq:
+            # a snapshot is still reading the state as of cow_seq
+            for acct in (entry['from'], entry['to']):
+                if acct not in cow_saved:
+                    cow_saved[acct] = balances.get(acct)
+        balances.add(entry['from'], -entry['amount'])
+        balances.add(entry['to'], entry['amount'])
+    finally:
+        for l in reversed(locks):
+            l.release()
+
+def settle(e, ready):
+    """Advance the watermark over `e` and queue it for apply. Caller must hold log_lock."""
+    global applied_seq
+    transaction_log.append(e)
+    if wal_file is not None:
+        wal_buffer.append(json.dumps(e) + "\n")
+    applied_seq = e['seq']
+    ready.append(e)
+
+def mark_applying(ready):
+    """Record settled entries as in flight. Caller must hold log_lock."""
+    if ready:
+        with applying_cond:
+            applying.update(e['seq'] for e in ready)
+
+class SettledRun(list):
+    """Entries settled in one log_lock hold, with copies of their log columns (see extend_log)."""
+    def __init__(self, entries, columns):
+        super().__init__(entries)
+        self.columns = columns
+
+def apply_net(run):
+    """
+    Apply a long settled run as one grouped sum: each account it touches is
+    updated once, under its own stripe, instead of once per entry. A run is
+    settled in a single log_lock hold, so it lies wholly on one side of a
+    snapshot cut and the copy-on-write check is per run.
+    """
+    deltas = run.columns.net_deltas()
+    last_seq = run[-1]['seq']
+    names = balances.names
+    for i, delta in deltas.items():
+        acct = names[i]
+        with account_locks[hash(acct) % N_LOCK_STRIPES]:
+            if cow_seq is not None and last_seq > cow_seq and acct not in cow_saved:
+                cow_saved[acct] = balances.get(acct)
+            balances.add_at(i, delta)
+
+def apply_settled(ready):
+    """Apply entries settled under log_lock; runs without log_lock."""
+    try:
+        if isinstance(ready, SettledRun):
+            apply_net(ready)
+        else:
+            for e in ready:
+                apply_transaction_entry(e)
+    finally:
+        # even if an entry failed to apply: a seq left in applying would
+        # block every wait_applied() (snapshots, installs, reads) for good
+        with applying_cond:
+            applying.difference_update(e['seq'] for e in ready)
+            # also wakes readers waiting for a watermark that skipped a hole
+            applying_cond.notify_all()
+
+def wait_applied(seq):
+    """Block until every settled entry up to seq has reached balances."""
+    with applying_cond:
+        applying_cond.wait_for(lambda: all(s > seq for s in applying))
+
+def wait_for_seq(seq, timeout):
+    """Block until balances include every entry up to seq; False on timeout."""
+    with applying_cond:
+        return applying_cond.wait_for(lambda: applied_seq >= seq and all(s > seq for s in applying), timeout)
+
+def insert_log(entry):
+    """
+    Insert an entry by seq and settle the contiguous prefix. Duplicates (by
+    seq) are ignored in O(1); out-of-order entries wait in pending_entries
+    until every lower seq has arrived. Returns the entries to apply_settled(),
+    or None for a duplicate.
+    """
+    with log_lock:
+        seq = entry['seq']
+        if seq <= applied_seq or seq in pending_entries:
+            return None
+        if entry.get('client_txid') is not None:
+            txid_index[entry['client_txid']] = seq
+        pending_entries[seq] = entry
+        # advance the watermark over every entry that is now contiguous
+        ready = []
+        while applied_seq + 1 in pending_entries:
+            settle(pending_entries.pop(applied_seq + 1), ready)
+        mark_applying(ready)
+        return ready
 
 def append_log(entry):
+    """
+    Insert an entry and apply the contiguous prefix to balances. The log
+    bookkeeping runs under log_lock; balances are updated after it is
+    released, under per-account stripes. Returns True if the entry was new.
+    """
+    start = time.perf_counter()
+    ready = insert_log(entry)
+    if ready is None:
+        return False
+    apply_settled(ready)
+    metrics.observe("dist_bank_append_log_seconds", time.perf_counter() - start, "insert")
+    return True
+
+def extend_log(entries, upto=None):
+    """
+    Settle `entries` (sorted by seq) beyond the watermark as history: the
+    watermark moves to the last seq (or `upto`), so holes that no node could
+    supply are skipped. Caller must hold log_lock and apply_settled() the
+    returned entries after releasing it.
+    """
+    ready = []
+    first = len(transaction_log)
+    for e in entries:
+        if e['seq'] <= applied_seq:
+            continue
+        pending_entries.pop(e['seq'], None)
+        if e.get('client_txid') is not None:
+            txid_index[e['client_txid']] = e['seq']
+        settle(e, ready)
+    return settle_through(upto, ready, first)
+
+def settle_through(upto, ready, first):
+    """
+    Finish a settled run that starts at log position `first`: move the
+    watermark to `upto` (skipping holes), drop the pending entries it
+    covers, settle those that now continue it and mark the run applying.
+    Caller must hold log_lock.
+    """
+    global applied_seq
+    if upto is not None and upto > applied_seq:
+        applied_seq = upto
+    for seq in [s for s in pending_entries if s <= applied_seq]:
+        del pending_entries[seq]
+    # pending entries may now continue the settled prefix
+    while applied_seq + 1 in pending_entries:
+        settle(pending_entries.pop(applied_seq + 1), ready)
+    mark_applying(ready)
+    if len(ready) >= REPLAY_MIN_RUN:
+        # every settled entry was appended to the log: copy their columns (a
+        # memcpy) so apply_settled() can reduce them without log_lock
+        ready = SettledRun(ready, transaction_log.columns(first, len(transaction_log)))
+    return ready
+
+def prepare_suffix(entries):
+    """
+    Everything settling `entries` (sorted by seq, beyond the watermark) adds
+    to the log, built next to the live state without log_lock: their
+    ColumnarLog, WAL lines and client_txids. Settle it with adopt_suffix().
+    """
+    suffix = ColumnarLog(balances)
+    suffix.extend(entries)
+    lines = [json.dumps(e) + "\n" for e in entries] if wal_file is not None else None
+    txids = {e['client_txid']: e['seq'] for e in entries if e.get('client_txid') is not None}
+    return entries, suffix, lines, txids
+
+def adopt_suffix(prepared, upto=None):
+    """
+    extend_log() for a prepare_suffix() result: under the lock only arrays,
+    dicts and the WAL buffer are appended to. Falls back to extend_log() if
+    the watermark or persistence changed since. Caller must hold log_lock
+    and apply_settled() the returned entries after releasing it.
+    """
+    global applied_seq
+    entries, suffix, lines, txids = prepared
+    if entries and (entries[0]['seq'] <= applied_seq or (wal_file is not None) != (lines is not None)):
+        return extend_log(entries, upto)
+    first = len(transaction_log)
+    if pending_entries:
+        for seq in suffix.seqs:
+            pending_entries.pop(seq, None)
+    transaction_log.concat(suffix)
+    txid_index.update(txids)
+    if lines:
+        wal_buffer.extend(lines)
+    if entries:
+        applied_seq = entries[-1]['seq']
+    return settle_through(upto, list(entries), first)
+
+def hold_pending(entries):
+    """Queue new leader entries behind a gap still being merged (see reconcile). Caller must hold log_lock."""
+    for e in entries:
+        if e.get('client_txid') is not None:
+            txid_index[e['client_txid']] = e['seq']
+        pending_entries[e['seq']] = e
+    return []
+
+def install_log(log, txids, upto):
+    """
+    Replace the local log with `log`, a ColumnarLog built off-lock from a
+    leader snapshot whose balances already include everything up to `upto`,
+    and `txids` (client_txid -> seq) for its entries. Caller must hold
+    log_lock and balances_lock, and should take_snapshot() afterwards.
+    """
+    global applied_seq, snapshot_seq
+    transaction_log.adopt(log)
+    pending_entries.clear()
+    # txids of entries the leader's history doesn't have must not dedup retries
+    txid_index.clear()
+    txid_index.update(txids)
+    applied_seq = upto
+    snapshot_seq = log.seqs[0] - 1 if len(log) else upto
+
+def log_entries():
+    """Applied entries followed by pending ones, in seq order. Caller must hold log_lock."""
+    return transaction_log[:] + [pending_entries[s] for s in sorted(pending_entries)]
+
+def find_entry(seq):
+    """The settled or pending entry with this seq, or None. Caller must hold log_lock."""
+    e = pending_entries.get(seq)
+    return e if e is not None else transaction_log.find(seq)
+
+def log_range(since, limit):
+    """Up to `limit` entries with seq > since, in seq order. Caller must hold log_lock."""
+    i = transaction_log.position(since)
+    page = transaction_log[i:i + limit]
+    if len(page) < limit and pending_entries:
+        page += [pending_entries[s] for s in sorted(pending_entries) if s > since][:limit - len(page)]
+    return page
+
+def entry_key(e):
+    return (e['seq'], e.get('lamport'), e['from'], e['to'], e['amount'], e.get('client_txid'))
+
+def first_conflict(entries, prev_seq, upto):
+    """
+    Follower: the lowest seq in (prev_seq, upto] where the leader's entries
+    contradict what we already settled (a different transfer, or an entry on
+    one side only), or None. Entries compacted into our snapshot can't be
+    compared. Caller must hold log_lock.
+    """
+    lo, hi = max(prev_seq, snapshot_seq), min(upto, applied_seq)
+    if lo >= hi:
+        return None
+    theirs = [e for e in entries if lo < e['seq'] <= hi]
+    for mine, leaders in itertools.zip_longest(transaction_log.range(lo, hi), theirs):
+        if mine is None or leaders is None or entry_key(mine) != entry_key(leaders):
+            return min(e['seq'] for e in (mine, leaders) if e is not None)
+    return None
+
+def apply_batch(entries, prev_seq, upto):
+    """
+    Follower: apply a leader batch covering seqs (prev_seq, upto]. If it
+    continues our history only the missing suffix is applied, holes included;
+    otherwise the entries wait as pending and the leader rewinds to our
+    watermark on its next send. Returns (watermark, conflict): conflict is
+    the first seq where our settled history differs from the leader's (see
+    first_conflict), in which case nothing is applied and the leader has to
+    send a snapshot.
+    """
+    start = time.perf_counter()
+    with log_lock:
+        if prev_seq <= applied_seq:
+            conflict = first_conflict(entries, prev_seq, upto)
+            if conflict is not None:
+                return applied_seq, conflict
+            ready = extend_log(entries, upto)
+            watermark = applied_seq
+        else:
+            ready = None
+    if ready is not None:
+        apply_settled(ready)
+        if ready:
+            metrics.observe("dist_bank_append_log_seconds", time.perf_counter() - start, "extend")
+        return watermark, None
+    for e in entries:
+        append_log(e)
+    return applied_seq, None
+
+def install_snapshot(data, rnd=None):
+    """
+    Replace local state with a leader snapshot (see get_state_snapshot).
+    A snapshot fetched for reconcile round `rnd` is refused (False) once
+    that round has ended.
+    """
+    global lamport, seq_counter
+    with lamport_lock:
+        lamport = max(lamport, data.get("lamport", 0)) + 1
+    incoming_log = data.get("log", [])
+    incoming_bal = data.get("balances", {})
+    upto = data.get("applied_seq", incoming_log[-1]["seq"] if incoming_log else 0)
+    # build the new state next to the live one; writers are blocked only for the swap
+    log = ColumnarLog(balances)
+    log.extend(incoming_log)
+    txids = dict(data.get("txids", {}))
+    txids.update((e['client_txid'], e['seq']) for e in incoming_log if e.get('client_txid') is not None)
+    prepared = balances.prepare(incoming_bal)
     with log_lock:
-        # prevent duplicates by seq
-        existing = next((e for e in transaction_log if e['seq'] == entry['seq']), None)
-        if existing is None:
-            transaction_log.append(entry)
-            transaction_log.sort(key=lambda e: e['seq'])
-            apply_transaction_entry(entry)
+        if rnd is not None and rnd != reconcile_round:
+            return False
+        # settled entries still in flight would land on top of the new balances
+        wait_applied(applied_seq)
+        with balances_lock:
+            install_log(log, txids, upto)
+            balances.swap(prepared)
+    seq_counter = max(seq_counter, data.get("seq_counter", 0))
+    if wal_file is not None:
+        # the WAL no longer describes this history: persist the new base
+        take_snapshot()
+    return True
+
+def time_left(deadline, default):
+    """Timeout for one request: what remains of deadline (default without one)."""
+    if deadline is None:
+        return default
+    left = deadline - time.time()
+    if left <= 0:
+        raise TimeoutError("deadline passed")
+    return left
+
+def fetch_log_suffix(peer, since, deadline=None, rnd=None):
+    """
+    Page through peer's /log after `since`, every request bounded by what
+    remains of the deadline. If that range is already compacted on the
+    peer, install its snapshot (for reconcile round `rnd`) first and
+    continue from it. Returns (entries, info of the last page).
+    """
+    entries = []
+    while True:
+        info = requests.get(peer + "/log", params={"since_seq": since, "limit": LOG_PAGE_SIZE},
+                            timeout=time_left(deadline, 1.0)).json()
+        if info.get("compacted"):
+            r = requests.get(peer + "/snapshot", headers={"Accept": BINARY_TYPE + ", application/json"},
+                             timeout=time_left(deadline, 5.0))
+            if not install_snapshot(decode_body(r.headers.get("Content-Type", ""), r.content, decode_snapshot), rnd):
+                raise TimeoutError(f"reconcile round {rnd} ended")
+            since = max(since, applied_seq)
+            continue
+        page = info.get("log", [])
+        entries.extend(page)
+        if not info.get("more") or not page:
+            return entries, info
+        since = page[-1]["seq"]
+
+def transfer_error(tx):
+    """Why a client transfer is malformed, or None. Checked before it takes a seq."""
+    if not isinstance(tx, dict):
+        return "transfer must be an object"
+    for k in ('from', 'to'):
+        if type(tx.get(k)) is not str:
+            return f"'{k}' must be an account name"
+    if type(tx.get('amount')) not in (int, float):
+        return "'amount' must be a number"
+    txid = tx.get('client_txid')
+    if txid is not None and type(txid) is not str:
+        return "'client_txid' must be a string"
+    return None
+
+def batch_error(data):
+    """Why a /transactions body is malformed, or None (the transfers are checked by leader_commit_batch)."""
+    if not isinstance(data, dict):
+        return "body must be an object"
+    if not isinstance(data.get("transactions", []), list):
+        return "'transactions' must be a list"
+    return None
+
+def leader_commit(data):
+    """
+    Leader only: assign the next seq to a client transfer and apply it.
+    A retry carrying an already committed client_txid gets the original
+    entry back instead of a new seq. Returns (entry, is_new); ValueError
+    for a malformed transfer, before any seq is taken (a skipped seq would
+    hold the watermark back for good).
+    """
+    global seq_counter
+    error = transfer_error(data)
+    if error is not None:
+        raise ValueError(error)
+    start = time.perf_counter()
+    txid = data.get('client_txid')
+    with seq_lock:
+        if txid is not None:
+            with log_lock:
+                seq = txid_index.get(txid)
+                if seq is not None:
+                    # compacted entries survive only as their seq
+                    return find_entry(seq) or {"seq": seq, "client_txid": txid}, False
+        seq = seq_counter
+        seq_counter += 1
+        entry = {
+            "seq": seq,
+            "lamport": increment_lamport(),
+            "from": data['from'],
+            "to": data['to'],
+            "amount": data['amount'],
+            "client_txid": txid
+        }
+        append_start = time.perf_counter()
+        ready = insert_log(entry)
+    # apply locally outside seq_lock, so transfers on disjoint accounts run in parallel
+    apply_settled(ready)
+    metrics.observe("dist_bank_append_log_seconds", time.perf_counter() - append_start, "insert")
+    metrics.inc("dist_bank_transactions_committed_total", 1, "single")
+    metrics.observe("dist_bank_commit_seconds", time.perf_counter() - start, "single")
+    return entry, True
+
+def leader_commit_batch(txs):
+    """
+    Leader only: assign one contiguous seq range to a batch of client
+    transfers and settle it in a single log_lock hold, so snapshots and
+    replication see all of it or none. Transfers whose client_txid is
+    already committed (or repeated within the batch) get the original entry
+    back. Returns (entries in request order, number newly committed);
+    ValueError if any transfer is malformed, before any seq is taken.
+    """
+    global seq_counter
+    if not isinstance(txs, list):
+        raise ValueError("'transactions' must be a list")
+    for i, tx in enumerate(txs):
+        error = transfer_error(tx)
+        if error is not None:
+            raise ValueError(f"transaction {i}: {error}")
+    start = time.perf_counter()
+    results = []
+    fresh = []
+    with seq_lock:
+        lc = increment_lamport()  # one event for the whole batch
+        with log_lock:
+            in_batch = {}
+            for tx in txs:
+                txid = tx.get('client_txid')
+                if txid is not None:
+                    seq = txid_index.get(txid)
+                    if seq is not None:
+                        results.append(find_entry(seq) or {"seq": seq, "client_txid": txid})
+                        continue
+                    if txid in in_batch:
+                        results.append(in_batch[txid])
+                        continue
+                entry = {
+                    "seq": seq_counter,
+                    "lamport": lc,
+                    "from": tx['from'],
+                    "to": tx['to'],
+                    "amount": tx['amount'],
+                    "client_txid": txid
+                }
+                seq_counter += 1
+                if txid is not None:
+                    in_batch[txid] = entry
+                fresh.append(entry)
+                results.append(entry)
+            append_start = time.perf_counter()
+            if fresh and fresh[0]['seq'] > applied_seq + 1:
+                # seqs before ours are still being merged: extend_log would skip them as holes
+                ready = hold_pending(fresh)
+            else:
+                ready = extend_log(fresh)
+            if len(fresh) > 1:
+                batch_starts.append(fresh[0]['seq'])
+                batch_ends.append(fresh[-1]['seq'])
+    apply_settled(ready)
+    if fresh:
+        metrics.observe("dist_bank_append_log_seconds", time.perf_counter() - append_start, "extend")
+        metrics.inc("dist_bank_transactions_committed_total", len(fresh), "batch")
+        metrics.observe("dist_bank_commit_seconds", time.perf_counter() - start, "batch")
+    return results, len(fresh)
+
+def note_peer_wire(peer, beat):
+    """Remember whether a peer accepts binary replication, from its heartbeat reply."""
+    peer_wire[peer] = "binary" in beat.get("wire", ())
+
+def binary_peer(peer):
+    return WIRE == "binary" and peer_wire.get(peer, False)
+
+def pack_number(v):
+    """(int64 bits, flags) for an int or float; ValueError if it does not fit."""
+    if type(v) is int:
+        return v, 0
+    if type(v) is float:
+        return struct.unpack("<q", struct.pack("<d", v))[0], F_FLOAT
+    raise ValueError(f"not a number: {v!r}")
+
+def unpack_number(bits, flags):
+    return struct.unpack("<d", struct.pack("<q", bits))[0] if flags & F_FLOAT else bits
+
+def intern_name(names, name):
+    """Index of name in the message's string table (a dict in insertion order)."""
+    i = names.get(name)
+    if i is None:
+        if type(name) is not str or "\0" in name:
+            raise ValueError(f"cannot intern {name!r}")
+        i = names[name] = len(names)
+    return i
+
+def encode_entries(entries, names):
+    """Entry records plus the NUL-joined client_txids, in entry order."""
+    records = []
+    txids = []
+    for e in entries:
+        if len(e) != 6:
+            raise ValueError("unexpected entry fields")
+        bits, flags = pack_number(e['amount'])
+        txid = e['client_txid']
+        if txid is None:
+            flags |= F_NO_TXID
+        elif type(txid) is not str or "\0" in txid:
+            raise ValueError(f"cannot encode client_txid {txid!r}")
+        else:
+            txids.append(txid)
+        records.append(ENTRY_RECORD.pack(e['seq'], e['lamport'], intern_name(names, e['from']),
+                                         intern_name(names, e['to']), bits, flags))
+    return b"".join(records), "\0".join(txids).encode()
+
+def decode_entries(records, names, txids):
+    txids = iter(txids.decode().split("\0"))
+    return [{"seq": seq, "lamport": lc, "from": names[fi], "to": names[ti],
+             "amount": unpack_number(bits, flags) if flags & F_FLOAT else bits,
+             "client_txid": None if flags & F_NO_TXID else next(txids)}
+            for seq, lc, fi, ti, bits, flags in ENTRY_RECORD.iter_unpack(records)]
+
+def encode_batch(payload):
+    """Binary /commit_batch body, or None if some entry does not fit the layout (sent as JSON)."""
+    try:
+        names = {}
+        records, txids = encode_entries(payload["entries"], names)
+        table = "\0".join(names).encode()
+        header = BATCH_HEADER.pack(b"DBB1", payload["prev_seq"], payload["upto"], payload["commit_seq"],
+                                   len(payload["entries"]), len(table), len(txids))
+        return b"".join((header, table, records, txids))
+    except (KeyError, TypeError, ValueError, struct.error):
+        return None
+
+def decode_batch(body):
+    magic, prev_seq, upto, commit_seq, n, table_len, txids_len = BATCH_HEADER.unpack_from(body)
+    if magic != b"DBB1":
+        raise ValueError("not a dist_bank batch")
+    o = BATCH_HEADER.size
+    names = body[o:o + table_len].decode().split("\0")
+    o += table_len
+    end = o + n * ENTRY_RECORD.size
+    entries = decode_entries(body[o:end], names, body[end:end + txids_len])
+    return {"entries": entries, "prev_seq": prev_seq, "upto": upto, "commit_seq": commit_seq}
+
+def encode_snapshot(snap):
+    """Binary form of get_state_snapshot(), or None if it does not fit the layout."""
+    try:
+        names = {}
+        bal = [BALANCE_RECORD.pack(intern_name(names, k), *pack_number(v)) for k, v in snap["balances"].items()]
+        records, txids = encode_entries(snap["log"], names)
+        table = "\0".join(names).encode()
+        dedup = snap.get("txids", {})
+        if any(type(t) is not str or "\0" in t for t in dedup):
+            return None
+        dedup_names = "\0".join(dedup).encode()
+        header = SNAPSHOT_HEADER.pack(b"DBS2", snap["lamport"], snap["seq_counter"], snap["applied_seq"],
+                                      len(bal), len(snap["log"]), len(table), len(txids))
+        return b"".join([header, table] + bal + [records, txids, DEDUP_HEADER.pack(len(dedup), len(dedup_names)),
+                                                 dedup_names, array("q", dedup.values()).tobytes()])
+    except (KeyError, TypeError, ValueError, struct.error):
+        return None
+
+def decode_snapshot(body):
+    magic, lc, counter, upto, n_bal, n, table_len, txids_len = SNAPSHOT_HEADER.unpack_from(body)
+    if magic not in (b"DBS1", b"DBS2"):
+        raise ValueError("not a dist_bank snapshot")
+    o = SNAPSHOT_HEADER.size
+    names = body[o:o + table_len].decode().split("\0")
+    o += table_len
+    end = o + n_bal * BALANCE_RECORD.size
+    bal = {names[i]: unpack_number(bits, flags) for i, bits, flags in BALANCE_RECORD.iter_unpack(body[o:end])}
+    o, end = end, end + n * ENTRY_RECORD.size
+    log = decode_entries(body[o:end], names, body[end:end + txids_len])
+    dedup = {}
+    if magic == b"DBS2":
+        # DBS1 (older nodes) has no compacted txids
+        o = end + txids_len
+        n_dedup, dedup_len = DEDUP_HEADER.unpack_from(body, o)
+        o += DEDUP_HEADER.size
+        seqs = array("q")
+        seqs.frombytes(body[o + dedup_len:o + dedup_len + 8 * n_dedup])
+        if n_dedup:
+            dedup = dict(zip(body[o:o + dedup_len].decode().split("\0"), seqs))
+    return {"log": log, "balances": bal, "lamport": lc, "seq_counter": counter, "applied_seq": upto, "txids": dedup}
+
+def decode_body(content_type, body, decode):
+    """Replication body sent either as BINARY_TYPE or JSON."""
+    if content_type.split(";")[0].strip() == BINARY_TYPE:
+        return decode(body)
+    return json.loads(body)
 
 def broadcast_commit(entry):
-    """Leader tells all peers to commit this entry."""
+    """Leader tells all peers to commit this entry: wakes the replication pipeline."""
+    with repl_cond:
+        repl_cond.notify_all()
+
+class Replicator:
+    """
+    Streams committed entries to one follower over a persistent Session.
+    Entries are read straight from transaction_log after match_index, so a slow
+    follower only delays itself; batches are cut by size or time window.
+    """
+    def __init__(self, peer, match_index):
+        self.peer = peer
+        self.match_index = match_index  # highest seq the follower has acknowledged
+        self.diverged = False           # follower holds history we don't: it needs a snapshot
+        self.session = requests.Session()
+
+    def post(self, path, payload, encode, timeout):
+        """POST a replication payload, binary if the follower supports it and the payload fits."""
+        body = encode(payload) if binary_peer(self.peer) else None
+        if body is None:
+            return self.session.post(self.peer + path, json=payload, timeout=timeout)
+        return self.session.post(self.peer + path, data=body, headers={"Content-Type": BINARY_TYPE}, timeout=timeout)
+
+    def active(self):
+        return IS_LEADER and replicators.get(self.peer) is self
+
+    def acked(self, sent_at, watermark, conflict=None):
+        """Record a /commit_batch answer; a follower that missed entries answers
+        with a lower watermark and is resent from there. One that reports a
+        conflict, or a watermark past ours (entries from a deposed leader),
+        can't be patched entry by entry and gets a snapshot next."""
+        metrics.observe("dist_bank_replication_batch_seconds", time.perf_counter() - sent_at, self.peer)
+        if conflict is not None or watermark > applied_seq:
+            self.diverged = True
+            watermark = min(watermark, applied_seq)
+        metrics.inc("dist_bank_replication_entries_total", max(0, watermark - self.match_index), self.peer)
+        self.match_index = watermark
+
+    def needs_snapshot(self):
+        """The follower is behind our compacted prefix, or its history diverged from ours."""
+        return self.diverged or self.match_index < snapshot_seq
+
+    def next_batch(self):
+        """Entries after match_index (up to REPL_BATCH_SIZE) and the last seq they cover."""
+        with log_lock:
+            hi = min(applied_seq, self.match_index + REPL_BATCH_SIZE)
+            # a client batch is replicated as one unit
+            i = bisect.bisect_right(batch_starts, hi) - 1
+            if i >= 0 and batch_ends[i] > hi:
+                hi = min(applied_seq, batch_ends[i])
+            batch = transaction_log.range(self.match_index, hi)
+        return batch, hi
+
+    def run(self):
+        while self.active():
+            with repl_cond:
+                if applied_seq <= self.match_index:
+                    repl_cond.wait(timeout=HEARTBEAT_INTERVAL)
+                    continue
+            if applied_seq - self.match_index < REPL_BATCH_SIZE:
+                # let concurrent commits join this batch
+                time.sleep(REPL_BATCH_WINDOW)
+            if self.needs_snapshot():
+                # ship a full snapshot: it replaces the follower's log and balances
+                snapshot = get_state_snapshot()
+                try:
+                    r = self.post("/sync_state", snapshot, encode_snapshot, 5.0)
+                    if r.status_code == 200:
+                        self.match_index = snapshot["applied_seq"]
+                        self.diverged = False
+                        continue
+                except Exception:
+                    pass
+                time.sleep(REPL_RETRY_DELAY)
+                continue
+            batch, hi = self.next_batch()
+            try:
+                # an empty batch still tells the follower that (match_index, hi] are settled holes
+                payload = {"entries": batch, "prev_seq": self.match_index, "upto": hi, "commit_seq": applied_seq}
+                start = time.perf_counter()
+                r = self.post("/commit_batch", payload, encode_batch, 1.0)
+                if r.status_code == 200:
+                    jd = r.json()
+                    self.acked(start, jd.get("applied_seq", hi), jd.get("conflict"))
+                    continue
+            except Exception:
+                pass
+            time.sleep(REPL_RETRY_DELAY)
+        self.session.close()
+
+def start_replication(match_indexes):
+    """Leader: start one Replicator per follower from its reported watermark."""
     for p in PEERS:
-        try:
-            requests.post(p + "/commit", json=entry, timeout=1.0)
-        except Exception:
-            pass
+        r = Replicator(p, match_indexes.get(p, applied_seq))
+        replicators[p] = r
+        threading.Thread(target=r.run, daemon=True).start()
+
+def balances_snapshot(at_cut=None):
+    """
+    Versioned read of balances without stopping writers. Returns
+    (seq, balances as of seq, at_cut()); at_cut runs under log_lock at the
+    cut point. While the copy runs, entries settled after the cut save the
+    old value of each account they touch first (copy-on-write).
+    """
+    global cow_seq, cow_saved
+    with snapshot_lock:
+        with log_lock:
+            seq = applied_seq
+            cow_saved = {}
+            cow_seq = seq
+            extra = at_cut() if at_cut else None
+        # only entries already in flight at the cut are waited for
+        wait_applied(seq)
+        out = {}
+        for acct in list(balances):
+            with account_locks[hash(acct) % N_LOCK_STRIPES]:
+                v = cow_saved[acct] if acct in cow_saved else balances[acct]
+            if v is not None:
+                out[acct] = v
+        with log_lock:
+            cow_seq = None
+            cow_saved = {}
+    return seq, out, extra
 
 def get_state_snapshot():
-    with log_lock, balances_lock, lamport_lock:
-        return {
-            "log": list(transaction_log),
-            "balances": dict(balances),
-            "lamport": lamport,
-            "seq_counter": seq_counter
+    seq, bal, _ = balances_snapshot()
+    with log_lock:
+        log = transaction_log[:transaction_log.position(seq)]
+    with lamport_lock:
+        lc = lamport
+    # client_txids of the compacted prefix: the log no longer carries them,
+    # and a follower without them would apply a retried transfer again
+    first = log[0]['seq'] if log else seq + 1
+    return {
+        "log": log,
+        "balances": bal,
+        "lamport": lc,
+        "seq_counter": seq_counter,
+        "applied_seq": seq,
+        "txids": {t: s for t, s in list(txid_index.items()) if s < first}
+    }
+
+# Durability functions
+
+def wal_path():
+    return os.path.join(DATA_DIR, f"node{NODE_ID}.wal")
+
+def snapshot_path():
+    return os.path.join(DATA_DIR, f"node{NODE_ID}.snapshot.json")
+
+def swap_wal_buffer():
+    """Take the buffered WAL lines. Caller must hold log_lock."""
+    global wal_buffer
+    lines, wal_buffer = wal_buffer, []
+    return lines
+
+def mark_durable(seq):
+    """Entries up to seq are on disk: release the commits waiting for them."""
+    global durable_seq
+    with durable_cond:
+        if seq <= durable_seq:
+            return
+        durable_seq = seq
+        durable_cond.notify_all()
+    for hook in durable_hooks:
+        hook()
+
+def wait_durable(seq):
+    """Block until the entry with this seq is fsynced; returns at once when persistence is off."""
+    if wal_file is None:
+        return
+    with durable_cond:
+        durable_cond.wait_for(lambda: durable_seq >= seq or wal_file is None)
+
+def flush_wal():
+    """Write and fsync every entry buffered since the last flush (one fsync per group)."""
+    with wal_lock:
+        with log_lock:
+            lines = swap_wal_buffer()
+            # the buffer holds every settled entry not yet written
+            seq = applied_seq
+        if lines and wal_file is not None:
+            wal_file.write("".join(lines))
+            wal_file.flush()
+            os.fsync(wal_file.fileno())
+        mark_durable(seq)
+
+def take_snapshot():
+    """
+    Persist balances + last applied seq, start a fresh WAL and drop the
+    compacted prefix from memory. Balances come from a copy-on-write read,
+    so writers keep going while the snapshot is taken.
+    """
+    global wal_file, snapshot_seq
+    with wal_lock:
+        # WAL lines buffered at the cut are exactly the entries up to its seq
+        seq, bal, lines = balances_snapshot(at_cut=swap_wal_buffer)
+        with lamport_lock:
+            lc = lamport
+        state = {
+            "applied_seq": seq,
+            "balances": bal,
+            "lamport": lc,
+            "seq_counter": seq_counter,
+            "txids": {t: s for t, s in list(txid_index.items()) if s <= seq}
         }
+        # finish the old WAL, keep it until the snapshot covering it is durable
+        wal_file.write("".join(lines))
+        wal_file.flush()
+        os.fsync(wal_file.fileno())
+        mark_durable(seq)
+        wal_file.close()
+        os.replace(wal_path(), wal_path() + ".old")
+        wal_file = open(wal_path(), "a")
+        tmp = snapshot_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, snapshot_path())
+        os.remove(wal_path() + ".old")
+    # compact the in-memory log
+    with log_lock:
+        del transaction_log[:transaction_log.position(state["applied_seq"])]
+        snapshot_seq = max(snapshot_seq, state["applied_seq"])
+        prune_txids(snapshot_seq - TXID_WINDOW)
+        k = bisect.bisect_right(batch_ends, snapshot_seq)
+        del batch_starts[:k], batch_ends[:k]
 
-# Flask endpoints
+def prune_txids(upto):
+    """
+    Forget the client_txids of entries up to seq `upto`. txid_index is filled
+    in settle order, i.e. roughly by seq, so this stops at the first newer
+    txid instead of scanning the whole window. Caller must hold log_lock.
+    """
+    stale = list(itertools.takewhile(lambda t: txid_index[t] <= upto, txid_index))
+    for t in stale:
+        del txid_index[t]
 
-@app.route("/status", methods=["GET"])
-def status():
-    return jsonify({
+def recover_local_state():
+    """
+    Load the last snapshot and replay the WAL tail after it, so recovery time
+    depends on the tail, not the full history. The tail is settled in one
+    pass and applied as per-account net deltas. A node with no saved state
+    starts from the demo accounts.
+    """
+    global applied_seq, snapshot_seq, lamport, seq_counter, wal_file
+    found = False
+    if os.path.exists(snapshot_path()):
+        with open(snapshot_path()) as f:
+            snap = json.load(f)
+        balances.swap(balances.prepare(snap["balances"]))
+        txid_index.update(snap["txids"])
+        applied_seq = snapshot_seq = snap["applied_seq"]
+        lamport = snap["lamport"]
+        seq_counter = snap["seq_counter"]
+        found = True
+    tail = []
+    for path in (wal_path() + ".old", wal_path()):
+        if not os.path.exists(path):
+            continue
+        found = True
+        with open(path) as f:
+            for line in f:
+                try:
+                    tail.append(json.loads(line))
+                except ValueError:
+                    break  # torn write at the tail
+    # WAL lines are in settle order, i.e. by seq; entries the snapshot already covers are skipped
+    with log_lock:
+        ready = extend_log(tail)
+    apply_settled(ready)
+    replayed = len(ready)
+    lamport = max([lamport] + [e.get("lamport", 0) for e in ready])
+    if not found:
+        seed_demo_accounts()
+    wal_file = open(wal_path(), "a")
+    print(f"[{NODE_ID}] Recovered applied_seq={applied_seq} (snapshot {snapshot_seq} + {replayed} WAL entries)")
+    # fold the replayed tail into a fresh snapshot
+    take_snapshot()
+
+def wal_flusher():
+    """Group commit loop: flush the WAL every GROUP_COMMIT_INTERVAL and snapshot periodically."""
+    while True:
+        time.sleep(GROUP_COMMIT_INTERVAL)
+        flush_wal()
+        if applied_seq - snapshot_seq >= SNAPSHOT_EVERY:
+            take_snapshot()
+
+# Endpoint bodies shared by the Flask app and the asyncio mode (dist_bank_async.py)
+
+def heartbeat_payload():
+    """Minimal liveness info; O(1) regardless of account count or log size."""
+    return {"id": NODE_ID, "leader": LEADER, "is_leader": IS_LEADER, "applied_seq": applied_seq,
+            "wire": ["binary", "json"]}
+
+def note_leader_progress(leader_seq):
+    """Follower: remember when we last held everything the leader had committed."""
+    global caught_up_at
+    if applied_seq >= leader_seq:
+        caught_up_at = time.time()
+
+def renew_lease(round_start, replies):
+    """
+    Leader: a heartbeat round started at round_start got these follower
+    replies (heartbeat payloads). Only followers that still name us as
+    their leader count: one that moved on to a newer leader must not keep
+    a deposed leader's lease alive.
+    """
+    global lease_until
+    acks = sum(1 for beat in replies if beat.get("leader") == LEADER)
+    if 2 * (acks + 1) > len(PEERS) + 1:
+        lease_until = round_start + LEASE_DURATION
+
+def hold_lease_reads():
+    """
+    New leader, once announced: until now followers may still have acked
+    the previous leader, whose lease then runs for up to LEASE_DURATION
+    more. Serve no lease read before that.
+    """
+    global reads_from
+    reads_from = time.time() + LEASE_DURATION
+
+def lease_valid():
+    return IS_LEADER and leader_ready.is_set() and reads_from <= time.time() < lease_until
+
+def read_index_payload():
+    """Leader: the commit seq a linearizable read must observe, only while the lease holds."""
+    if not IS_LEADER:
+        return {"error": "not_leader", "leader": LEADER}, 503
+    if not lease_valid():
+        return {"error": "no_lease", "leader": LEADER}, 503
+    # the last seq handed out, not the watermark: a new leader may still be
+    # settling merged history behind writes it already accepted
+    return {"seq": seq_counter - 1, "lease_remaining": lease_until - time.time()}, 200
+
+def read_staleness():
+    """Upper bound (seconds) on how far this node's state may trail the leader."""
+    return 0.0 if IS_LEADER else time.time() - caught_up_at
+
+def read_balance(acct, min_seq=0, max_staleness=None):
+    """
+    Serve one account from local state. Waits up to READ_WAIT for the
+    watermark to reach min_seq, and refuses if this node may be more than
+    max_staleness seconds behind the leader. Returns (payload, http status).
+    """
+    if min_seq and not wait_for_seq(min_seq, READ_WAIT):
+        return {"error": "behind", "applied_seq": applied_seq, "leader": LEADER}, 503
+    staleness = read_staleness()
+    if max_staleness is not None and staleness > max_staleness:
+        return {"error": "stale", "staleness": staleness, "leader": LEADER}, 503
+    seq = applied_seq
+    with account_locks[hash(acct) % N_LOCK_STRIPES]:
+        if acct not in balances:
+            return {"error": "not_found", "account": acct}, 404
+        bal = balances[acct]
+    return {"account": acct, "balance": bal, "applied_seq": seq, "staleness": staleness}, 200
+
+def record_heartbeat(data):
+    """Follower: note a leader heartbeat. Touches neither the log nor balances."""
+    global LEADER, last_leader_heartbeat
+    if LEADER is None and not IS_LEADER:
+        # e.g. a restarted node that missed the coordinator message
+        LEADER = data.get("leader")
+    if data.get("leader") == LEADER:
+        last_leader_heartbeat = time.time()
+        note_leader_progress(data.get("applied_seq", 0))
+
+def record_forward(start, n, outcome):
+    metrics.inc("dist_bank_transactions_forwarded_total", n, outcome)
+    metrics.observe("dist_bank_forward_seconds", time.perf_counter() - start)
+
+def record_election(started, won):
+    """Note the end of an election round started at `started` (wall clock)."""
+    global last_election_seconds
+    last_election_seconds = time.time() - started
+    metrics.inc("dist_bank_elections_total", 1, "won" if won else "deferred")
+    metrics.observe("dist_bank_election_seconds", last_election_seconds)
+    return last_election_seconds
+
+def replication_lag():
+    """Leader: entries each follower still has to acknowledge."""
+    if not IS_LEADER:
+        return {}
+    return {p: max(0, applied_seq - r.match_index) for p, r in list(replicators.items())}
+
+metrics.gauge("dist_bank_replication_lag_entries", "Committed entries not yet acknowledged by a follower",
+              replication_lag, label="follower")
+metrics.gauge("dist_bank_applied_seq", "Local watermark: every seq up to it is applied", lambda: applied_seq)
+metrics.gauge("dist_bank_pending_entries", "Entries waiting behind a gap", lambda: len(pending_entries))
+metrics.gauge("dist_bank_is_leader", "1 while this node is leader", lambda: int(IS_LEADER))
+metrics.gauge("dist_bank_read_staleness_seconds", "Upper bound on how far local reads trail the leader",
+              read_staleness)
+
+def status_payload():
+    return {
         "id": NODE_ID,
         "port": PORT,
         "is_leader": IS_LEADER,
         "leader": LEADER,
         "lamport": lamport,
         "seq_counter": seq_counter,
+        "applied_seq": applied_seq,
+        "match_index": {p: r.match_index for p, r in replicators.items()} if IS_LEADER else {},
+        "last_election_seconds": last_election_seconds,
         "balances": dict(balances)
-    })
+    }
+
+def log_payload(since=None, limit=LOG_PAGE_SIZE):
+    """
+    Local log and lamport; used by new leader to collect logs. With since
+    only entries after it are returned, at most `limit` per page; "more"
+    means ask again from the last seq returned.
+    """
+    with log_lock, lamport_lock:
+        if since is None:
+            return {"log": log_entries(), "lamport": lamport, "seq_counter": seq_counter}
+        if since < snapshot_seq:
+            # range no longer held in memory: caller needs /snapshot
+            return {"compacted": True, "snapshot_seq": snapshot_seq, "applied_seq": applied_seq}
+        page = log_range(since, limit)
+        return {
+            "log": page,
+            "more": len(page) == limit,
+            "applied_seq": applied_seq,
+            "lamport": lamport,
+            "seq_counter": seq_counter
+        }
+
+# Flask endpoints
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+@app.route("/status", methods=["GET"])
+def status():
+    return jsonify(status_payload())
 
 @app.route("/transaction", methods=["POST"])
 def transaction():
@@ -100,32 +1320,35 @@ def transaction():
     If leader: assign seq, lamport, commit and broadcast.
     If follower: forward to leader (if known) or start election.
     """
-    global seq_counter
     data = request.get_json()
-    increment_lamport()
     if IS_LEADER:
-        with seq_lock:
-            seq = seq_counter
-            seq_counter += 1
-        entry = {
-            "seq": seq,
-            "lamport": lamport,
-            "from": data['from'],
-            "to": data['to'],
-            "amount": data['amount'],
-            "client_txid": data.get('client_txid')
-        }
-        append_log(entry)  # apply locally
-        # broadcast to followers
-        threading.Thread(target=broadcast_commit, args=(entry,)).start()
+        if not leader_ready.is_set():
+            # still merging peers' logs: a seq handed out now could collide with theirs
+            return jsonify({"status":"reconciling","message":"new leader not ready, retry"}), 503
+        try:
+            entry, is_new = leader_commit(data)
+        except ValueError as e:
+            return jsonify({"status":"rejected","message":str(e)}), 400
+        if is_new:
+            # broadcast to followers
+            broadcast_commit(entry)
+        # acknowledge only once the entry is on disk (group commit)
+        wait_durable(entry['seq'])
+        if not is_new:
+            # client retry: already committed and replicated
+            return jsonify({"status":"committed","entry":entry,"duplicate":True}), 200
         return jsonify({"status":"committed","entry":entry}), 200
     else:
+        increment_lamport()
         if LEADER:
             try:
                 # forward to leader
-                r = requests.post(LEADER + "/transaction", json=data, timeout=2.0)
+                start = time.perf_counter()
+                r = leader_session.post(LEADER + "/transaction", json=data, timeout=2.0)
+                record_forward(start, 1, "ok")
                 return (r.text, r.status_code, r.headers.items())
             except Exception:
+                metrics.inc("dist_bank_transactions_forwarded_total", 1, "error")
                 # can't reach leader: trigger election
                 threading.Thread(target=start_election).start()
                 return jsonify({"status":"leader_unreachable","message":"starting election"}), 503
@@ -134,10 +1357,51 @@ def transaction():
             threading.Thread(target=start_election).start()
             return jsonify({"status":"no_leader","message":"starting election"}), 503
 
+@app.route("/transactions", methods=["POST"])
+def transactions():
+    """
+    Client posts a batch: {"transactions": [{from, to, amount, client_txid}, ...]}
+    If leader: commit the whole batch under one contiguous seq range.
+    If follower: forward the batch to the leader in one request.
+    """
+    data = request.get_json()
+    error = batch_error(data)
+    if error is not None:
+        return jsonify({"status":"rejected","message":error}), 400
+    if IS_LEADER:
+        if not leader_ready.is_set():
+            # still merging peers' logs: a seq handed out now could collide with theirs
+            return jsonify({"status":"reconciling","message":"new leader not ready, retry"}), 503
+        try:
+            entries, committed = leader_commit_batch(data.get("transactions", []))
+        except ValueError as e:
+            return jsonify({"status":"rejected","message":str(e)}), 400
+        if committed:
+            broadcast_commit(entries[-1])
+        if entries:
+            wait_durable(max(e['seq'] for e in entries))
+        return jsonify({"status":"committed","entries":entries,"committed":committed}), 200
+    increment_lamport()
+    if LEADER:
+        try:
+            start = time.perf_counter()
+            r = leader_session.post(LEADER + "/transactions", json=data, timeout=10.0)
+            record_forward(start, len(data.get("transactions", [])), "ok")
+            return (r.text, r.status_code, r.headers.items())
+        except Exception:
+            metrics.inc("dist_bank_transactions_forwarded_total", len(data.get("transactions", [])), "error")
+            threading.Thread(target=start_election).start()
+            return jsonify({"status":"leader_unreachable","message":"starting election"}), 503
+    threading.Thread(target=start_election).start()
+    return jsonify({"status":"no_leader","message":"starting election"}), 503
+
 @app.route("/commit", methods=["POST"])
 def commit():
     """Follower receives commit from leader."""
     entry = request.get_json()
+    error = transfer_error(entry)
+    if error is not None or type(entry.get("seq")) is not int:
+        return jsonify({"status":"rejected","message":error or "'seq' must be an integer"}), 400
     # update lamport with leader's lamport stamp
     increment_lamport(received=entry.get("lamport"))
     append_log(entry)
@@ -146,11 +1410,72 @@ def commit():
     last_leader_heartbeat = time.time()
     return jsonify({"status":"ok"}), 200
 
+@app.route("/commit_batch", methods=["POST"])
+def commit_batch():
+    """Follower receives a batch of consecutive commits from the leader's pipeline (binary or JSON)."""
+    data = decode_body(request.content_type or "", request.get_data(), decode_batch)
+    entries = data.get("entries", [])
+    if entries:
+        increment_lamport(received=max(e.get("lamport", 0) for e in entries))
+    upto = data.get("upto", entries[-1]["seq"] if entries else 0)
+    watermark, conflict = apply_batch(entries, data.get("prev_seq", upto), upto)
+    global last_leader_heartbeat
+    last_leader_heartbeat = time.time()
+    if conflict is not None:
+        return jsonify({"status":"conflict","applied_seq":watermark,"conflict":conflict}), 200
+    note_leader_progress(data.get("commit_seq", upto))
+    return jsonify({"status":"ok","applied_seq":watermark}), 200
+
+@app.route("/balance/<acct>", methods=["GET"])
+def get_balance(acct):
+    """
+    Per-account read, served locally (followers included).
+    ?min_seq=N         wait until this node has applied seq N (read-your-writes)
+    ?max_staleness=S   refuse if this node may be more than S seconds behind the leader
+    ?linearizable=1    leader-lease read: learn the commit seq from the leader's
+                       /read_index, then serve locally once it is applied
+    """
+    min_seq = request.args.get("min_seq", 0, type=int)
+    max_staleness = request.args.get("max_staleness", type=float)
+    if request.args.get("linearizable") in ("1", "true"):
+        if IS_LEADER:
+            payload, code = read_index_payload()
+        elif LEADER:
+            try:
+                r = leader_session.get(LEADER + "/read_index", timeout=1.0)
+                payload, code = r.json(), r.status_code
+            except Exception:
+                payload, code = {"error": "leader_unreachable", "leader": LEADER}, 503
+        else:
+            payload, code = {"error": "no_leader"}, 503
+        if code != 200:
+            return jsonify(payload), code
+        min_seq = max(min_seq, payload["seq"])
+    payload, code = read_balance(acct, min_seq, max_staleness)
+    return jsonify(payload), code
+
+@app.route("/read_index", methods=["GET"])
+def read_index():
+    """Leader: current commit seq for linearizable reads, while holding the read lease."""
+    payload, code = read_index_payload()
+    return jsonify(payload), code
+
 @app.route("/log", methods=["GET"])
 def get_log():
-    """Return local log and lamport; used by new leader to collect logs."""
-    with log_lock, lamport_lock:
-        return jsonify({"log": list(transaction_log), "lamport": lamport, "seq_counter": seq_counter}), 200
+    """Return local log and lamport (?since_seq=N&limit=M for one page after N)."""
+    since = request.args.get("since_seq", type=int)
+    limit = request.args.get("limit", LOG_PAGE_SIZE, type=int)
+    return jsonify(log_payload(since, limit)), 200
+
+@app.route("/snapshot", methods=["GET"])
+def get_snapshot():
+    """Full state snapshot, for peers whose catch-up range was compacted."""
+    snapshot = get_state_snapshot()
+    if request.accept_mimetypes.best_match([BINARY_TYPE, "application/json"]) == BINARY_TYPE:
+        body = encode_snapshot(snapshot)
+        if body is not None:
+            return body, 200, {"Content-Type": BINARY_TYPE}
+    return jsonify(snapshot), 200
 
 @app.route("/election", methods=["POST"])
 def election_msg():
@@ -160,6 +1485,7 @@ def election_msg():
     """
     data = request.get_json()
     caller_id = data['id']
+    peer_ids[data['reply_to']] = caller_id
     if NODE_ID > caller_id:
         # reply to caller that this node is alive/higher -> caller should not become leader
         try:
@@ -172,6 +1498,13 @@ def election_msg():
     else:
         return jsonify({"response":"ok","action":"no_answer"}), 200
 
+@app.route("/heartbeat", methods=["GET", "POST"])
+def heartbeat():
+    """POST: leader -> follower heartbeat. GET: cheap liveness probe for peers."""
+    if request.method == "POST":
+        record_heartbeat(request.get_json())
+    return jsonify(heartbeat_payload()), 200
+
 @app.route("/answer", methods=["POST"])
 def answer_msg():
     # Received response from higher node that it's alive.
@@ -189,7 +1522,9 @@ def coordinator():
     old_leader = LEADER
     if LEADER.endswith(str(PORT)):
         # I am the new leader
+        leader_ready.clear()
         IS_LEADER = True
+        hold_lease_reads()
         # reconstruct state by asking peers for logs
         threading.Thread(target=on_become_leader).start()
     else:
@@ -198,30 +1533,12 @@ def coordinator():
 
 @app.route("/sync_state", methods=["POST"])
 def sync_state():
-    global lamport, balances, transaction_log, seq_counter
-
-    data = request.json
-
-    # Sync Lamport
-    with lamport_lock:
-        lamport = max(lamport, data.get("lamport", 0)) + 1
-
-    # Sync balances
-    incoming_bal = data.get("balances", {})
-    with balances_lock:
-        for k, v in incoming_bal.items():
-            balances[k] = v
-
-    # Sync log
-    incoming_log = data.get("log", [])
-    with log_lock:
-        for entry in incoming_log:
-            if entry not in transaction_log:
-                transaction_log.append(entry)
-
-    # Sync sequence counter
-    seq_counter = max(seq_counter, data.get("seq_counter", 0))
-
+    """
+    Install a full leader snapshot. Only used when a follower is behind the
+    leader's compacted prefix; normal catch-up streams the missing suffix
+    through /commit_batch.
+    """
+    install_snapshot(decode_body(request.content_type or "", request.get_data(), decode_snapshot))
     print(f"[{NODE_ID}] State sync done")
     return jsonify({"status": "ok"})
 
@@ -229,114 +1546,149 @@ def sync_state():
 
 # Election functions
 
+def fan_out(call, peers, deadline):
+    """
+    Run call(peer, timeout) for all peers concurrently, every call bounded by
+    the shared deadline. Returns {peer: result} for calls that finished in
+    time without raising.
+    """
+    futures = {fanout_pool.submit(call, p, max(0.05, deadline - time.time())): p for p in peers}
+    results = {}
+    try:
+        for f in as_completed(futures, timeout=max(0, deadline - time.time())):
+            try:
+                results[futures[f]] = f.result()
+            except Exception:
+                pass
+    except FutureTimeout:
+        pass
+    for f in futures:
+        f.cancel()   # calls still queued behind the pool never start
+    return results
+
+def probe_peer_id(p, timeout):
+    """Node id of peer p, from the cache or its /heartbeat."""
+    if p not in peer_ids:
+        beat = requests.get(p + "/heartbeat", timeout=min(timeout, 1.0)).json()
+        note_peer_wire(p, beat)
+        peer_ids[p] = beat['id']
+    return peer_ids[p]
+
 def start_election():
     """
     Bully algorithm:
     - Contact all peers with higher ID.
     - If any higher node answers, wait for coordinator message.
     - If none answer within timeout, become coordinator and broadcast.
+    All peer calls of a round run concurrently under one deadline.
     """
     global LEADER, IS_LEADER
     print(f"[{NODE_ID}] Starting election")
-    # send /election to nodes with higher ID
-    higher_peers = []
-    for p in PEERS:
-        try:
-            # obtain their id via /status
-            r = requests.get(p + "/status", timeout=1.0)
-            jd = r.json()
-            peer_id = jd['id']
-            if peer_id > NODE_ID:
-                higher_peers.append((peer_id, p))
-        except:
-            pass
-
-    answers = []
-    # send election messages to higher peers
-    for peer_id, p in higher_peers:
-        try:
-            requests.post(p + "/election", json={"id": NODE_ID, "reply_to": f"http://127.0.0.1:{PORT}"}, timeout=1.0)
-        except:
-            pass
+    started = time.time()
+    deadline = started + ELECTION_DEADLINE
+    # ids are cached, so only peers never seen before are probed
+    ids = fan_out(probe_peer_id, PEERS, deadline)
+    higher_peers = [p for p, peer_id in ids.items() if peer_id > NODE_ID]
 
-    # wait for any answers within a short window
-    wait_until = time.time() + 2.0
-    answered = False
-    # We don't have per-answer bookkeeping; assume if any higher peer responds to /status quickly they're available.
-    # Simpler: poll status of higher peers
-    while time.time() < wait_until:
-        for peer_id, p in higher_peers:
-            try:
-                r = requests.get(p + "/status", timeout=0.5)
-                if r.status_code == 200:
-                    answered = True
-                    break
-            except:
-                continue
-        if answered:
-            break
-        time.sleep(0.2)
+    # send election messages to higher peers; a higher peer that accepts
+    # the message is alive and answers by running its own election
+    def send_election(p, timeout):
+        r = requests.post(p + "/election", json={"id": NODE_ID, "reply_to": f"http://127.0.0.1:{PORT}"},
+                          timeout=min(timeout, 1.0))
+        return r.status_code == 200
+    answered = any(fan_out(send_election, higher_peers, deadline).values())
 
     if not answered:
         # become coordinator
         LEADER = f"http://127.0.0.1:{PORT}"
+        leader_ready.clear()
         IS_LEADER = True
         print(f"[{NODE_ID}] Becoming leader")
         # announce to all peers
-        for p in PEERS:
-            try:
-                requests.post(p + "/coordinator", json={"leader_url": LEADER}, timeout=1.0)
-            except:
-                pass
+        announce = lambda p, timeout: requests.post(p + "/coordinator", json={"leader_url": LEADER}, timeout=min(timeout, 1.0))
+        fan_out(announce, PEERS, time.time() + 1.0)
+        hold_lease_reads()
+        print(f"[{NODE_ID}] Election won in {record_election(started, True):.3f}s")
         # As leader, run on_become_leader to collect logs and set state
         threading.Thread(target=on_become_leader).start()
     else:
-        print(f"[{NODE_ID}] Higher node exists, waiting for coordinator")
+        print(f"[{NODE_ID}] Higher node exists, waiting for coordinator ({record_election(started, False):.3f}s)")
 
 def on_become_leader():
     """Called on node that just declared itself leader: gather logs and reconcile state."""
-    global seq_counter, lamport
     print(f"[{NODE_ID}] Running leader reconciliation")
+    started = time.time()
     collected_logs = []
-    max_seq = 0
     max_lamport = 0
-    # pull logs from peers
-    for p in PEERS:
-        try:
-            r = requests.get(p + "/log", timeout=1.0)
-            if r.status_code == 200:
-                jd = r.json()
-                collected_logs.extend(jd.get("log", []))
-                max_lamport = max(max_lamport, jd.get("lamport", 0))
-                max_seq = max(max_seq, jd.get("seq_counter", 0) - 1)
-        except:
-            pass
-    # include our own log
+    max_counter = 0
+    peer_applied = {}  # peer -> its watermark, where its replicator starts
+    # pull from all peers at once only the entries after our own watermark
+    rnd = open_reconcile_round()
+    since = applied_seq
+    deadline = started + RECONCILE_DEADLINE
+    pulled = fan_out(lambda p, timeout: fetch_log_suffix(p, since, deadline, rnd), PEERS, deadline)
+    for p, (entries, jd) in pulled.items():
+        collected_logs.extend(entries)
+        max_lamport = max(max_lamport, jd.get("lamport", 0))
+        max_counter = max(max_counter, jd.get("seq_counter", 0))
+        peer_applied[p] = jd.get("applied_seq", 0)
+    if not reconcile(collected_logs, max_lamport, max_counter, rnd):
+        return
+    # followers catch up through the replication pipeline, each from its own
+    # watermark, so failover cost grows with divergence rather than history
+    start_replication(peer_applied)
+    print(f"[{NODE_ID}] Leader reconciliation done in {time.time() - started:.3f}s. seq_counter={seq_counter}, lamport={lamport}")
+
+def open_reconcile_round():
+    """New leader: start collecting peer logs; returns the round the fetches are tagged with."""
+    global reconcile_round
     with log_lock:
-        collected_logs.extend(transaction_log)
-    # deduplicate by seq and sort
+        reconcile_round += 1
+        return reconcile_round
+
+def reconcile(collected_logs, max_lamport, max_counter=0, rnd=None):
+    """
+    New leader: merge the log suffixes collected from peers into local state.
+    max_counter is the highest seq_counter a peer reported: seqs below it
+    may have been handed out by a deposed leader, so they are never reused,
+    and those that reached none of the peers become holes. Ends collection
+    round `rnd`, so fetches still in flight can no longer install anything;
+    returns False (and changes nothing) if a newer round has started.
+    """
+    global seq_counter, lamport, lease_until, reconcile_round
+    # a read lease from an earlier term does not carry over
+    lease_until = 0.0
+    with log_lock:
+        if rnd is not None and rnd != reconcile_round:
+            return False
+        reconcile_round += 1
+        rnd = reconcile_round
+        # include our own entries waiting behind a gap
+        collected_logs.extend(pending_entries.values())
+        base = applied_seq
+    # deduplicate by seq and sort (seq <= 0 are legacy heartbeat pings); our
+    # own applied prefix (possibly compacted into a snapshot) stays as it is
     seq_map = {}
     for e in collected_logs:
-        seq_map[e['seq']] = e
+        if e['seq'] > base:
+            seq_map[e['seq']] = e
     merged = [seq_map[k] for k in sorted(seq_map.keys())]
-    # rebuild local state
-    with log_lock, balances_lock, lamport_lock:
-        transaction_log.clear()
-        balances.clear()
-        for e in merged:
-            transaction_log.append(e)
-            balances[e['from']] -= e['amount']
-            balances[e['to']] += e['amount']
+    with lamport_lock:
         lamport = max(lamport, max_lamport) + 1
-        seq_counter = max(seq_counter, (max(seq_map.keys()) + 1) if seq_map else 1)
-    # broadcast a sync to followers (optional)
-    snapshot = get_state_snapshot()
-    for p in PEERS:
-        try:
-            requests.post(p + "/sync_state", json=snapshot, timeout=1.0)
-        except:
-            pass
-    print(f"[{NODE_ID}] Leader reconciliation done. seq_counter={seq_counter}, lamport={lamport}")
+    # the merged history ends below counter: writes may take seqs from there
+    # right away and wait as pending until it is settled behind them
+    with log_lock:
+        if rnd != reconcile_round:
+            return False   # re-elected meanwhile: the newer round merges
+        counter = max(seq_counter, max_counter, applied_seq + 1, merged[-1]['seq'] + 1 if merged else 0)
+        seq_counter = counter
+        leader_ready.set()
+    # roll local state forward off-lock; writers wait only for the swap
+    prepared = prepare_suffix(merged)
+    with log_lock:
+        ready = adopt_suffix(prepared, upto=counter - 1)
+    apply_settled(ready)
+    return True
 
 # Heartbeat thread
 def heartbeat_monitor():
@@ -344,25 +1696,18 @@ def heartbeat_monitor():
     while True:
         time.sleep(HEARTBEAT_INTERVAL)
         if IS_LEADER:
-            # as leader, we can optionally send heartbeats by posting to /commit a tiny ping or specific /heartbeat endpoint
-            for p in PEERS:
-                try:
-                    requests.post(p + "/commit", json={"seq": -1, "lamport": increment_lamport(), "from":"__sys__","to":"__sys__","amount":0,"client_txid":"heartbeat"}, timeout=0.5)
-                except:
-                    pass
+            # as leader, push a minimal heartbeat to every follower at once
+            round_start = time.time()
+            ping = heartbeat_payload()
+            beat = lambda p, timeout: heartbeat_session.post(p + "/heartbeat", json=ping, timeout=min(timeout, 0.5))
+            acks = fan_out(beat, PEERS, round_start + 0.5)
+            replies = {p: r.json() for p, r in acks.items() if r.status_code == 200}
+            for p, reply in replies.items():
+                note_peer_wire(p, reply)
+            renew_lease(round_start, replies.values())
         else:
-            # follower: check last heartbeat time or ping leader
-            if LEADER:
-                try:
-                    r = requests.get(LEADER + "/status", timeout=1.0)
-                    if r.status_code == 200:
-                        last_leader_heartbeat = time.time()
-                    else:
-                        # treat as failure
-                        pass
-                except:
-                    pass
-            # if timeout passed, start election
+            # follower: the leader's heartbeats (and commit batches) refresh
+            # last_leader_heartbeat; if timeout passed, start election
             if time.time() - last_leader_heartbeat > HEARTBEAT_TIMEOUT:
                 print(f"[{NODE_ID}] Leader heartbeat timed out. Starting election.")
                 last_leader_heartbeat = time.time()
@@ -375,21 +1720,46 @@ def seed_demo_accounts():
         balances['B'] = 100
         balances['C'] = 100
 
-if __name__ == "__main__":
+def build_arg_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("--id", type=int, required=True)
     parser.add_argument("--port", type=int, required=True)
     parser.add_argument("--peers", type=str, default="")
-    args = parser.parse_args()
+    parser.add_argument("--data-dir", type=str, default=None,
+                        help="directory for the WAL and snapshots (in-memory only if omitted)")
+    parser.add_argument("--group-commit", type=float, default=GROUP_COMMIT_INTERVAL,
+                        help="seconds between WAL fsyncs; a commit is acknowledged after the fsync that "
+                             "covers it, so this adds up to that much commit latency")
+    parser.add_argument("--wire", choices=["binary", "json"], default=WIRE,
+                        help="encoding for replication to followers that support it (client endpoints stay JSON)")
+    parser.add_argument("--snapshot-every", type=int, default=SNAPSHOT_EVERY,
+                        help="applied entries between snapshots")
+    return parser
+
+def configure(args):
+    """Set this node's identity, peers and persistence from parsed args, and load or seed state."""
+    global NODE_ID, PORT, PEERS, LEADER, IS_LEADER, DATA_DIR, GROUP_COMMIT_INTERVAL, SNAPSHOT_EVERY, WIRE
     NODE_ID = args.id
     PORT = args.port
+    WIRE = args.wire
     if args.peers:
         PEERS = [p for p in args.peers.split(",") if p]
     # initially unknown leader
     LEADER = None
     IS_LEADER = False
 
-    seed_demo_accounts()
+    if args.data_dir:
+        DATA_DIR = args.data_dir
+        GROUP_COMMIT_INTERVAL = args.group_commit
+        SNAPSHOT_EVERY = args.snapshot_every
+        os.makedirs(DATA_DIR, exist_ok=True)
+        recover_local_state()
+        threading.Thread(target=wal_flusher, daemon=True).start()
+    else:
+        seed_demo_accounts()
+
+if __name__ == "__main__":
+    configure(build_arg_parser().parse_args())
 
     # start heartbeat monitor thread
     th = threading.Thread(target=heartbeat_monitor, daemon=True)
@@ -401,15 +1771,8 @@ if __name__ == "__main__":
     def startup_election_check():
         time.sleep(1.0)
         # trivial heuristic: if our ID is the highest among those reachable, become leader
-        highest = NODE_ID
-        for p in PEERS:
-            try:
-                r = requests.get(p + "/status", timeout=1.0)
-                if r.status_code == 200:
-                    jd = r.json()
-                    highest = max(highest, jd['id'])
-            except:
-                pass
+        ids = fan_out(probe_peer_id, PEERS, time.time() + 1.0)
+        highest = max([NODE_ID] + list(ids.values()))
         if NODE_ID >= highest:
             threading.Thread(target=start_election).start()
     threading.Thread(target=startup_election_check, daemon=True).start()
@@ -0,0 +1,497 @@
+# dist_bank_async.py
+# asyncio serving mode for dist_bank: same endpoints, same node state and
+# log/ledger code (imported from dist_bank.py), but requests are handled on
+# one event loop and every outbound call (forwarding, election, heartbeats,
+# replication) goes through one pooled aiohttp session instead of a blocking
+# requests call, so thousands of transfers can be in flight without a
+# thread per request.
+# pip install aiohttp flask requests
+#
+# python3 dist_bank_async.py --id 1 --port 5001 \
+#     --peers http://127.0.0.1:5002,http://127.0.0.1:5003
+# Nodes in either mode can be mixed in one cluster.
+
+import asyncio, heapq, itertools, time
+from aiohttp import web, ClientSession, ClientTimeout, TCPConnector
+
+import dist_bank as bank
+
+MAX_CONNECTIONS = 1000  # pooled outbound connections shared by all peers
+
+session = None          # aiohttp ClientSession, created on startup
+background = set()      # running background tasks (kept referenced until done)
+durable_waiters = []    # heap of (seq, n, future) for commits waiting on the WAL; loop thread only
+waiter_ids = itertools.count()
+
+# Outbound helpers
+
+def spawn(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    background.add(task)
+    task.add_done_callback(background.discard)
+    return task
+
+def release_durable():
+    """Resolve the waiters whose entries are fsynced by now (runs on the loop)."""
+    while durable_waiters and durable_waiters[0][0] <= bank.durable_seq:
+        future = heapq.heappop(durable_waiters)[2]
+        if not future.done():
+            future.set_result(None)
+
+async def durable(seq):
+    """Wait until the entry with this seq is fsynced, without holding a thread meanwhile."""
+    if bank.wal_file is None or bank.durable_seq >= seq:
+        return
+    future = asyncio.get_running_loop().create_future()
+    heapq.heappush(durable_waiters, (seq, next(waiter_ids), future))
+    await future
+
+async def get_json(url, timeout, params=None):
+    """GET url and return the decoded JSON body, or None on any failure."""
+    try:
+        async with session.get(url, params=params, timeout=ClientTimeout(total=timeout)) as r:
+            if r.status == 200:
+                return await r.json()
+    except Exception:
+        pass
+    return None
+
+async def post_json(url, payload, timeout):
+    """POST payload to url and return the decoded JSON body, or None on any failure."""
+    try:
+        async with session.post(url, json=payload, timeout=ClientTimeout(total=timeout)) as r:
+            if r.status == 200:
+                return await r.json()
+    except Exception:
+        pass
+    return None
+
+async def post_replication(url, payload, encode, timeout):
+    """post_json for replication traffic: binary when the follower supports it and the payload fits."""
+    body = encode(payload) if bank.binary_peer(url.rsplit("/", 1)[0]) else None
+    if body is None:
+        return await post_json(url, payload, timeout)
+    try:
+        async with session.post(url, data=body, headers={"Content-Type": bank.BINARY_TYPE},
+                                timeout=ClientTimeout(total=timeout)) as r:
+            if r.status == 200:
+                return await r.json()
+    except Exception:
+        pass
+    return None
+
+async def get_snapshot_from(peer, timeout):
+    """A peer's /snapshot, binary if it can send it; None on any failure."""
+    try:
+        async with session.get(peer + "/snapshot", headers={"Accept": bank.BINARY_TYPE + ", application/json"},
+                               timeout=ClientTimeout(total=timeout)) as r:
+            if r.status == 200:
+                body = await r.read()
+                return await asyncio.to_thread(bank.decode_body, r.headers.get("Content-Type", ""), body,
+                                               bank.decode_snapshot)
+    except Exception:
+        pass
+    return None
+
+# Replication
+
+class AsyncReplicator(bank.Replicator):
+    """dist_bank.Replicator driven by the event loop and the shared session."""
+    def __init__(self, peer, match_index):
+        self.peer = peer
+        self.match_index = match_index
+        self.diverged = False
+        self.wakeup = asyncio.Event()
+
+    async def run(self):
+        while self.active():
+            if bank.applied_seq <= self.match_index:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), bank.HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if bank.applied_seq - self.match_index < bank.REPL_BATCH_SIZE:
+                # let concurrent commits join this batch
+                await asyncio.sleep(bank.REPL_BATCH_WINDOW)
+            if self.needs_snapshot():
+                # ship a full snapshot: it replaces the follower's log and balances
+                snapshot = await asyncio.to_thread(bank.get_state_snapshot)
+                if await post_replication(self.peer + "/sync_state", snapshot, bank.encode_snapshot, 5.0) is not None:
+                    self.match_index = snapshot["applied_seq"]
+                    self.diverged = False
+                    continue
+                await asyncio.sleep(bank.REPL_RETRY_DELAY)
+                continue
+            batch, hi = self.next_batch()
+            payload = {"entries": batch, "prev_seq": self.match_index, "upto": hi, "commit_seq": bank.applied_seq}
+            start = time.perf_counter()
+            jd = await post_replication(self.peer + "/commit_batch", payload, bank.encode_batch, 1.0)
+            if jd is not None:
+                self.acked(start, jd.get("applied_seq", hi), jd.get("conflict"))
+                continue
+            await asyncio.sleep(bank.REPL_RETRY_DELAY)
+
+def wake_replicators():
+    for r in bank.replicators.values():
+        if isinstance(r, AsyncReplicator):
+            r.wakeup.set()
+
+def start_replication(match_indexes):
+    for p in bank.PEERS:
+        r = AsyncReplicator(p, match_indexes.get(p, bank.applied_seq))
+        bank.replicators[p] = r
+        spawn(r.run())
+
+# Election
+
+async def start_election():
+    """Bully election, as dist_bank.start_election, with peer calls issued concurrently."""
+    print(f"[{bank.NODE_ID}] Starting election")
+    started = time.time()
+    deadline = started + bank.ELECTION_DEADLINE
+    # ids are cached, so only peers never seen before are probed
+    unknown = [p for p in bank.PEERS if p not in bank.peer_ids]
+    statuses = await asyncio.gather(*(get_json(p + "/heartbeat", min(1.0, deadline - time.time())) for p in unknown))
+    for p, st in zip(unknown, statuses):
+        if st:
+            bank.note_peer_wire(p, st)
+            bank.peer_ids[p] = st['id']
+    higher_peers = [p for p in bank.PEERS if bank.peer_ids.get(p, bank.NODE_ID) > bank.NODE_ID]
+    # a higher peer that accepts the election message is alive and answers
+    reply_to = f"http://127.0.0.1:{bank.PORT}"
+    timeout = max(0.05, min(1.0, deadline - time.time()))
+    replies = await asyncio.gather(*(post_json(p + "/election", {"id": bank.NODE_ID, "reply_to": reply_to}, timeout)
+                                     for p in higher_peers))
+    answered = any(r is not None for r in replies)
+
+    if not answered:
+        bank.LEADER = reply_to
+        bank.leader_ready.clear()
+        bank.IS_LEADER = True
+        print(f"[{bank.NODE_ID}] Becoming leader")
+        await asyncio.gather(*(post_json(p + "/coordinator", {"leader_url": bank.LEADER}, 1.0)
+                               for p in bank.PEERS))
+        bank.hold_lease_reads()
+        print(f"[{bank.NODE_ID}] Election won in {bank.record_election(started, True):.3f}s")
+        spawn(on_become_leader())
+    else:
+        print(f"[{bank.NODE_ID}] Higher node exists, waiting for coordinator ({bank.record_election(started, False):.3f}s)")
+
+async def fetch_log_suffix(peer, since, deadline, rnd):
+    """
+    Async dist_bank.fetch_log_suffix; returns (entries, info), or None if the
+    peer is unreachable before the deadline or round `rnd` ended.
+    """
+    entries = []
+    while True:
+        params = {"since_seq": since, "limit": bank.LOG_PAGE_SIZE}
+        left = deadline - time.time()
+        info = await get_json(peer + "/log", left, params=params) if left > 0 else None
+        if info is None:
+            return None
+        if info.get("compacted"):
+            left = deadline - time.time()
+            snapshot = await get_snapshot_from(peer, left) if left > 0 else None
+            # cancelling this task can't stop the install thread: the round check does
+            if snapshot is None or not await asyncio.to_thread(bank.install_snapshot, snapshot, rnd):
+                return None
+            since = max(since, bank.applied_seq)
+            continue
+        page = info.get("log", [])
+        entries.extend(page)
+        if not info.get("more") or not page:
+            return entries, info
+        since = page[-1]["seq"]
+
+async def on_become_leader():
+    print(f"[{bank.NODE_ID}] Running leader reconciliation")
+    started = time.time()
+    rnd = bank.open_reconcile_round()
+    since = bank.applied_seq
+    deadline = started + bank.RECONCILE_DEADLINE
+    pulls = [asyncio.ensure_future(fetch_log_suffix(p, since, deadline, rnd)) for p in bank.PEERS]
+    if pulls:
+        # peers that miss the shared deadline catch up through their replicator
+        await asyncio.wait(pulls, timeout=bank.RECONCILE_DEADLINE)
+    results = [t.result() if t.done() else None for t in pulls]
+    for t in pulls:
+        t.cancel()
+    collected_logs = []
+    max_lamport = 0
+    max_counter = 0
+    peer_applied = {}
+    for p, res in zip(bank.PEERS, results):
+        if res is None:
+            continue
+        entries, jd = res
+        collected_logs.extend(entries)
+        max_lamport = max(max_lamport, jd.get("lamport", 0))
+        max_counter = max(max_counter, jd.get("seq_counter", 0))
+        peer_applied[p] = jd.get("applied_seq", 0)
+    # merging and applying the suffixes can take a while: keep serving meanwhile
+    if not await asyncio.to_thread(bank.reconcile, collected_logs, max_lamport, max_counter, rnd):
+        return
+    start_replication(peer_applied)
+    print(f"[{bank.NODE_ID}] Leader reconciliation done in {time.time() - started:.3f}s. seq_counter={bank.seq_counter}, lamport={bank.lamport}")
+
+# Heartbeat
+
+async def heartbeat_monitor():
+    while True:
+        await asyncio.sleep(bank.HEARTBEAT_INTERVAL)
+        if bank.IS_LEADER:
+            round_start = time.time()
+            ping = bank.heartbeat_payload()
+            acks = await asyncio.gather(*(post_json(p + "/heartbeat", ping, 0.5) for p in bank.PEERS))
+            for p, a in zip(bank.PEERS, acks):
+                if a is not None:
+                    bank.note_peer_wire(p, a)
+            bank.renew_lease(round_start, [a for a in acks if a is not None])
+        else:
+            if time.time() - bank.last_leader_heartbeat > bank.HEARTBEAT_TIMEOUT:
+                print(f"[{bank.NODE_ID}] Leader heartbeat timed out. Starting election.")
+                bank.last_leader_heartbeat = time.time()
+                spawn(start_election())
+
+async def startup_election_check():
+    await asyncio.sleep(1.0)
+    statuses = await asyncio.gather(*(get_json(p + "/heartbeat", 1.0) for p in bank.PEERS))
+    for p, st in zip(bank.PEERS, statuses):
+        if st:
+            bank.note_peer_wire(p, st)
+            bank.peer_ids[p] = st['id']
+    highest = max([bank.NODE_ID] + [st['id'] for st in statuses if st])
+    if bank.NODE_ID >= highest:
+        spawn(start_election())
+
+# Endpoints
+
+def query_arg(request, name, convert, default=None):
+    """A query parameter converted with `convert`; default if missing or malformed, as Flask's type= does."""
+    try:
+        return convert(request.query[name])
+    except (KeyError, ValueError):
+        return default
+
+async def read_json(request):
+    """The decoded JSON body, or None if it isn't valid JSON (rejected as malformed by the caller)."""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+async def get_metrics(request):
+    return web.Response(text=bank.metrics.render(), content_type="text/plain")
+
+async def status(request):
+    return web.json_response(bank.status_payload())
+
+async def transaction(request):
+    data = await read_json(request)
+    if bank.IS_LEADER:
+        if not bank.leader_ready.is_set():
+            return web.json_response({"status": "reconciling", "message": "new leader not ready, retry"}, status=503)
+        try:
+            entry, is_new = bank.leader_commit(data)
+        except ValueError as e:
+            return web.json_response({"status": "rejected", "message": str(e)}, status=400)
+        if is_new:
+            wake_replicators()
+        await durable(entry['seq'])   # acknowledge only once the entry is on disk
+        if not is_new:
+            return web.json_response({"status": "committed", "entry": entry, "duplicate": True})
+        return web.json_response({"status": "committed", "entry": entry})
+    bank.increment_lamport()
+    if bank.LEADER:
+        try:
+            start = time.perf_counter()
+            async with session.post(bank.LEADER + "/transaction", json=data,
+                                    timeout=ClientTimeout(total=2.0)) as r:
+                body = await r.read()
+            bank.record_forward(start, 1, "ok")
+            return web.Response(body=body, status=r.status, content_type="application/json")
+        except Exception:
+            bank.metrics.inc("dist_bank_transactions_forwarded_total", 1, "error")
+            spawn(start_election())
+            return web.json_response({"status": "leader_unreachable", "message": "starting election"}, status=503)
+    spawn(start_election())
+    return web.json_response({"status": "no_leader", "message": "starting election"}, status=503)
+
+async def transactions(request):
+    data = await read_json(request)
+    error = bank.batch_error(data)
+    if error is not None:
+        return web.json_response({"status": "rejected", "message": error}, status=400)
+    if bank.IS_LEADER:
+        if not bank.leader_ready.is_set():
+            return web.json_response({"status": "reconciling", "message": "new leader not ready, retry"}, status=503)
+        try:
+            entries, committed = bank.leader_commit_batch(data.get("transactions", []))
+        except ValueError as e:
+            return web.json_response({"status": "rejected", "message": str(e)}, status=400)
+        if committed:
+            wake_replicators()
+        last = max((e['seq'] for e in entries), default=0)
+        await durable(last)
+        return web.json_response({"status": "committed", "entries": entries, "committed": committed})
+    bank.increment_lamport()
+    if bank.LEADER:
+        try:
+            start = time.perf_counter()
+            async with session.post(bank.LEADER + "/transactions", json=data,
+                                    timeout=ClientTimeout(total=10.0)) as r:
+                body = await r.read()
+            bank.record_forward(start, len(data.get("transactions", [])), "ok")
+            return web.Response(body=body, status=r.status, content_type="application/json")
+        except Exception:
+            bank.metrics.inc("dist_bank_transactions_forwarded_total", len(data.get("transactions", [])), "error")
+            spawn(start_election())
+            return web.json_response({"status": "leader_unreachable", "message": "starting election"}, status=503)
+    spawn(start_election())
+    return web.json_response({"status": "no_leader", "message": "starting election"}, status=503)
+
+async def commit(request):
+    entry = await request.json()
+    error = bank.transfer_error(entry)
+    if error is not None or type(entry.get("seq")) is not int:
+        return web.json_response({"status": "rejected", "message": error or "'seq' must be an integer"}, status=400)
+    bank.increment_lamport(received=entry.get("lamport"))
+    bank.append_log(entry)
+    bank.last_leader_heartbeat = time.time()
+    return web.json_response({"status": "ok"})
+
+async def commit_batch(request):
+    data = bank.decode_body(request.headers.get("Content-Type", ""), await request.read(), bank.decode_batch)
+    entries = data.get("entries", [])
+    if entries:
+        bank.increment_lamport(received=max(e.get("lamport", 0) for e in entries))
+    upto = data.get("upto", entries[-1]["seq"] if entries else 0)
+    watermark, conflict = await asyncio.to_thread(bank.apply_batch, entries, data.get("prev_seq", upto), upto)
+    bank.last_leader_heartbeat = time.time()
+    if conflict is not None:
+        return web.json_response({"status": "conflict", "applied_seq": watermark, "conflict": conflict})
+    bank.note_leader_progress(data.get("commit_seq", upto))
+    return web.json_response({"status": "ok", "applied_seq": watermark})
+
+async def get_balance(request):
+    acct = request.match_info["acct"]
+    min_seq = query_arg(request, "min_seq", int, 0)
+    max_staleness = query_arg(request, "max_staleness", float)
+    if request.query.get("linearizable") in ("1", "true"):
+        if bank.IS_LEADER:
+            payload, code = bank.read_index_payload()
+        elif bank.LEADER:
+            try:
+                async with session.get(bank.LEADER + "/read_index", timeout=ClientTimeout(total=1.0)) as r:
+                    payload, code = await r.json(), r.status
+            except Exception:
+                payload, code = {"error": "leader_unreachable", "leader": bank.LEADER}, 503
+        else:
+            payload, code = {"error": "no_leader"}, 503
+        if code != 200:
+            return web.json_response(payload, status=code)
+        min_seq = max(min_seq, payload["seq"])
+    if min_seq > bank.applied_seq or bank.applying:
+        # may have to wait for the watermark: keep the event loop free
+        payload, code = await asyncio.to_thread(bank.read_balance, acct, min_seq, max_staleness)
+    else:
+        payload, code = bank.read_balance(acct, min_seq, max_staleness)
+    return web.json_response(payload, status=code)
+
+async def read_index(request):
+    payload, code = bank.read_index_payload()
+    return web.json_response(payload, status=code)
+
+async def get_log(request):
+    since = query_arg(request, "since_seq", int)
+    limit = query_arg(request, "limit", int, bank.LOG_PAGE_SIZE)
+    payload = bank.log_payload(since, limit)
+    return web.json_response(payload)
+
+async def get_snapshot(request):
+    snapshot = await asyncio.to_thread(bank.get_state_snapshot)
+    if bank.BINARY_TYPE in request.headers.get("Accept", ""):
+        body = await asyncio.to_thread(bank.encode_snapshot, snapshot)
+        if body is not None:
+            return web.Response(body=body, content_type=bank.BINARY_TYPE)
+    return web.json_response(snapshot)
+
+async def election_msg(request):
+    data = await request.json()
+    bank.peer_ids[data['reply_to']] = data['id']
+    if bank.NODE_ID > data['id']:
+        spawn(post_json(data['reply_to'] + "/answer", {"id": bank.NODE_ID}, 1.0))
+        spawn(start_election())
+        return web.json_response({"response": "ok", "action": "sent_answer"})
+    return web.json_response({"response": "ok", "action": "no_answer"})
+
+async def heartbeat(request):
+    if request.method == "POST":
+        bank.record_heartbeat(await request.json())
+    return web.json_response(bank.heartbeat_payload())
+
+async def answer_msg(request):
+    return web.json_response({"received": "ok"})
+
+async def coordinator(request):
+    data = await request.json()
+    bank.LEADER = data['leader_url']
+    if bank.LEADER.endswith(str(bank.PORT)):
+        bank.leader_ready.clear()
+        bank.IS_LEADER = True
+        bank.hold_lease_reads()
+        spawn(on_become_leader())
+    else:
+        bank.IS_LEADER = False
+    return web.json_response({"ack": "ok"})
+
+async def sync_state(request):
+    data = await asyncio.to_thread(bank.decode_body, request.headers.get("Content-Type", ""), await request.read(),
+                                   bank.decode_snapshot)
+    await asyncio.to_thread(bank.install_snapshot, data)
+    print(f"[{bank.NODE_ID}] State sync done")
+    return web.json_response({"status": "ok"})
+
+async def on_startup(app):
+    global session
+    session = ClientSession(connector=TCPConnector(limit=MAX_CONNECTIONS))
+    loop = asyncio.get_running_loop()
+    # mark_durable runs on the WAL flusher thread: hop onto the loop to resolve the waiters
+    bank.durable_hooks.append(lambda: loop.call_soon_threadsafe(release_durable))
+    spawn(heartbeat_monitor())
+    spawn(startup_election_check())
+
+async def on_cleanup(app):
+    bank.durable_hooks.clear()
+    await session.close()
+
+def build_app():
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.add_routes([
+        web.get("/metrics", get_metrics),
+        web.get("/status", status),
+        web.post("/transaction", transaction),
+        web.post("/transactions", transactions),
+        web.post("/commit", commit),
+        web.post("/commit_batch", commit_batch),
+        web.get("/balance/{acct}", get_balance),
+        web.get("/read_index", read_index),
+        web.get("/log", get_log),
+        web.get("/snapshot", get_snapshot),
+        web.post("/election", election_msg),
+        web.get("/heartbeat", heartbeat),
+        web.post("/heartbeat", heartbeat),
+        web.post("/answer", answer_msg),
+        web.post("/coordinator", coordinator),
+        web.post("/sync_state", sync_state),
+    ])
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+if __name__ == "__main__":
+    bank.configure(bank.build_arg_parser().parse_args())
+    print(f"Starting async node {bank.NODE_ID} on port {bank.PORT} with peers {bank.PEERS}")
+    web.run_app(build_app(), host="127.0.0.1", port=bank.PORT, print=None)
@@ -0,0 +1,318 @@
+# ledger.py
+# Compact in-memory ledger for dist_bank: account ids interned to dense
+# indexes, balances in an int64 array, settled log entries as columns.
+# Both classes keep the dict / list-of-dicts API dist_bank was written against.
+
+import threading, bisect
+from array import array
+from collections.abc import MutableMapping
+
+try:
+    import numpy as np  # optional: grouped sums for long replays
+except ImportError:
+    np = None
+
+ENTRY_FIELDS = ("seq", "lamport", "from", "to", "amount", "client_txid")
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1
+NUMPY_MIN_ENTRIES = 4096   # shorter runs are summed in a plain loop
+FLOAT_EXACT = 1 << 53
+
+
+class Ledger(MutableMapping):
+    """
+    Account balances behind a dict facade. Each account id is interned once
+    to a dense index; its balance lives in an int64 array at that index.
+    Balances that do not fit int64 (floats, overflow) spill into a small dict.
+    The intern table is shared with ColumnarLog, so an account may be
+    interned (by a settled entry) before it holds a balance; `present` marks
+    the ones that do. Reads of a missing account return 0, like the
+    defaultdict(int) this replaces, without creating it.
+
+    Not locked per account: callers hold dist_bank's stripe locks, as they
+    did for the dict. Only interning a new id takes intern_lock.
+    """
+    def __init__(self):
+        self.index = {}              # account id -> dense index
+        self.names = []              # dense index -> account id
+        self.values = array('q')     # dense index -> balance
+        self.present = bytearray()   # dense index -> 1 once the account holds a balance
+        self.spill = {}              # dense index -> balance that is not an int64
+        self.intern_lock = threading.Lock()
+
+    def intern(self, name):
+        i = self.index.get(name)
+        if i is None:
+            with self.intern_lock:
+                i = self.index.get(name)
+                if i is None:
+                    i = len(self.names)
+                    self.names.append(name)
+                    self.values.append(0)
+                    self.present.append(0)
+                    # published last: a visible index always has its slots
+                    self.index[name] = i
+        return i
+
+    def value(self, i):
+        if self.spill and i in self.spill:
+            return self.spill[i]
+        return self.values[i]
+
+    def store(self, i, v):
+        if type(v) is int:
+            try:
+                self.values[i] = v
+                if self.spill:
+                    self.spill.pop(i, None)
+                return
+            except OverflowError:
+                pass
+        self.spill[i] = v
+
+    def add(self, name, delta):
+        """balances[name] += delta, without the facade's extra lookups."""
+        self.add_at(self.intern(name), delta)
+
+    def add_at(self, i, delta):
+        self.present[i] = 1
+        if type(delta) is int and not (self.spill and i in self.spill):
+            try:
+                self.values[i] += delta
+                return
+            except OverflowError:
+                pass
+        self.spill[i] = self.value(i) + delta
+
+    def prepare(self, mapping):
+        """
+        Arrays holding exactly `mapping`, built next to the live ones so
+        writers keep going; install them with swap(). New ids are interned
+        here, which is safe alongside readers.
+        """
+        slots = [self.intern(k) for k in mapping]
+        n = len(self.names)
+        values = array('q', bytes(8 * n))
+        present = bytearray(n)
+        spill = {}
+        for i, v in zip(slots, mapping.values()):
+            present[i] = 1
+            if type(v) is int and INT64_MIN <= v <= INT64_MAX:
+                values[i] = v
+            else:
+                spill[i] = v
+        return values, present, spill
+
+    def swap(self, prepared):
+        """Replace every balance with a prepare()d state in O(1). Caller blocks writers."""
+        values, present, spill = prepared
+        with self.intern_lock:
+            # ids interned since prepare() get empty slots
+            missing = len(self.names) - len(present)
+            values.frombytes(bytes(8 * missing))
+            present.extend(bytes(missing))
+            self.values, self.present, self.spill = values, present, spill
+
+    def __getitem__(self, name):
+        i = self.index.get(name)
+        if i is None or not self.present[i]:
+            return 0
+        return self.value(i)
+
+    def __setitem__(self, name, v):
+        i = self.intern(name)
+        self.store(i, v)
+        self.present[i] = 1
+
+    def __delitem__(self, name):
+        i = self.index.get(name)
+        if i is None or not self.present[i]:
+            raise KeyError(name)
+        self.present[i] = 0
+        self.values[i] = 0
+        self.spill.pop(i, None)
+
+    def __contains__(self, name):
+        i = self.index.get(name)
+        return i is not None and self.present[i] == 1
+
+    def get(self, name, default=None):
+        i = self.index.get(name)
+        if i is None or not self.present[i]:
+            return default
+        return self.value(i)
+
+    def __iter__(self):
+        return iter([n for n, p in zip(self.names, self.present) if p])
+
+    def __len__(self):
+        return self.present.count(1)
+
+    def __repr__(self):
+        return f"Ledger({dict(self)!r})"
+
+
+class ColumnarLog:
+    """
+    Settled log entries in seq order, stored as parallel arrays: seq,
+    lamport, from/to (ledger indexes) and amount, plus a list of
+    client_txids. Entries are rebuilt as dicts only when read, so the
+    columns hold about 42 bytes per entry instead of a dict per entry. A
+    client_txid adds its string (85 bytes for a uuid4) and a slot in
+    dist_bank's txid_index (about 70 more): about 200 bytes per entry with
+    txids set. An entry that does not fit the columns (float amount, extra
+    fields) is kept whole in `odd`, keyed by seq.
+
+    Offers the list operations dist_bank uses on transaction_log: len,
+    indexing and slicing (returning dicts), append, extend, prefix deletion
+    and clear. Callers hold log_lock, as they did for the list.
+    """
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.seqs = array('q')
+        self.lamports = array('q')
+        self.froms = array('i')      # ledger indexes
+        self.tos = array('i')
+        self.amounts = array('q')
+        self.txids = []
+        self.odd = {}            # seq -> entry dict that does not fit the columns
+
+    def __len__(self):
+        return len(self.seqs)
+
+    @staticmethod
+    def fits(e):
+        return (len(e) == len(ENTRY_FIELDS) and all(k in e for k in ENTRY_FIELDS)
+                and all(type(e[k]) is int and INT64_MIN <= e[k] <= INT64_MAX for k in ("lamport", "amount")))
+
+    def append(self, e):
+        seq = e['seq']
+        self.seqs.append(seq)
+        if self.fits(e):
+            self.lamports.append(e['lamport'])
+            self.froms.append(self.ledger.intern(e['from']))
+            self.tos.append(self.ledger.intern(e['to']))
+            self.amounts.append(e['amount'])
+            self.txids.append(e['client_txid'])
+        else:
+            self.odd[seq] = e
+            self.lamports.append(0)
+            self.froms.append(-1)
+            self.tos.append(-1)
+            self.amounts.append(0)
+            self.txids.append(e.get('client_txid'))
+
+    def extend(self, entries):
+        for e in entries:
+            self.append(e)
+
+    def entry(self, i):
+        seq = self.seqs[i]
+        if self.odd and seq in self.odd:
+            return self.odd[seq]
+        names = self.ledger.names
+        return {"seq": seq, "lamport": self.lamports[i], "from": names[self.froms[i]],
+                "to": names[self.tos[i]], "amount": self.amounts[i], "client_txid": self.txids[i]}
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.entry(k) for k in range(*i.indices(len(self.seqs)))]
+        if i < 0:
+            i += len(self.seqs)
+        if not 0 <= i < len(self.seqs):
+            raise IndexError("log index out of range")
+        return self.entry(i)
+
+    def __iter__(self):
+        for i in range(len(self.seqs)):
+            yield self.entry(i)
+
+    def __delitem__(self, s):
+        if not isinstance(s, slice) or s.step not in (None, 1):
+            raise TypeError("ColumnarLog only deletes contiguous ranges")
+        start, stop, _ = s.indices(len(self.seqs))
+        if self.odd:
+            for seq in self.seqs[start:stop]:
+                self.odd.pop(seq, None)
+        for col in (self.seqs, self.lamports, self.froms, self.tos, self.amounts, self.txids):
+            del col[start:stop]
+
+    def clear(self):
+        del self[:]
+
+    def columns(self, start, stop):
+        """Copies of the from/to/amount columns of entries [start, stop), for net_deltas() outside log_lock."""
+        odd = [self.odd[q] for q in self.seqs[start:stop] if q in self.odd] if self.odd else []
+        return LogColumns(self.ledger, self.froms[start:stop], self.tos[start:stop], self.amounts[start:stop], odd)
+
+    def adopt(self, other):
+        """Take over the columns of a ColumnarLog built off-lock (same ledger). Caller holds log_lock."""
+        self.seqs, self.lamports, self.froms, self.tos = other.seqs, other.lamports, other.froms, other.tos
+        self.amounts, self.txids, self.odd = other.amounts, other.txids, other.odd
+
+    def concat(self, other):
+        """Append the entries of a ColumnarLog built off-lock (same ledger, higher seqs). Caller holds log_lock."""
+        for col, more in ((self.seqs, other.seqs), (self.lamports, other.lamports), (self.froms, other.froms),
+                          (self.tos, other.tos), (self.amounts, other.amounts), (self.txids, other.txids)):
+            col.extend(more)
+        self.odd.update(other.odd)
+
+    def position(self, seq):
+        """Number of entries with seq <= `seq` (bisect_right over the seq column)."""
+        return bisect.bisect_right(self.seqs, seq)
+
+    def find(self, seq):
+        """The entry with this seq, or None."""
+        i = bisect.bisect_left(self.seqs, seq)
+        if i < len(self.seqs) and self.seqs[i] == seq:
+            return self.entry(i)
+        return None
+
+    def range(self, lo, hi):
+        """Entries with lo < seq <= hi, in seq order."""
+        return self[self.position(lo):self.position(hi)]
+
+
+class LogColumns:
+    """A run of settled entries as column copies, reduced to per-account net deltas."""
+    def __init__(self, ledger, froms, tos, amounts, odd):
+        self.ledger = ledger
+        self.froms = froms
+        self.tos = tos
+        self.amounts = amounts
+        self.odd = odd           # entry dicts kept whole by ColumnarLog (their columns hold -1)
+
+    def net_deltas(self):
+        """
+        {ledger index: net change} over the run, in one grouped pass rather
+        than a balance update per entry. Every account touched is listed,
+        even with a zero net change, so it exists afterwards.
+        """
+        n = len(self.amounts)
+        deltas = None
+        if np is not None and n >= NUMPY_MIN_ENTRIES:
+            f = np.frombuffer(self.froms, dtype=np.int32)
+            t = np.frombuffer(self.tos, dtype=np.int32)
+            a = np.frombuffer(self.amounts, dtype=np.int64)
+            keep = f >= 0
+            f, t, a = f[keep], t[keep], a[keep]
+            # bincount sums in float64: exact only while every partial sum stays below 2**53
+            if len(a) and max(int(a.max()), -int(a.min())) * len(a) < FLOAT_EXACT:
+                # group by the accounts this run touches, not by every ledger
+                # index: the cost follows the run length, not the account count
+                touched, inv = np.unique(np.concatenate((f, t)), return_inverse=True)
+                k = len(f)
+                net = (np.bincount(inv[k:], weights=a, minlength=len(touched))
+                       - np.bincount(inv[:k], weights=a, minlength=len(touched)))
+                deltas = dict(zip(touched.tolist(), net.astype(np.int64).tolist()))
+        if deltas is None:
+            deltas = {}
+            for f, t, amount in zip(self.froms, self.tos, self.amounts):
+                if f >= 0:
+                    deltas[f] = deltas.get(f, 0) - amount
+                    deltas[t] = deltas.get(t, 0) + amount
+        for e in self.odd:
+            f = self.ledger.intern(e['from'])
+            t = self.ledger.intern(e['to'])
+            deltas[f] = deltas.get(f, 0) - e['amount']
+            deltas[t] = deltas.get(t, 0) + e['amount']
+        return deltas
@@ -0,0 +1,209 @@
+# test_dist_bank.py
+# In-process checks of dist_bank's log and replication state. Every node is a
+# fresh copy of the dist_bank module, so a leader and its followers can live
+# side by side without any HTTP.
+#
+#   python -m pytest -q test_dist_bank.py
+
+import importlib.util
+import itertools
+import json
+import os
+import time
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+node_ids = itertools.count(1)
+
+
+def node(data_dir=None):
+    """A new, independent dist_bank node seeded with the demo accounts."""
+    n = next(node_ids)
+    spec = importlib.util.spec_from_file_location(f"dist_bank_node{n}", os.path.join(HERE, "dist_bank.py"))
+    bank = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bank)
+    bank.NODE_ID = n
+    bank.seed_demo_accounts()
+    if data_dir is not None:
+        bank.DATA_DIR = str(data_dir)
+        bank.wal_file = open(bank.wal_path(), "a")
+    return bank
+
+
+def lead(bank):
+    bank.IS_LEADER = True
+    bank.leader_ready.set()
+    return bank
+
+
+def transfer(frm, to, amount, txid=None):
+    return {"from": frm, "to": to, "amount": amount, "client_txid": txid}
+
+
+@pytest.mark.parametrize("wire", ["binary", "json"])
+def test_compacted_txid_is_not_applied_twice_after_snapshot_install(tmp_path, wire):
+    leader = lead(node(tmp_path))
+    leader.leader_commit(transfer("A", "B", 5, "t1"))
+    leader.leader_commit(transfer("B", "C", 7, "t2"))
+    leader.take_snapshot()
+    leader.leader_commit(transfer("C", "A", 1, "t3"))
+    assert leader.snapshot_seq == 2   # t1 and t2 only survive as txids
+
+    snap = leader.get_state_snapshot()
+    if wire == "binary":
+        data = leader.decode_snapshot(leader.encode_snapshot(snap))
+    else:
+        data = json.loads(json.dumps(snap))
+
+    follower = node()
+    follower.install_snapshot(data)
+    balances = dict(follower.balances)
+
+    # failover: the follower leads now and a client retries the compacted transfer
+    lead(follower)
+    entry, is_new = follower.leader_commit(transfer("A", "B", 5, "t1"))
+    assert not is_new
+    assert entry["seq"] == 1
+    assert dict(follower.balances) == balances == dict(leader.balances)
+
+
+def test_divergent_follower_is_replaced_by_a_snapshot():
+    leader = lead(node())
+    follower = node()
+    for e in (leader.leader_commit(transfer("A", "B", 5, "t1"))[0],
+              leader.leader_commit(transfer("B", "C", 7, "t2"))[0]):
+        follower.apply_batch([e], e["seq"] - 1, e["seq"])
+    # a deposed leader got seq 3 (and 4) onto the follower only
+    stale = [{"seq": 3, "lamport": 90, "from": "C", "to": "A", "amount": 50, "client_txid": "old3"},
+             {"seq": 4, "lamport": 91, "from": "C", "to": "A", "amount": 1, "client_txid": "old4"}]
+    follower.apply_batch(stale, 2, 4)
+    entry, _ = leader.leader_commit(transfer("A", "C", 2, "t3"))
+
+    # the leader's seq 3 is compared with the follower's, not skipped
+    watermark, conflict = follower.apply_batch([entry], 2, 3)
+    assert (watermark, conflict) == (4, 3)
+    repl = leader.Replicator("http://follower", 2)
+    repl.acked(0.0, watermark, conflict)
+    assert repl.needs_snapshot()
+    assert repl.match_index == leader.applied_seq == 3
+
+    # a watermark past the leader's gives the divergence away as well
+    repl = leader.Replicator("http://follower", 3)
+    repl.acked(0.0, 4)
+    assert repl.needs_snapshot() and repl.match_index == 3
+
+    follower.install_snapshot(leader.get_state_snapshot())
+    assert dict(follower.balances) == dict(leader.balances)
+    assert follower.applied_seq == 3
+    assert "old4" not in follower.txid_index
+    assert follower.apply_batch([entry], 2, 3) == (3, None)
+
+
+def test_new_leader_never_reuses_a_seq_a_peer_handed_out():
+    bank = node()
+    bank.leader_commit(transfer("A", "B", 5, "t1"))   # as leader of an earlier term
+    bank.IS_LEADER = False
+    # a peer assigned seqs up to 9 that reached nobody we heard from
+    bank.reconcile([], 0, max_counter=10)
+    assert bank.applied_seq == 9
+    lead(bank)
+    entry, _ = bank.leader_commit(transfer("B", "C", 1, "t2"))
+    assert entry["seq"] == 10
+    assert bank.applied_seq == 10
+
+
+def test_late_reconcile_fetch_cannot_rewind_the_new_leader():
+    old = lead(node())
+    old.leader_commit(transfer("A", "B", 5, "t1"))
+    late_snapshot = old.get_state_snapshot()          # applied_seq 1
+    entries = [old.leader_commit(transfer("B", "C", 1, f"t{i}"))[0] for i in (2, 3)]
+
+    bank = node()
+    rnd = bank.open_reconcile_round()
+    assert bank.reconcile(late_snapshot["log"] + entries, 0, 0, rnd)
+    assert bank.applied_seq == 3
+    # a fetch of the finished round answers only now
+    assert bank.install_snapshot(late_snapshot, rnd) is False
+    assert bank.applied_seq == 3 and dict(bank.balances) == dict(old.balances)
+    # and so does the reconcile of a round a re-election superseded
+    stale = bank.open_reconcile_round()
+    bank.open_reconcile_round()
+    assert bank.reconcile([], 0, 0, stale) is False
+    with pytest.raises(TimeoutError):
+        bank.fetch_log_suffix("http://127.0.0.1:9", 0, deadline=0.0, rnd=rnd)
+
+
+@pytest.mark.parametrize("body", [None, [], "x", 3, {"transactions": None}, {"transactions": {"from": "A"}}])
+def test_malformed_transactions_body_is_rejected(body):
+    bank = lead(node())
+    client = bank.app.test_client()
+    r = client.post("/transactions", data=json.dumps(body), content_type="application/json")
+    assert r.status_code == 400
+    assert r.get_json()["status"] == "rejected"
+    assert bank.seq_counter == 1
+
+
+def test_lease_needs_a_majority_that_still_follows_us():
+    bank = lead(node())
+    bank.LEADER = "http://127.0.0.1:5001"
+    bank.PEERS = ["http://127.0.0.1:5002", "http://127.0.0.1:5003"]
+    newer = {"leader": "http://127.0.0.1:5003"}
+    # both followers answer, but they follow a newer leader now: we are deposed
+    bank.renew_lease(time.time(), [newer, newer])
+    assert not bank.lease_valid()
+    bank.renew_lease(time.time(), [newer, {"leader": bank.LEADER}])
+    assert bank.lease_valid()
+
+
+def test_new_leader_waits_out_the_previous_lease():
+    bank = lead(node())
+    bank.LEADER = "http://127.0.0.1:5001"
+    bank.PEERS = ["http://127.0.0.1:5002"]
+    bank.hold_lease_reads()
+    bank.renew_lease(time.time(), [{"leader": bank.LEADER}])
+    assert not bank.lease_valid()
+    assert bank.read_index_payload()[1] == 503
+    bank.reads_from = time.time()
+    assert bank.lease_valid()
+
+
+def test_compacted_txids_are_kept_for_a_bounded_window(tmp_path):
+    bank = lead(node(tmp_path))
+    bank.TXID_WINDOW = 3
+    for i in range(1, 9):
+        bank.leader_commit(transfer("A", "B", 1, f"t{i}"))
+    bank.take_snapshot()
+    assert sorted(bank.txid_index.values()) == [6, 7, 8]
+    assert set(bank.get_state_snapshot()["txids"]) == {"t6", "t7", "t8"}
+    assert not bank.leader_commit(transfer("A", "B", 1, "t6"))[1]
+    # past the window a retry is a new transfer
+    entry, is_new = bank.leader_commit(transfer("A", "B", 1, "t5"))
+    assert is_new and entry["seq"] == 9
+
+
+def test_writes_accepted_during_reconcile_settle_behind_the_merged_history():
+    old = lead(node())
+    merged = [old.leader_commit(transfer("A", "B", i, f"t{i}"))[0] for i in (1, 2, 3)]
+    bank = lead(node())
+    bank.leader_ready.clear()
+    rnd = bank.open_reconcile_round()
+    writes = [transfer("A", "C", 1, "w1"), transfer("C", "B", 2, "w2"), transfer("B", "A", 3, "w3")]
+    during = []
+    build = bank.prepare_suffix
+
+    def prepare_while_clients_write(entries):
+        # leader_ready is set once the counter is known: writes arrive while the merge is built
+        assert bank.leader_ready.is_set()
+        during.append(bank.leader_commit(writes[0])[0])
+        during.extend(bank.leader_commit_batch(writes[1:])[0])
+        assert bank.applied_seq == 0
+        return build(entries)
+
+    bank.prepare_suffix = prepare_while_clients_write
+    assert bank.reconcile(list(merged), 0, 0, rnd)
+    assert [e["seq"] for e in during] == [4, 5, 6]
+    assert bank.applied_seq == 6 and not bank.pending_entries
+    old.leader_commit(writes[0])
+    old.leader_commit_batch(writes[1:])
+    assert dict(bank.balances) == dict(old.balances)
@@ -0,0 +1,167 @@
+# bench_keys.py
+# Throughput benchmark for the API key server: the single-lock server against
+# lock-striped shards in one process and a sharded deployment of N processes.
+# Each mode starts its servers in subprocesses, creates a key pool, then client
+# processes run get -> keepalive -> unblock cycles for a fixed time.
+# pip install flask requests (and aiohttp for --async)
+
+import argparse, json, multiprocessing, os, random, subprocess, sys, tempfile, threading, time
+import requests
+
+from server import Ring
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODES = ["single", "striped", "sharded"]
+
+
+class Deployment:
+    """Server processes for one mode on consecutive ports."""
+
+    def __init__(self, mode, n, base_port, workdir, script="server.py"):
+        if mode == "sharded":
+            self.ports = [base_port + i for i in range(n)]
+        else:
+            self.ports = [base_port]
+        shards = n if mode == "striped" else 1
+        self.urls = [f"http://127.0.0.1:{p}" for p in self.ports]
+        self.procs = []
+        for port, url in zip(self.ports, self.urls):
+            cmd = [sys.executable, script, "--port", str(port), "--shards", str(shards)]
+            if len(self.urls) > 1:
+                cmd += ["--peers", ",".join(u for u in self.urls if u != url), "--advertise", url]
+            log = open(os.path.join(workdir, f"{mode}-{port}.log"), "a")
+            self.procs.append(subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=HERE))
+
+    def wait_up(self, timeout):
+        deadline = time.time() + timeout
+        for url in self.urls:
+            while True:
+                try:
+                    requests.post(url + "/get?count=1&steal=0", timeout=0.5)
+                    break
+                except requests.RequestException:
+                    if time.time() > deadline:
+                        return False
+                    time.sleep(0.1)
+        return True
+
+    def stop(self):
+        for proc in self.procs:
+            proc.terminate()
+        for proc in self.procs:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def create_keys(urls, total):
+    """Each member mints the keys it owns, so create round-robins over members."""
+    session = requests.Session()
+    for i in range(total):
+        session.post(urls[i % len(urls)] + "/create", timeout=5).raise_for_status()
+
+
+def client_process(urls, threads, duration, seed, out):
+    """Runs `threads` cycle loops for `duration` seconds and reports counts on `out`."""
+    ring = Ring(urls) if len(urls) > 1 else None
+    counts = {"cycles": 0, "requests": 0, "misses": 0, "errors": 0}
+    counts_lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def loop(k):
+        rnd = random.Random(seed * 1000 + k)
+        session = requests.Session()
+        home = urls[rnd.randrange(len(urls))]
+        cycles = reqs = misses = errors = 0
+        while time.time() < stop_at:
+            try:
+                r = session.post(home + "/get", timeout=5)
+                reqs += 1
+                if r.status_code == 404:
+                    misses += 1
+                    continue
+                key = r.json()["key"]
+                # keepalive/unblock go straight to the owner: clients hash like the servers
+                owner = ring.owner(key) if ring else home
+                session.post(f"{owner}/keepalive/{key}", timeout=5)
+                session.post(f"{owner}/unblock/{key}", timeout=5)
+                reqs += 2
+                cycles += 1
+            except requests.RequestException:
+                errors += 1
+        with counts_lock:
+            for name, v in (("cycles", cycles), ("requests", reqs), ("misses", misses), ("errors", errors)):
+                counts[name] += v
+
+    workers = [threading.Thread(target=loop, args=(k,)) for k in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    out.put(counts)
+
+
+def run_mode(mode, args, workdir):
+    deployment = Deployment(mode, args.n, args.base_port, workdir,
+                            "server_async.py" if args.use_async else "server.py")
+    try:
+        if not deployment.wait_up(15.0):
+            sys.exit(f"{mode}: servers did not start, see logs in {workdir}")
+        create_keys(deployment.urls, args.keys)
+        out = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client_process,
+                                           args=(deployment.urls, args.threads, args.duration, args.seed + c, out))
+                   for c in range(args.clients)]
+        start = time.time()
+        for p in clients:
+            p.start()
+        totals = {"cycles": 0, "requests": 0, "misses": 0, "errors": 0}
+        for _ in clients:
+            for name, v in out.get().items():
+                totals[name] += v
+        for p in clients:
+            p.join()
+        elapsed = time.time() - start
+    finally:
+        deployment.stop()
+    totals["mode"] = mode
+    totals["processes"] = len(deployment.ports)
+    totals["requests_per_sec"] = totals["requests"] / elapsed
+    totals["cycles_per_sec"] = totals["cycles"] / elapsed
+    return totals
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="API key server throughput: single lock vs sharded")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated subset of " + ",".join(MODES))
+    parser.add_argument("-n", type=int, default=4, help="shards (striped) or member processes (sharded)")
+    parser.add_argument("--base-port", type=int, default=5200)
+    parser.add_argument("--keys", type=int, default=2000, help="keys created before the run")
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--threads", type=int, default=8, help="threads per client process")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load per mode")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run the servers in asyncio mode (server_async.py, needs aiohttp)")
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    workdir = tempfile.mkdtemp(prefix="bench_keys_")
+    print(f"{os.cpu_count()} cpus, logs in {workdir}")
+    print(f"{'mode':<9}{'procs':>6}{'req/s':>10}{'cycles/s':>10}{'misses':>8}{'errors':>8}")
+    results = []
+    for mode in args.modes.split(","):
+        r = run_mode(mode, args, workdir)
+        results.append(r)
+        print(f"{mode:<9}{r['processes']:>6}{r['requests_per_sec']:>10.0f}{r['cycles_per_sec']:>10.0f}"
+              f"{r['misses']:>8}{r['errors']:>8}")
+    base = results[0]["requests_per_sec"]
+    for r in results[1:]:
+        print(f"{r['mode']} vs {results[0]['mode']}: {r['requests_per_sec'] / base:.2f}x")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -1,27 +1,30 @@
-import requests
+from keyclient import KeyClient
 
 BASE = "http://localhost:5000"
 
-# Create a new key
-print("\n--- CREATE KEY ---")
-res = requests.post(BASE + "/create")
-print(res.json())
+with KeyClient(BASE) as client:
+    # Create a new key
+    print("\n--- CREATE KEY ---")
+    print(client.create())
 
-# Get any available key
-print("\n--- GET KEY ---")
-res = requests.post(BASE + "/get")
-data = res.json()
-print(data)
+    # Get any available key (kept alive in the background while held)
+    print("\n--- GET KEY ---")
+    key = client.get()
+    print(key)
 
-if "key" in data:
-    key = data["key"]
+    if key is not None:
+        # Keep alive (the background renewal does this every lifetime / 3)
+        print("\n--- KEEPALIVE ---")
+        print(client.keepalive([key]))
 
-    # Keep alive
-    print("\n--- KEEPALIVE ---")
-    res = requests.post(BASE + f"/keepalive/{key}")
-    print(res.json())
+        # Unblock key
+        print("\n--- UNBLOCK ---")
+        print(client.unblock(key))
 
-    # Unblock key
-    print("\n--- UNBLOCK ---")
-    res = requests.post(BASE + f"/unblock/{key}")
-    print(res.json())
+    # Batch: take several keys, renew them in one request, hand them back
+    print("\n--- GET 3 KEYS ---")
+    batch = client.get(count=3)
+    print(batch)
+    if batch:
+        print(client.keepalive(batch))
+        print(client.unblock(batch))
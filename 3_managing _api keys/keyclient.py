@@ -0,0 +1,127 @@
+# keyclient.py
+# Client library for the API key server. One pooled HTTP session for every
+# call, batch /get, bulk /keepalive and /unblock, and a background thread that
+# renews every key the client holds with one bulk /keepalive per interval.
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+RENEW_FRACTION = 3          # renew every lifetime / 3, so a failed round or two is harmless
+FIRST_RENEW_DELAY = 1.0     # seconds before the first renewal, until the server's lifetime is known
+BULK_CHUNK = 10000          # keys per bulk call (the server's MAX_BULK_KEYS)
+
+
+class KeyClient:
+    def __init__(self, base="http://localhost:5000", pool_size=10, timeout=5.0, on_lost=None):
+        self.base = base.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.on_lost = on_lost      # called with the held keys the server no longer has
+        self.held = set()           # keys renewed in the background
+        self.held_lock = threading.Lock()
+        self.interval = None        # seconds between renewals, from the server's expires_in
+        self.stop = threading.Event()
+        self.renewer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def post(self, path, **kwargs):
+        return self.session.post(self.base + path, timeout=self.timeout, **kwargs)
+
+    def note_lifetime(self, expires_in):
+        self.interval = max(expires_in / RENEW_FRACTION, FIRST_RENEW_DELAY)
+
+    def create(self):
+        r = self.post('/create')
+        r.raise_for_status()
+        data = r.json()
+        self.note_lifetime(data['expires_in'])
+        return data['key']
+
+    def get(self, count=None, hold=True):
+        """
+        Block one key (count=None) or up to count keys. Returns the key, or
+        the list of keys; None / [] when the server has none available.
+        With hold=True the keys are renewed in the background until unblocked.
+        """
+        r = self.post('/get', params=None if count is None else {'count': count})
+        if r.status_code == 404:
+            return None if count is None else []
+        r.raise_for_status()
+        data = r.json()
+        got = [data['key']] if count is None else data['keys']
+        if hold:
+            self.hold(got)
+        return got[0] if count is None else got
+
+    def bulk(self, path, keys):
+        """POST keys to a bulk endpoint in BULK_CHUNK pieces; merged result."""
+        keys = list(keys)
+        result = {'ok': 0, 'not_found': [], 'unreachable': []}
+        for i in range(0, len(keys), BULK_CHUNK):
+            r = self.post(path, json={'keys': keys[i:i + BULK_CHUNK]})
+            r.raise_for_status()
+            data = r.json()
+            result['ok'] += data['ok']
+            result['not_found'] += data['not_found']
+            result['unreachable'] += data['unreachable']
+            if 'expires_in' in data:
+                self.note_lifetime(data['expires_in'])
+        return result
+
+    def keepalive(self, keys):
+        """Renew keys now, in one request per BULK_CHUNK keys."""
+        return self.bulk('/keepalive', keys)
+
+    def unblock(self, keys):
+        """Hand keys back to the server and stop renewing them."""
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        with self.held_lock:
+            self.held.difference_update(keys)
+        return self.bulk('/unblock', keys)
+
+    def hold(self, keys):
+        """Renew keys in the background until they are unblocked or dropped."""
+        with self.held_lock:
+            self.held.update(keys)
+        if self.renewer is None:
+            self.renewer = threading.Thread(target=self.renew_loop, daemon=True)
+            self.renewer.start()
+
+    def drop(self, keys):
+        """Stop renewing keys without unblocking them."""
+        with self.held_lock:
+            self.held.difference_update(keys)
+
+    def renew_held(self):
+        with self.held_lock:
+            keys = list(self.held)
+        if not keys:
+            return
+        result = self.keepalive(keys)
+        if result['not_found']:
+            self.drop(result['not_found'])
+            if self.on_lost is not None:
+                self.on_lost(result['not_found'])
+        # unreachable keys stay held and are retried next round
+
+    def renew_loop(self):
+        while not self.stop.wait(self.interval or FIRST_RENEW_DELAY):
+            try:
+                self.renew_held()
+            except requests.RequestException as e:
+                print(f"keyclient: keepalive round failed, retrying: {e}")
+
+    def close(self):
+        self.stop.set()
+        if self.renewer is not None:
+            self.renewer.join()
+        self.session.close()
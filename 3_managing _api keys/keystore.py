@@ -0,0 +1,86 @@
+# keystore.py
+# Optional persistence for server.py: key rows in a SQLite table in WAL mode.
+# Changes are coalesced per key in memory and written by a background thread
+# in one transaction per batch, so requests never wait on the disk. A crash
+# loses at most the last PERSIST_INTERVAL seconds of changes.
+
+import sqlite3
+import threading
+
+PERSIST_INTERVAL = 0.2     # seconds between batch writes
+PERSIST_BATCH = 5000       # pending keys that trigger a write before the interval is up
+
+
+class KeyStore:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # WAL keeps commits atomic; fsync at checkpoints
+        self.db.execute("""CREATE TABLE IF NOT EXISTS keys (
+                               key TEXT PRIMARY KEY,
+                               status TEXT NOT NULL,
+                               last_keepalive INTEGER NOT NULL,
+                               blocked_at INTEGER)""")
+        self.pending = {}          # key -> (status, last_keepalive, blocked_at), or None to delete
+        self.cond = threading.Condition()
+        self.flush_lock = threading.Lock()   # one batch write at a time
+        self.writer = None
+        self.stopping = False
+
+    def load(self):
+        """Every stored key as (key, status, last_keepalive, blocked_at)."""
+        return self.db.execute("SELECT key, status, last_keepalive, blocked_at FROM keys").fetchall()
+
+    def put(self, k, v):
+        """Record the current state of key k (v is its keys[] entry, None once deleted)."""
+        row = None if v is None else (v['status'], v['last_keepalive'], v['blocked_at'])
+        with self.cond:
+            self.pending[k] = row
+            if len(self.pending) >= PERSIST_BATCH:
+                self.cond.notify()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.cond:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                return
+            upserts = [(k,) + row for k, row in batch.items() if row is not None]
+            deletes = [(k,) for k, row in batch.items() if row is None]
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany("INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?)", upserts)
+                self.db.executemany("DELETE FROM keys WHERE key = ?", deletes)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                # keep the batch for the next attempt, behind anything newer
+                with self.cond:
+                    batch.update(self.pending)
+                    self.pending = batch
+                raise
+
+    def writer_loop(self):
+        while not self.stopping:
+            with self.cond:
+                if len(self.pending) < PERSIST_BATCH and not self.stopping:
+                    self.cond.wait(PERSIST_INTERVAL)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"keystore: write failed, retrying: {e}")
+
+    def start(self):
+        self.writer = threading.Thread(target=self.writer_loop, daemon=True)
+        self.writer.start()
+
+    def close(self):
+        """Write what is pending and close the database."""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        if self.writer is not None:
+            self.writer.join()
+        self.flush()
+        self.db.close()
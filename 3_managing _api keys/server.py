@@ -1,84 +1,438 @@
 # server.py
-from flask import Flask, jsonify, request
-from threading import Thread, Lock
+from flask import Flask, jsonify, request, redirect
+from threading import Thread, Lock, Condition
+from collections import OrderedDict
+import argparse
+import atexit
+import bisect
+import hashlib
+import heapq
+import itertools
+import random
+import signal
+import sys
 import time
 import uuid
+import requests
 
 app = Flask(__name__)
 
 # Configuration
 KEY_LIFETIME_SECONDS = 5 * 60      # 5 minutes
 AUTO_RELEASE_SECONDS = 60          # release blocked keys after 60 seconds if not unblocked
-CLEANUP_INTERVAL = 5               # seconds between cleanup loop runs
-
-# Shared state
-keys = {}  # key -> {status: 'available'|'blocked', last_keepalive: ts, blocked_at: ts or None}
-lock = Lock()
+EXPIRY_TOLERANCE = 1.0             # expiries/auto-releases may run up to this late, so nearby deadlines share a wakeup
+EXPIRY_CHUNK = 1000                # most deadlines handled per lock hold
+MAX_GET_COUNT = 1000               # most keys handed out by one /get?count=N
+MAX_BULK_KEYS = 10000              # most keys in one bulk /keepalive or /unblock
+FORWARD_TIMEOUT = 5.0              # seconds to wait on the owning member for a forwarded bulk call
+VNODES = 64                        # points per shard / member on a hash ring
+STEAL_TIMEOUT = 1.0                # seconds to wait on a peer member when stealing keys
+DRY_BACKOFF = 0.5                  # seconds a member that had no keys is skipped when stealing
 
 def now():
     return int(time.time())
 
+def ring_hash(s):
+    return int.from_bytes(hashlib.md5(s.encode()).digest()[:8], 'big')
+
+class Ring:
+    """Consistent-hash ring: each key UUID belongs to the first point at or after its hash."""
+    def __init__(self, names):
+        points = sorted((ring_hash(f"{name}#{i}"), name) for name in names for i in range(VNODES))
+        self.hashes = [h for h, _ in points]
+        self.names = [name for _, name in points]
+
+    def owner(self, k):
+        i = bisect.bisect_left(self.hashes, ring_hash(k))
+        return self.names[i % len(self.names)]
+
+class Shard:
+    """
+    One partition of the keys: its own lock, key table, pool of available
+    keys and expiry schedule. The plain server runs a single Shard.
+    """
+    def __init__(self):
+        self.keys = {}  # key -> {status: 'available'|'blocked', last_keepalive: ts, blocked_at: ts or None}
+        self.available = OrderedDict()  # available keys, oldest release first; key -> None
+        self.lock = Lock()
+        # (deadline, kind, key) for every scheduled expiry / auto-release.
+        # Entries are checked against the key when they come due, never removed early;
+        # each key has at most one of each kind queued, so the heap stays within 2 per key.
+        self.schedule = []
+        self.release_due = set()  # keys with an auto-release queued
+        self.schedule_cond = Condition(self.lock)
+        self.store = None  # KeyStore when running with --db
+
+    def persist(self, k):
+        """Queue key k's current state (or its deletion) for the store. Caller holds lock."""
+        if self.store is not None:
+            self.store.put(k, self.keys.get(k))
+
+    def restore(self, rows):
+        """
+        Rebuild keys, the available pool and the expiry schedule from stored
+        rows, before the cleanup thread starts. Deadlines already past are
+        handled by the first cleanup pass.
+        """
+        for k, status, last_keepalive, blocked_at in rows:
+            self.keys[k] = {'status': status, 'last_keepalive': last_keepalive, 'blocked_at': blocked_at}
+            self.schedule.append((last_keepalive + KEY_LIFETIME_SECONDS + 1, 'expire', k))
+            if status == 'available':
+                self.available[k] = None
+            else:
+                self.schedule.append((blocked_at + AUTO_RELEASE_SECONDS + 1, 'release', k))
+                self.release_due.add(k)
+        heapq.heapify(self.schedule)
+
+    def schedule_at(self, deadline, kind, k):
+        """Queue a deadline for key k. Caller holds lock."""
+        entry = (deadline, kind, k)
+        heapq.heappush(self.schedule, entry)
+        if self.schedule[0] is entry:
+            self.schedule_cond.notify()  # earlier than what cleanup_loop is waiting for
+
+    def create(self, k, ts):
+        with self.lock:
+            self.keys[k] = {
+                'status': 'available',
+                'last_keepalive': ts,
+                'blocked_at': None
+            }
+            self.available[k] = None
+            self.schedule_at(ts + KEY_LIFETIME_SECONDS + 1, 'expire', k)
+            self.persist(k)
+
+    def take_available(self, n):
+        """Block and return up to n keys from the pool. Caller holds lock."""
+        ts = now()
+        taken = []
+        while self.available and len(taken) < n:
+            k, _ = self.available.popitem(last=False)
+            self.keys[k]['status'] = 'blocked'
+            self.keys[k]['blocked_at'] = ts
+            if k not in self.release_due:
+                # a release still queued from an earlier block is moved on when it comes due
+                self.release_due.add(k)
+                self.schedule_at(ts + AUTO_RELEASE_SECONDS + 1, 'release', k)
+            self.persist(k)
+            taken.append(k)
+        return taken
+
+    def release(self, k):
+        """Mark a key available and put it back in the pool. Caller holds lock."""
+        self.keys[k]['status'] = 'available'
+        self.keys[k]['blocked_at'] = None
+        self.available[k] = None
+        self.persist(k)
+
+    def unblock_many(self, ks):
+        """Release every key of ks that exists under one lock hold; returns the ones that do not."""
+        missing = []
+        with self.lock:
+            for k in ks:
+                if k in self.keys:
+                    self.release(k)
+                else:
+                    missing.append(k)
+        return missing
+
+    def keepalive_many(self, ks):
+        """Renew every key of ks that exists under one lock hold; returns the ones that do not."""
+        missing = []
+        ts = now()
+        with self.lock:
+            for k in ks:
+                v = self.keys.get(k)
+                if v is None:
+                    missing.append(k)
+                    continue
+                v['last_keepalive'] = ts
+                self.persist(k)
+        return missing
+
+    def unblock(self, k):
+        return not self.unblock_many([k])
+
+    def keepalive(self, k):
+        return not self.keepalive_many([k])
+
+    def run_due(self, ts):
+        """Handle up to EXPIRY_CHUNK deadlines that are due at ts. Caller holds lock."""
+        for _ in range(EXPIRY_CHUNK):
+            if not self.schedule or self.schedule[0][0] > ts:
+                return
+            _, kind, k = heapq.heappop(self.schedule)
+            if kind == 'release':
+                self.release_due.discard(k)
+            v = self.keys.get(k)
+            if v is None:
+                continue
+            if kind == 'expire':
+                # 1) Remove keys expired (no keepalive within lifetime);
+                #    a keepalive since this was queued just moves the deadline
+                if ts - v['last_keepalive'] > KEY_LIFETIME_SECONDS:
+                    del self.keys[k]
+                    self.available.pop(k, None)
+                    self.persist(k)
+                else:
+                    heapq.heappush(self.schedule, (v['last_keepalive'] + KEY_LIFETIME_SECONDS + 1, kind, k))
+            elif v['status'] == 'blocked':
+                # 2) Auto-release blocked keys older than AUTO_RELEASE_SECONDS;
+                #    one unblocked and blocked again since waits for its new deadline
+                deadline = v['blocked_at'] + AUTO_RELEASE_SECONDS + 1
+                if deadline <= ts:
+                    self.release(k)
+                else:
+                    self.release_due.add(k)
+                    heapq.heappush(self.schedule, (deadline, kind, k))
+
+    def cleanup_loop(self):
+        with self.lock:
+            while True:
+                ts = now()
+                self.run_due(ts)
+                if self.schedule and self.schedule[0][0] <= ts:
+                    self.schedule_cond.wait(0)  # more due: let requests in between chunks
+                    continue
+                wait = self.schedule[0][0] - time.time() if self.schedule else None
+                self.schedule_cond.wait(None if wait is None else max(wait, EXPIRY_TOLERANCE))
+
+# Shared state
+shards = [Shard()]
+shard_ring = Ring(['0'])
+rotation = itertools.count()  # spreads /get over shards
+
+# Sharded deployment: several server processes, each owning the keys that
+# hash to it on the member ring. Unset when the server runs alone.
+SELF = None      # this member's URL
+member_ring = None
+peers = []
+session = requests.Session()
+dry_until = {}   # peer -> time before which stealing skips it
+
+def shard_for(k):
+    if len(shards) == 1:
+        return shards[0]
+    return shards[int(shard_ring.owner(k))]
+
+def owner_of(k):
+    """URL of the member that owns k, or None when it is this one."""
+    if member_ring is None:
+        return None
+    owner = member_ring.owner(k)
+    return None if owner == SELF else owner
+
+def steal(n):
+    """Take up to n keys from peer members, skipping ones that recently ran dry."""
+    taken = []
+    start = random.randrange(len(peers))
+    for peer in peers[start:] + peers[:start]:
+        if dry_until.get(peer, 0) > time.time():
+            continue
+        try:
+            # steal=0: the peer answers from its own shards only
+            r = session.post(f"{peer}/get", params={'count': n - len(taken), 'steal': 0}, timeout=STEAL_TIMEOUT)
+        except requests.RequestException:
+            dry_until[peer] = time.time() + DRY_BACKOFF
+            continue
+        if r.status_code == 200:
+            taken += r.json()['keys']
+            if len(taken) == n:
+                break
+        else:
+            dry_until[peer] = time.time() + DRY_BACKOFF
+    return taken
+
+def take_local(n):
+    """Up to n keys from the local shards, starting at a different shard each call."""
+    taken = []
+    start = next(rotation)
+    for i in range(len(shards)):
+        shard = shards[(start + i) % len(shards)]
+        if not shard.available:
+            continue  # unlocked hint; take_available rechecks under the lock
+        with shard.lock:
+            taken += shard.take_available(n - len(taken))
+        if len(taken) == n:
+            break
+    return taken
+
+def take_keys(n, allow_steal=True):
+    """
+    Up to n keys: from the local shards, then from peer members once every
+    local shard has run dry.
+    """
+    taken = take_local(n)
+    if len(taken) < n and allow_steal and peers:
+        taken += steal(n - len(taken))
+    return taken
+
+def parse_count(count):
+    """Keys asked for by /get?count=N, or None when count is malformed or out of range."""
+    try:
+        n = int(count)
+    except ValueError:
+        return None
+    return n if 1 <= n <= MAX_GET_COUNT else None
+
+def to_owner(owner):
+    # 307 keeps the method, so the client repeats the POST at the owner
+    return redirect(owner + request.full_path.rstrip('?'), code=307)
+
 @app.route('/create', methods=['POST'])
 def create_key():
     k = str(uuid.uuid4())
-    ts = now()
-    with lock:
-        keys[k] = {
-            'status': 'available',
-            'last_keepalive': ts,
-            'blocked_at': None
-        }
+    while owner_of(k) is not None:
+        k = str(uuid.uuid4())  # mint keys this member owns
+    shard_for(k).create(k, now())
     return jsonify({'key': k, 'expires_in': KEY_LIFETIME_SECONDS}), 201
 
 @app.route('/get', methods=['POST'])
 def get_key():
-    with lock:
-        for k, v in keys.items():
-            if v['status'] == 'available':
-                v['status'] = 'blocked'
-                v['blocked_at'] = now()
-                return jsonify({'key': k}), 200
+    # /get hands out one key; /get?count=N up to N keys at once
+    allow_steal = request.args.get('steal') != '0'
+    count = request.args.get('count')
+    if count is None:
+        taken = take_keys(1, allow_steal)
+        if taken:
+            return jsonify({'key': taken[0]}), 200
+        return jsonify({'error': 'no-available-keys'}), 404
+    n = parse_count(count)
+    if n is None:
+        return jsonify({'error': 'bad-count', 'max': MAX_GET_COUNT}), 400
+    taken = take_keys(n, allow_steal)
+    if taken:
+        return jsonify({'keys': taken}), 200
     return jsonify({'error': 'no-available-keys'}), 404
 
 @app.route('/unblock/<k>', methods=['POST'])
 def unblock_key(k):
-    with lock:
-        if k not in keys:
-            return jsonify({'error': 'not_found'}), 404
-        keys[k]['status'] = 'available'
-        keys[k]['blocked_at'] = None
-        return jsonify({'key': k, 'status': 'available'}), 200
+    owner = owner_of(k)
+    if owner is not None:
+        return to_owner(owner)
+    if not shard_for(k).unblock(k):
+        return jsonify({'error': 'not_found'}), 404
+    return jsonify({'key': k, 'status': 'available'}), 200
 
 @app.route('/keepalive/<k>', methods=['POST'])
 def keepalive(k):
-    with lock:
-        if k not in keys:
-            return jsonify({'error': 'not_found'}), 404
-        keys[k]['last_keepalive'] = now()
-        return jsonify({'key': k, 'expires_in': KEY_LIFETIME_SECONDS}), 200
-
-def cleanup_loop():
-    while True:
-        time.sleep(CLEANUP_INTERVAL)
-        ts = now()
-        with lock:
-            to_delete = []
-            for k, v in list(keys.items()):
-                # 1) Remove keys expired (no keepalive within lifetime)
-                if ts - v['last_keepalive'] > KEY_LIFETIME_SECONDS:
-                    to_delete.append(k)
-                    continue
-                # 2) Auto-release blocked keys older than AUTO_RELEASE_SECONDS
-                if v['status'] == 'blocked' and v['blocked_at'] is not None:
-                    if ts - v['blocked_at'] > AUTO_RELEASE_SECONDS:
-                        v['status'] = 'available'
-                        v['blocked_at'] = None
-            for k in to_delete:
-                del keys[k]
+    owner = owner_of(k)
+    if owner is not None:
+        return to_owner(owner)
+    if not shard_for(k).keepalive(k):
+        return jsonify({'error': 'not_found'}), 404
+    return jsonify({'key': k, 'expires_in': KEY_LIFETIME_SECONDS}), 200
+
+def bulk_error(ks):
+    """Why the "keys" of a bulk body are unusable, as (payload, status), or None."""
+    if not isinstance(ks, list) or not all(isinstance(k, str) for k in ks):
+        return {'error': 'bad-keys'}, 400
+    if len(ks) > MAX_BULK_KEYS:
+        return {'error': 'too-many-keys', 'max': MAX_BULK_KEYS}, 400
+    return None
+
+def apply_local(op, ks, forwarded):
+    """
+    Apply op to the keys of ks this member owns (all of them when forwarded),
+    one lock hold per shard. Returns (not found, {owner: keys it owns}).
+    """
+    local, remote = {}, {}
+    for k in ks:
+        owner = None if forwarded else owner_of(k)
+        if owner is None:
+            local.setdefault(shard_for(k), []).append(k)
+        else:
+            remote.setdefault(owner, []).append(k)
+    not_found = []
+    for shard, shard_keys in local.items():
+        not_found += getattr(shard, op)(shard_keys)
+    return not_found, remote
+
+def run_bulk(op, path):
+    """
+    Apply op ('keepalive_many' / 'unblock_many') to the keys listed in the
+    JSON body {"keys": [...]}: one lock hold per local shard, and one
+    forwarded call per other member owning some of the keys.
+    """
+    body = request.get_json(silent=True) or {}
+    ks = body.get('keys')
+    error = bulk_error(ks)
+    if error is not None:
+        return error
+    not_found, remote = apply_local(op, ks, request.args.get('forwarded') == '1')
+    unreachable = []
+    for owner, owner_keys in remote.items():
+        # forwarded=1: the owner applies them itself even if its ring disagrees
+        try:
+            r = session.post(f"{owner}{path}", params={'forwarded': 1}, json={'keys': owner_keys},
+                             timeout=FORWARD_TIMEOUT)
+            r.raise_for_status()
+            not_found += r.json()['not_found']
+        except (requests.RequestException, ValueError, KeyError):
+            unreachable += owner_keys
+    ok = len(ks) - len(not_found) - len(unreachable)
+    return {'ok': ok, 'not_found': not_found, 'unreachable': unreachable}, 200
+
+@app.route('/unblock', methods=['POST'])
+def unblock_keys():
+    # bulk form of /unblock/<k>: body {"keys": [...]}
+    result, status = run_bulk('unblock_many', '/unblock')
+    return jsonify(result), status
+
+@app.route('/keepalive', methods=['POST'])
+def keepalive_keys():
+    # bulk form of /keepalive/<k>: body {"keys": [...]}
+    result, status = run_bulk('keepalive_many', '/keepalive')
+    if status == 200:
+        result['expires_in'] = KEY_LIFETIME_SECONDS
+    return jsonify(result), status
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--shards', type=int, default=1,
+                        help='lock-striped shards in this process')
+    parser.add_argument('--peers', default='',
+                        help='comma-separated URLs of the other member processes (sharded deployment)')
+    parser.add_argument('--advertise', default=None,
+                        help='this member\'s URL as listed in the peers\' --peers (default http://127.0.0.1:PORT)')
+    parser.add_argument('--db', default=None,
+                        help='SQLite file to keep keys in across restarts (one per member process)')
+    return parser
+
+def configure(args):
+    """Set up shards and membership from parsed args, recover keys (--db) and start the cleanup threads."""
+    global shards, shard_ring, peers, SELF, member_ring
+    shards = [Shard() for _ in range(args.shards)]
+    shard_ring = Ring([str(i) for i in range(args.shards)])
+    peers = [p.rstrip('/') for p in args.peers.split(',') if p]
+    if peers:
+        SELF = args.advertise or f"http://127.0.0.1:{args.port}"
+        member_ring = Ring([SELF] + peers)
+
+    if args.db:
+        from keystore import KeyStore
+        store = KeyStore(args.db)
+        started = time.time()
+        rows = store.load()
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(id(shard_for(row[0])), []).append(row)
+        for shard in shards:
+            shard.restore(by_shard.get(id(shard), []))
+            shard.store = store
+        print(f"Recovered {len(rows)} keys from {args.db} in {time.time() - started:.2f}s")
+        store.start()
+        atexit.register(store.close)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # run atexit on terminate too
+
+    # start cleanup threads (daemon so they exit with main process)
+    for shard in shards:
+        cleaner = Thread(target=shard.cleanup_loop, daemon=True)
+        cleaner.start()
 
 if __name__ == '__main__':
-    # start cleanup thread (daemon so it exits with main process)
-    cleaner = Thread(target=cleanup_loop, daemon=True)
-    cleaner.start()
+    args = build_arg_parser().parse_args()
+    configure(args)
     # run flask with threaded=True so requests can be handled concurrently
-    app.run(host='0.0.0.0', port=5000, threaded=True)
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
@@ -0,0 +1,164 @@
+# server_async.py
+# asyncio serving mode for the API key server: same endpoints, same key pool,
+# shards, expiry schedule and persistence (imported from server.py), but
+# requests are handled on one event loop, and the calls to peer members
+# (stealing keys, forwarding bulk calls) go through one pooled aiohttp session
+# instead of a blocking requests call per handler thread. A shard lock is only
+# held for a short pool or table update, so taking it on the loop is cheap.
+# pip install aiohttp flask requests
+#
+# python server_async.py --port 5000 [--shards 4] [--peers ...] [--db keys.db]
+# Members in either mode can be mixed in one sharded deployment.
+
+import asyncio
+import random
+import time
+import uuid
+from aiohttp import web, ClientSession, ClientTimeout, TCPConnector
+
+import server as keys
+
+MAX_CONNECTIONS = 100   # pooled outbound connections shared by all peers
+
+session = None          # aiohttp ClientSession, created on startup
+
+async def steal(n):
+    """keys.steal on the shared session: peers are asked one after another until n keys are found."""
+    taken = []
+    start = random.randrange(len(keys.peers))
+    for peer in keys.peers[start:] + keys.peers[:start]:
+        if keys.dry_until.get(peer, 0) > time.time():
+            continue
+        try:
+            # steal=0: the peer answers from its own shards only
+            async with session.post(f"{peer}/get", params={'count': n - len(taken), 'steal': 0},
+                                    timeout=ClientTimeout(total=keys.STEAL_TIMEOUT)) as r:
+                body = await r.json() if r.status == 200 else None
+        except Exception:
+            body = None
+        if body is None:
+            keys.dry_until[peer] = time.time() + keys.DRY_BACKOFF
+            continue
+        taken += body['keys']
+        if len(taken) == n:
+            break
+    return taken
+
+async def take_keys(n, allow_steal=True):
+    taken = keys.take_local(n)
+    if len(taken) < n and allow_steal and keys.peers:
+        taken += await steal(n - len(taken))
+    return taken
+
+def to_owner(request, owner):
+    # 307 keeps the method, so the client repeats the POST at the owner
+    raise web.HTTPTemporaryRedirect(owner + request.path_qs)
+
+async def create_key(request):
+    k = str(uuid.uuid4())
+    while keys.owner_of(k) is not None:
+        k = str(uuid.uuid4())  # mint keys this member owns
+    keys.shard_for(k).create(k, keys.now())
+    return web.json_response({'key': k, 'expires_in': keys.KEY_LIFETIME_SECONDS}, status=201)
+
+async def get_key(request):
+    allow_steal = request.query.get('steal') != '0'
+    count = request.query.get('count')
+    if count is None:
+        taken = await take_keys(1, allow_steal)
+        if taken:
+            return web.json_response({'key': taken[0]})
+        return web.json_response({'error': 'no-available-keys'}, status=404)
+    n = keys.parse_count(count)
+    if n is None:
+        return web.json_response({'error': 'bad-count', 'max': keys.MAX_GET_COUNT}, status=400)
+    taken = await take_keys(n, allow_steal)
+    if taken:
+        return web.json_response({'keys': taken})
+    return web.json_response({'error': 'no-available-keys'}, status=404)
+
+async def unblock_key(request):
+    k = request.match_info['k']
+    owner = keys.owner_of(k)
+    if owner is not None:
+        to_owner(request, owner)
+    if not keys.shard_for(k).unblock(k):
+        return web.json_response({'error': 'not_found'}, status=404)
+    return web.json_response({'key': k, 'status': 'available'})
+
+async def keepalive(request):
+    k = request.match_info['k']
+    owner = keys.owner_of(k)
+    if owner is not None:
+        to_owner(request, owner)
+    if not keys.shard_for(k).keepalive(k):
+        return web.json_response({'error': 'not_found'}, status=404)
+    return web.json_response({'key': k, 'expires_in': keys.KEY_LIFETIME_SECONDS})
+
+async def forward_bulk(owner, path, owner_keys):
+    """The owner's not_found list for keys forwarded to it, or None if it could not be reached."""
+    try:
+        # forwarded=1: the owner applies them itself even if its ring disagrees
+        async with session.post(f"{owner}{path}", params={'forwarded': 1}, json={'keys': owner_keys},
+                                timeout=ClientTimeout(total=keys.FORWARD_TIMEOUT)) as r:
+            r.raise_for_status()
+            return (await r.json())['not_found']
+    except Exception:
+        return None
+
+async def run_bulk(request, op, path):
+    """keys.run_bulk, with the calls to the other owning members issued concurrently."""
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    ks = body.get('keys') if isinstance(body, dict) else None
+    error = keys.bulk_error(ks)
+    if error is not None:
+        return error
+    not_found, remote = keys.apply_local(op, ks, request.query.get('forwarded') == '1')
+    unreachable = []
+    answers = await asyncio.gather(*(forward_bulk(owner, path, owner_keys) for owner, owner_keys in remote.items()))
+    for owner_keys, missing in zip(remote.values(), answers):
+        if missing is None:
+            unreachable += owner_keys
+        else:
+            not_found += missing
+    ok = len(ks) - len(not_found) - len(unreachable)
+    return {'ok': ok, 'not_found': not_found, 'unreachable': unreachable}, 200
+
+async def unblock_keys(request):
+    result, status = await run_bulk(request, 'unblock_many', '/unblock')
+    return web.json_response(result, status=status)
+
+async def keepalive_keys(request):
+    result, status = await run_bulk(request, 'keepalive_many', '/keepalive')
+    if status == 200:
+        result['expires_in'] = keys.KEY_LIFETIME_SECONDS
+    return web.json_response(result, status=status)
+
+async def on_startup(app):
+    global session
+    session = ClientSession(connector=TCPConnector(limit=MAX_CONNECTIONS))
+
+async def on_cleanup(app):
+    await session.close()
+
+def build_app():
+    app = web.Application()
+    app.add_routes([
+        web.post('/create', create_key),
+        web.post('/get', get_key),
+        web.post('/unblock/{k}', unblock_key),
+        web.post('/keepalive/{k}', keepalive),
+        web.post('/unblock', unblock_keys),
+        web.post('/keepalive', keepalive_keys),
+    ])
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+if __name__ == '__main__':
+    args = keys.build_arg_parser().parse_args()
+    keys.configure(args)
+    web.run_app(build_app(), host='0.0.0.0', port=args.port, print=None)
@@ -0,0 +1,216 @@
+# anomaly.py
+# Streaming anomaly detection for the merged log stream of master.py (both the
+# berkeley and the lamport variant). Every signal is kept in O(1) memory per
+# server: exponentially weighted mean/variance for rolling z-scores, and one
+# count-min sketch for how often each message type has been seen.
+
+import math
+import re
+import zlib
+
+ALPHA = 0.05            # EWMA weight of the newest sample (~ the last 40 samples count)
+Z_THRESHOLD = 4.0       # |z| at or above this is flagged
+WARMUP = 10             # samples a statistic needs before it flags anything
+RATE_WINDOW = 10.0      # seconds per event-rate window
+GAP_FACTOR = 14.0       # a silence this many mean gaps long is flagged (~1e-6 for Poisson arrivals)
+MAX_EMPTY_WINDOWS = 100 # silent windows replayed one by one; longer silences are folded
+CMS_WIDTH = 2048
+CMS_DEPTH = 4
+RARE_COUNT = 2          # a message type seen at most this often...
+RARE_AFTER = 1000       # ...once this many messages were seen is flagged as rare
+TEMPLATE_CACHE = 10000  # msg -> template memo, cleared when full
+
+NUMBERS = re.compile(r"0x[0-9a-fA-F]+|[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?")
+
+
+def template(msg):
+    """A message with its numbers blanked: 'Clock adjusted by # seconds'."""
+    return NUMBERS.sub("#", msg)
+
+
+class Ewma:
+    """
+    Exponentially weighted mean and variance of one signal. update() scores a
+    sample against the state before it, then folds it in. The first 1/alpha
+    samples are averaged evenly, so the variance isn't biased low right
+    after warmup.
+    """
+    __slots__ = ("alpha", "min_std", "rel_std", "mean", "var", "n")
+
+    def __init__(self, alpha=ALPHA, min_std=0.0, rel_std=0.0):
+        self.alpha = alpha
+        self.min_std = min_std      # std floor, so a very steady signal doesn't flag noise
+        self.rel_std = rel_std      # std floor as a fraction of the mean
+        self.mean = 0.0
+        self.var = 0.0
+        self.n = 0
+
+    def update(self, x):
+        """z-score of x, or None during warmup."""
+        z = None
+        if self.n >= WARMUP:
+            std = max(math.sqrt(self.var), self.min_std, self.rel_std * abs(self.mean))
+            z = (x - self.mean) / std if std > 0 else 0.0
+        if self.n == 0:
+            self.mean = x
+        else:
+            alpha = max(self.alpha, 1.0 / (self.n + 1))
+            diff = x - self.mean
+            incr = alpha * diff
+            self.mean += incr
+            self.var = (1 - alpha) * (self.var + diff * incr)
+        self.n += 1
+        return z
+
+
+class CountMinSketch:
+    """Approximate counts of items in CMS_DEPTH x CMS_WIDTH counters; never undercounts."""
+
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH):
+        self.width = width
+        self.rows = [[0] * width for _ in range(depth)]
+        self.total = 0
+
+    def add(self, item):
+        """Count one occurrence of item; returns its estimated count."""
+        data = item.encode()
+        est = None
+        for seed, row in enumerate(self.rows):
+            i = zlib.crc32(data, seed) % self.width
+            row[i] += 1
+            est = row[i] if est is None or row[i] < est else est
+        self.total += 1
+        return est
+
+
+class ServerStats:
+    """Rolling statistics of one server's stream."""
+    __slots__ = ("window", "count", "rate", "last_t", "gap", "last_lamport", "jump", "adjust")
+
+    def __init__(self):
+        self.window = None          # index of the rate window being counted
+        self.count = 0
+        self.rate = Ewma(min_std=1.0, rel_std=0.1)    # events per window
+        self.last_t = None
+        self.gap = Ewma()                             # inter-arrival gap, seconds
+        self.last_lamport = None
+        self.jump = Ewma(min_std=1.0)                 # log of the Lamport clock step (receives make steps of a few)
+        self.adjust = Ewma(min_std=0.5)               # log of |Berkeley adjustment|
+
+
+class AnomalyDetector:
+    """
+    Scores every entry of the merged stream as it passes. observe() returns
+    the anomalies the entry revealed, each a dict with server, kind, value,
+    z and t (z is None for the kinds not judged by a z-score). Kinds: rate
+    (events per RATE_WINDOW against that server's usual rate, high or low),
+    gap (a silence of more than GAP_FACTOR mean gaps before this entry),
+    lamport_jump, adjust (from observe_adjust) and rare_message.
+    """
+
+    def __init__(self, z_threshold=Z_THRESHOLD, rate_window=RATE_WINDOW):
+        self.z_threshold = z_threshold
+        self.rate_window = rate_window
+        self.servers = {}
+        self.types = CountMinSketch()
+        self.templates = {}
+        self.stream_window = None   # latest rate window any server reached
+        self.seen = 0
+
+    def stats(self, server):
+        st = self.servers.get(server)
+        if st is None:
+            st = self.servers[server] = ServerStats()
+        return st
+
+    def flag(self, out, server, kind, value, z, t):
+        if z is not None and abs(z) >= self.z_threshold:
+            out.append({"server": server, "kind": kind, "value": value, "z": round(z, 2), "t": t})
+
+    def close_windows(self, server, st, upto, out):
+        """Score server's finished rate windows before window `upto`."""
+        if st.window is None:
+            st.window = upto
+            return
+        if upto <= st.window:
+            return
+        self.flag(out, server, "rate", st.count, st.rate.update(st.count), st.window * self.rate_window)
+        empty = upto - st.window - 1
+        for k in range(min(empty, MAX_EMPTY_WINDOWS)):
+            w = st.window + 1 + k
+            self.flag(out, server, "rate", 0, st.rate.update(0), w * self.rate_window)
+        st.window = upto
+        st.count = 0
+
+    def observe(self, server, t, msg, lamport=None):
+        """
+        One entry of the merged stream: server, event time t (epoch seconds),
+        message and, for the lamport variant, its Lamport clock.
+        """
+        out = []
+        self.seen += 1
+        st = self.stats(server)
+
+        w = int(t // self.rate_window)
+        self.close_windows(server, st, w, out)
+        st.count += 1
+        if self.stream_window is None or w > self.stream_window:
+            # the stream moved on: servers that went quiet close their windows too
+            self.stream_window = w
+            for other, ost in self.servers.items():
+                if ost is not st:
+                    self.close_windows(other, ost, w - 1, out)
+
+        if st.last_t is not None:
+            gap = t - st.last_t
+            if gap > 0:
+                # gaps are roughly exponential, so judge them by the tail
+                # beyond the mean rather than by a z-score
+                mean = st.gap.mean
+                if st.gap.n >= WARMUP and gap > GAP_FACTOR * mean:
+                    out.append({"server": server, "kind": "gap", "value": round(gap, 3), "z": None, "t": t})
+                st.gap.update(gap)
+        st.last_t = t if st.last_t is None else max(st.last_t, t)
+
+        if lamport is not None:
+            if st.last_lamport is not None and lamport > st.last_lamport:
+                step = lamport - st.last_lamport
+                z = st.jump.update(math.log(step))
+                if z is not None and z > 0:
+                    self.flag(out, server, "lamport_jump", step, z, t)
+            if st.last_lamport is None or lamport > st.last_lamport:
+                st.last_lamport = lamport
+
+        tmpl = self.templates.get(msg)
+        if tmpl is None:
+            if len(self.templates) >= TEMPLATE_CACHE:
+                self.templates.clear()
+            tmpl = self.templates[msg] = template(msg)
+        count = self.types.add(tmpl)
+        if count <= RARE_COUNT and self.types.total > RARE_AFTER:
+            out.append({"server": server, "kind": "rare_message", "value": tmpl, "z": None, "t": t})
+        return out
+
+    def observe_adjust(self, server, seconds, t=None):
+        """A Berkeley adjustment the master sent to server."""
+        out = []
+        if seconds:
+            st = self.stats(server)
+            z = st.adjust.update(math.log(abs(seconds)))
+            if z is not None and z > 0:
+                self.flag(out, server, "adjust", seconds, z, t)
+        return out
+
+
+def detect(stream, detector, fields):
+    """
+    Pipeline stage: yields (entry, anomalies) for every entry of stream.
+    fields(entry) gives observe()'s (server, t, msg, lamport) for the entry.
+    """
+    for entry in stream:
+        yield entry, detector.observe(*fields(entry))
+
+
+def describe(a):
+    z = "" if a["z"] is None else f" (z={a['z']})"
+    return f"[ANOMALY] S{a['server']} {a['kind']}: {a['value']}{z}"
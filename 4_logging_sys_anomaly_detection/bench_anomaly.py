@@ -0,0 +1,185 @@
+# bench_anomaly.py
+# Replayable benchmark for anomaly.py. Builds a synthetic merged log stream
+# from a seed (Poisson arrivals per server, Zipf-distributed message types,
+# Lamport clocks, Berkeley adjustments), injects known anomalies, runs the
+# detector over it and reports throughput, recall and false positives.
+# --record writes the stream to a file and --replay runs a recorded one.
+#
+#   python bench_anomaly.py --servers 50 --events 500000
+#   python bench_anomaly.py --record stream.jsonl
+#   python bench_anomaly.py --replay stream.jsonl
+
+import argparse, heapq, json, math, random, time
+
+from anomaly import AnomalyDetector, RATE_WINDOW
+
+MESSAGE_TYPES = [
+    "Local event recorded",
+    "Request {} served in {} ms",
+    "Cache hit for key {}",
+    "Cache miss for key {}",
+    "User {} logged in",
+    "User {} logged out",
+    "Queue depth {}",
+    "Connection from 10.0.{}.{} accepted",
+    "Connection {} closed",
+    "Retrying call {} after {} ms",
+    "Checkpoint {} written",
+    "GC pause {} ms",
+]
+RARE_MESSAGE = "Disk failure on volume {}"
+SYNC_INTERVAL = 5.0     # simulated Berkeley rounds
+MATCH_SLACK = 2 * RATE_WINDOW
+
+
+def server_stream(rnd, server, rate, duration, injections, lamport_mode):
+    """One server's events in time order: (t, server, msg, lamport) tuples."""
+    weights = [1.0 / (k + 1) for k in range(len(MESSAGE_TYPES))]
+    burst = [i for i in injections if i["kind"] == "burst" and i["server"] == server]
+    silence = [i for i in injections if i["kind"] == "silence" and i["server"] == server]
+    jumps = [i for i in injections if i["kind"] == "lamport_jump" and i["server"] == server]
+    rare = [i for i in injections if i["kind"] == "rare_message" and i["server"] == server]
+    t, lamport = 0.0, 0
+    while True:
+        r = rate
+        for b in burst:
+            if b["t"] <= t < b["t"] + RATE_WINDOW:
+                r = rate * 10
+        t += rnd.expovariate(r)
+        if t >= duration:
+            return
+        if any(s["t"] <= t < s["t"] + s["length"] for s in silence):
+            continue
+        # receives from other servers now and then bump the clock
+        lamport += 1 + (rnd.randrange(3) if rnd.random() < 0.2 else 0)
+        for j in jumps:
+            if not j.get("done") and t >= j["t"]:
+                lamport += 10000
+                j["done"] = True
+        msg = rnd.choices(MESSAGE_TYPES, weights)[0]
+        for r_ in rare:
+            if not r_.get("done") and t >= r_["t"]:
+                msg = RARE_MESSAGE
+                r_["done"] = True
+        msg = msg.format(*(rnd.randrange(1000) for _ in range(msg.count("{}"))))
+        yield (t, server, msg, lamport if lamport_mode else None)
+
+
+def adjust_stream(rnd, servers, duration, injections):
+    """Berkeley rounds: (t, server, None, None, adjustment) for every server each SYNC_INTERVAL."""
+    big = {(i["server"], int(i["t"] // SYNC_INTERVAL)) for i in injections if i["kind"] == "adjust"}
+    t = SYNC_INTERVAL
+    while t < duration:
+        for s in servers:
+            adj = rnd.lognormvariate(math.log(1e-4), 0.5) * rnd.choice((-1, 1))
+            if (s, int(t // SYNC_INTERVAL)) in big:
+                adj = 2.0
+            yield (t, s, None, None, adj)
+        t += SYNC_INTERVAL
+
+
+def plan_injections(rnd, servers, duration, lamport_mode):
+    """Anomalies to plant, spread over the second half of the run (the first warms up)."""
+    kinds = ["burst", "silence", "rare_message", "adjust"] + (["lamport_jump"] if lamport_mode else [])
+    out = []
+    for k, kind in enumerate(kinds * 2):
+        t = duration * (0.5 + 0.45 * (k + rnd.random()) / (2 * len(kinds)))
+        inj = {"kind": kind, "server": rnd.choice(servers), "t": t}
+        if kind == "silence":
+            inj["length"] = 6 * RATE_WINDOW
+        out.append(inj)
+    return out
+
+
+def synthetic(args):
+    """(events, injections): the merged stream as (t, server, msg, lamport, adjust) tuples."""
+    rnd = random.Random(args.seed)
+    servers = list(range(5001, 5001 + args.servers))
+    duration = args.events / (args.servers * args.rate)
+    injections = plan_injections(rnd, servers, duration, args.lamport)
+    streams = [((t, s, m, l, None) for t, s, m, l in
+                server_stream(random.Random(args.seed * 7919 + s), s, args.rate, duration, injections, args.lamport))
+               for s in servers]
+    streams.append(adjust_stream(random.Random(args.seed * 31), servers, duration, injections))
+    for inj in injections:
+        inj.pop("done", None)
+    events = list(heapq.merge(*streams, key=lambda e: e[0]))
+    return events, injections
+
+
+def matches(anomaly, inj):
+    kinds = {"burst": ("rate",), "silence": ("gap", "rate"), "lamport_jump": ("lamport_jump",),
+             "rare_message": ("rare_message",), "adjust": ("adjust",)}[inj["kind"]]
+    if anomaly["kind"] not in kinds or anomaly["server"] != inj["server"]:
+        return False
+    end = inj["t"] + inj.get("length", 0) + MATCH_SLACK
+    return inj["t"] - MATCH_SLACK <= anomaly["t"] <= end
+
+
+def run(events, injections, args):
+    detector = AnomalyDetector(z_threshold=args.z)
+    found = []
+    start = time.perf_counter()
+    for t, server, msg, lamport, adjust in events:
+        if adjust is not None:
+            found += detector.observe_adjust(server, adjust, t)
+        else:
+            found += detector.observe(server, t, msg, lamport)
+    elapsed = time.perf_counter() - start
+
+    detected = [any(matches(a, inj) for a in found) for inj in injections]
+    false_pos = [a for a in found if not any(matches(a, inj) for inj in injections)]
+    by_kind = {}
+    for inj, hit in zip(injections, detected):
+        n, h = by_kind.get(inj["kind"], (0, 0))
+        by_kind[inj["kind"]] = (n + 1, h + hit)
+    return {
+        "events": len(events),
+        "seconds": elapsed,
+        "events_per_sec": len(events) / elapsed,
+        "anomalies": len(found),
+        "recall": sum(detected) / len(injections) if injections else None,
+        "recall_by_kind": {k: f"{h}/{n}" for k, (n, h) in by_kind.items()},
+        "false_positives": len(false_pos),
+        "false_positives_per_million": 1e6 * len(false_pos) / len(events),
+    }
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="anomaly.py throughput and accuracy on a synthetic log stream")
+    parser.add_argument("--servers", type=int, default=20)
+    parser.add_argument("--events", type=int, default=300000, help="log entries to generate (approximate)")
+    parser.add_argument("--rate", type=float, default=5.0, help="mean entries per second per server")
+    parser.add_argument("--lamport", action=argparse.BooleanOptionalAction, default=True,
+                        help="give entries Lamport clocks (the lamport variant)")
+    parser.add_argument("--z", type=float, default=4.0, help="z-score threshold")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--record", default=None, help="write the generated stream and injections to this file")
+    parser.add_argument("--replay", default=None, help="run a stream written by --record instead of generating one")
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    if args.replay:
+        with open(args.replay) as f:
+            injections = json.loads(f.readline())["injections"]
+            events = [tuple(json.loads(line)) for line in f]
+    else:
+        events, injections = synthetic(args)
+    if args.record:
+        with open(args.record, "w") as f:
+            f.write(json.dumps({"injections": injections}) + "\n")
+            for e in events:
+                f.write(json.dumps(e) + "\n")
+
+    results = run(events, injections, args)
+    print(f"events         {results['events']}")
+    print(f"throughput     {results['events_per_sec']:.0f} events/sec")
+    print(f"anomalies      {results['anomalies']}")
+    print(f"recall         {results['recall']:.2f}  {results['recall_by_kind']}")
+    print(f"false pos      {results['false_positives']} ({results['false_positives_per_million']:.1f} per million events)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
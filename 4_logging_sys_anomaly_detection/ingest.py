@@ -0,0 +1,153 @@
+# ingest.py
+# Receiving side of master.py of both the berkeley and the lamport variant:
+# accepts the servers' log batches, pulled by the master loop or pushed to
+# /ingest by servers started with --push, and feeds them to one StreamMerger.
+
+import math
+import time
+import queue
+import threading
+import requests
+
+INGEST_QUEUE = 1000     # pushed batches waiting to be merged; /ingest refuses more (429)
+RETRY_AFTER = 0.5       # seconds a refused pusher is told to wait
+PUSH_STALE = 5.0        # a server that pushed within this many seconds is not pulled
+
+
+def is_int(v):
+    return type(v) is int
+
+
+def is_number(v):
+    # bool is an int, and NaN or an infinity would break the heap's ordering
+    return type(v) in (int, float) and math.isfinite(v)
+
+
+class LogIngest:
+    """
+    Cursors and push queue in front of a StreamMerger. For each server the
+    cursor is (its boot id, last entry received from it): a new boot id
+    means the server restarted and its log starts over, and entries are
+    deduplicated and gap-checked by their "offset". The merger, cursors and
+    whatever `show` feeds are shared by the master loop (pulls) and the
+    ingest thread (pushes), so both hold `lock` while touching them.
+    """
+    def __init__(self, merger, show, check, after="offset", on_push=None):
+        self.merger = merger
+        self.show = show            # prints released entries; called with lock held
+        self.check = check          # raises on a pushed entry whose fields `show` can't print
+        self.after = after          # entry field a pull asks the server to continue after
+        self.on_push = on_push      # called with each pushed batch before it is merged (lock held)
+        self.lock = threading.Lock()
+        self.cursors = {}           # server -> (boot id, last entry received from it)
+        self.pushed_at = {}         # server -> when it last pushed
+        self.queue = queue.Queue(maxsize=INGEST_QUEUE)
+
+    def accept(self, s, boot, entries):
+        """Queue a server's new entries for the merge, noting restarts and gaps. Caller holds lock."""
+        last_boot, last = self.cursors.get(s, (None, None))
+        last_offset = last["offset"] if last else -1
+        if boot != last_boot:
+            if last_boot is not None:
+                print(f"[MASTER] Server {s} restarted, its log starts over")
+            last, last_offset = None, -1
+        else:
+            # a batch resent after its reply was lost repeats what we already have
+            entries = [e for e in entries if e["offset"] > last_offset]
+        if entries:
+            missed = entries[0]["offset"] - last_offset - 1
+            if missed > 0:
+                print(f"[MASTER] Server {s} dropped {missed} entries before they were received")
+            last = entries[-1]
+        self.cursors[s] = (boot, last)
+        for entry in entries:
+            entry["server"] = s
+        self.merger.push(s, entries)
+
+    def pushing(self, s):
+        return time.time() - self.pushed_at.get(s, 0) < PUSH_STALE
+
+    def pushers(self):
+        """Servers that pushed recently: they hold the watermark back even when a poll misses them."""
+        return set(filter(self.pushing, self.pushed_at))
+
+    def pull(self, s, mark=None):
+        """
+        Pull what server s logged past its cursor. The pull has everything
+        it logged before `mark` was taken (a clock every later entry lies
+        past), so its watermark is raised to that only now, so pushed
+        batches can't release past entries still to be pulled.
+        """
+        with self.lock:
+            boot, last = self.cursors.get(s, (None, None))
+        try:
+            r = requests.get(f"http://localhost:{s}/logs",
+                             params={"after": last[self.after] if last else -1, "boot": boot}).json()
+        except:
+            return
+        with self.lock:
+            self.accept(s, r["boot"], r["entries"])
+            if mark is not None:
+                self.merger.advance(s, mark)
+
+    def malformed(self, batch):
+        """What is wrong with a pushed batch, or None if ingest_loop can merge it."""
+        if not isinstance(batch, dict):
+            return "body is not a JSON object"
+        if not is_int(batch.get("server")):
+            return "server must be an integer"
+        if not isinstance(batch.get("boot"), str):
+            return "boot must be a string"
+        if not is_number(batch.get("progress")):
+            return "progress must be a number"
+        entries = batch.get("entries")
+        if not isinstance(entries, list):
+            return "entries must be a list"
+        for i, e in enumerate(entries):
+            if not isinstance(e, dict) or not is_int(e.get("offset")) or not isinstance(e.get("msg"), str):
+                return f"entry {i} needs an integer offset and a string msg"
+            try:
+                ok = is_number(self.merger.clock(e))
+                self.check(e)
+            except (KeyError, TypeError, ValueError, OverflowError, OSError):
+                ok = False
+            if not ok:
+                return f"entry {i} has a missing or bad clock or timestamp"
+        return None
+
+    def offer(self, batch):
+        """
+        /ingest: queue a batch shipped by a server started with --push.
+        Malformed batches are refused (400) here, before they reach the
+        merge. Refused while the merge is behind, which makes the server
+        back off and batch up more. Returns a Flask response tuple.
+        """
+        error = self.malformed(batch)
+        if error is not None:
+            return {"error": "bad-batch", "detail": error}, 400
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            return {"error": "busy"}, 429, {"Retry-After": str(RETRY_AFTER)}
+        return {"status": "ok"}, 200
+
+    def ingest_loop(self):
+        """Merge pushed batches as they arrive and show what they release, between the master's rounds."""
+        while True:
+            batch = self.queue.get()
+            s = batch["server"]
+            try:
+                with self.lock:
+                    if self.on_push is not None:
+                        self.on_push(batch)
+                    self.pushed_at[s] = time.time()
+                    # it holds the watermark back like a polled server, even when
+                    # it isn't one of the servers the master was started with; only
+                    # its own batches move its mark (progress), never a round
+                    self.merger.live.add(s)
+                    self.accept(s, batch["boot"], batch["entries"])
+                    self.merger.advance(s, batch["progress"])
+                    self.show(self.merger.release())
+            except Exception as e:
+                # one bad batch must not stop the merge of every later one
+                print(f"[MASTER] Pushed batch from server {s} not merged: {e!r}")
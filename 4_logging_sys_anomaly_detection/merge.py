@@ -0,0 +1,77 @@
+# merge.py
+# Watermarked k-way merge of the servers' log streams, shared by master.py
+# of both the berkeley and the lamport variant (they differ only in the key
+# and the clock they merge by).
+
+import heapq
+import itertools
+from collections import deque
+
+
+class StreamMerger:
+    """
+    Heap-based k-way merge of the servers' log streams. Each server's
+    entries arrive in its own order; the heap holds the head of every
+    server's queue, so the globally next entry is always on top. An entry
+    is released only once every live server has moved past its clock (the
+    watermark), so nothing that arrives later can sort before it. Memory is
+    bounded by what sits above the watermark, not by the length of the logs.
+    """
+    def __init__(self, key, clock):
+        self.key = key              # merge order
+        self.clock = clock          # entry -> the clock the watermark is compared with
+        self.queues = {}            # server -> pulled entries not yet released
+        self.progress = {}          # server -> clock every later entry of it lies past
+        self.live = set()           # servers that hold the watermark back this round
+        self.heap = []              # (key, tiebreak, entry, server), one per non-empty queue
+        self.tiebreak = itertools.count()
+        self.released = None        # watermark of the last release
+
+    def push(self, s, entries):
+        """Queue a server's new entries, in its own order."""
+        if not entries:
+            return
+        q = self.queues.setdefault(s, deque())
+        if not q:
+            heapq.heappush(self.heap, (self.key(entries[0]), next(self.tiebreak), entries[0], s))
+        q.extend(entries)
+        mark = self.progress.get(s)
+        for entry in entries:
+            clock = self.clock(entry)
+            if mark is not None and clock < mark:
+                # behind what its server already reported (its clock went
+                # back, e.g. it restarted): it can't come out in order
+                entry["late"] = True
+            else:
+                mark = clock
+        self.advance(s, mark)
+
+    def advance(self, s, clock):
+        """Server s will log nothing at or below `clock` from now on."""
+        if s not in self.progress or clock > self.progress[s]:
+            self.progress[s] = clock
+
+    def watermark(self):
+        if any(s not in self.progress for s in self.live):
+            # a live server that reported nothing yet may still log anything
+            return None
+        marks = [self.progress[s] for s in self.live]
+        return min(marks) if marks else None
+
+    def release(self):
+        """Yield the queued entries up to the watermark, in global order."""
+        w = self.watermark()
+        if w is None:
+            return
+        while self.heap and self.clock(self.heap[0][2]) <= w:
+            _, _, entry, s = heapq.heappop(self.heap)
+            q = self.queues[s]
+            q.popleft()
+            if q:
+                heapq.heappush(self.heap, (self.key(q[0]), next(self.tiebreak), q[0], s))
+            if self.released is not None and self.clock(entry) <= self.released:
+                # its server was left out of an earlier watermark (unreachable)
+                entry["late"] = True
+            yield entry
+        if self.released is None or w > self.released:
+            self.released = w
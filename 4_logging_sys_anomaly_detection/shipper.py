@@ -0,0 +1,50 @@
+# shipper.py
+# Push mode for server.py of both the berkeley and the lamport variant:
+# ships a server's buffered log entries to the master's /ingest in batches.
+
+import time
+import itertools
+import requests
+
+SHIP_BATCH = 500        # entries per /ingest call; a full batch ships at once
+SHIP_INTERVAL = 0.2     # seconds between calls when batches don't fill
+SHIP_TIMEOUT = 5.0
+MAX_BACKOFF = 5.0       # longest pause after the master refused or failed
+
+
+def ship_logs(master_url, server, boot, logs, cond, progress):
+    """
+    Ship logs (a deque of entries with offsets, guarded by cond) to the
+    master's /ingest in batches over one keep-alive connection: as soon as
+    SHIP_BATCH entries are waiting, else every SHIP_INTERVAL (an empty
+    batch then still carries progress(), the clock every later entry lies
+    past). Entries leave the buffer only once the master accepted them.
+    When the master is behind (429) or down, the shipper backs off and the
+    buffer absorbs the difference.
+    """
+    session = requests.Session()
+    shipped = -1        # offset of the last entry the master accepted
+    backoff = SHIP_INTERVAL
+    while True:
+        with cond:
+            cond.wait_for(lambda: len(logs) >= SHIP_BATCH, timeout=SHIP_INTERVAL)
+            while logs and logs[0]["offset"] <= shipped:
+                logs.popleft()
+            batch = list(itertools.islice(logs, SHIP_BATCH))
+            mark = progress()
+        try:
+            r = session.post(f"{master_url}/ingest", timeout=SHIP_TIMEOUT,
+                             json={"server": server, "boot": boot, "entries": batch, "progress": mark})
+        except requests.RequestException:
+            r = None
+        if r is not None and r.status_code == 200:
+            if batch:
+                shipped = batch[-1]["offset"]
+            backoff = SHIP_INTERVAL
+            continue
+        if r is not None and r.status_code == 429:
+            wait = float(r.headers.get("Retry-After", backoff))
+        else:
+            wait = backoff
+        backoff = min(backoff * 2, MAX_BACKOFF)
+        time.sleep(wait)
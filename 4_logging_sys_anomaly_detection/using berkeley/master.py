@@ -1,65 +1,169 @@
+import os
 import sys
 import time
 import requests
 import threading
-from flask import Flask
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import Flask, request
 from datetime import datetime, timezone
 
+# anomaly.py, merge.py and ingest.py are shared by both variants, one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from anomaly import AnomalyDetector, detect, describe
+from merge import StreamMerger
+from ingest import LogIngest
+
 app = Flask(__name__)
 
 MASTER_PORT = None
+SAMPLES_PER_SERVER = 4  # /time round trips per server per sync; the lowest-RTT one is used
+ROUND_DEADLINE = 2.0    # seconds a sync round may spend polling; slower servers sit the round out
+REQUEST_TIMEOUT = 1.0   # seconds per /time or /adjust call
+MAX_SKEW = 0.5          # clocks further than this from the median are left out of the average
+POOL_SIZE = 64          # threads polling / adjusting servers at once
+
+pool = ThreadPoolExecutor(max_workers=POOL_SIZE)
+local = threading.local()
 
 # ----------------------
 # Berkeley Algorithm
 # ----------------------
-def collect_times(servers):
-    times = {}
-    for s in servers:
+def session():
+    """One keep-alive session per pool thread, so samples after the first skip the TCP handshake."""
+    if not hasattr(local, "session"):
+        local.session = requests.Session()
+    return local.session
+
+def sample_time(s, deadline):
+    """
+    Up to SAMPLES_PER_SERVER /time round trips to server s before deadline.
+    Returns (offset of its clock from ours, rtt, time it reported) for the
+    lowest-RTT sample, or None. Cristian: the reported time was read about
+    rtt/2 before the reply reached us.
+    """
+    best = None
+    for _ in range(SAMPLES_PER_SERVER):
+        left = deadline - time.time()
+        if left <= 0:
+            break
         try:
-            r = requests.get(f"http://localhost:{s}/time").json()
-            times[s] = r["server_time"]
+            sent = time.perf_counter()
+            r = session().get(f"http://localhost:{s}/time", timeout=min(REQUEST_TIMEOUT, left))
+            rtt = time.perf_counter() - sent
+            received = time.time()
+            server_time = r.json()["server_time"]
         except:
-            times[s] = None
+            continue
+        if best is None or rtt < best[1]:
+            best = (server_time + rtt / 2 - received, rtt, server_time)
+    return best
+
+def collect_times(servers, deadline):
+    """Sample every server concurrently; servers with no sample by the deadline map to None."""
+    futures = {pool.submit(sample_time, s, deadline): s for s in servers}
+    wait(futures, timeout=max(0, deadline - time.time()))
+    times = {}
+    for f, s in futures.items():
+        times[s] = f.result() if f.done() else None
     return times
 
-def berkeley(servers):
-    times = collect_times(servers)
-    valid = [t for t in times.values() if t is not None]
-
-    if not valid:
-        return {}
+def fault_tolerant_average(offsets):
+    """Average of the offsets within MAX_SKEW of their median; also returns the servers left out."""
+    ordered = sorted(offsets.values())
+    mid = len(ordered) // 2
+    median = ordered[mid] if len(ordered) % 2 else (ordered[mid - 1] + ordered[mid]) / 2
+    kept = [o for o in ordered if abs(o - median) <= MAX_SKEW]
+    if not kept:
+        # an even split into two camps far apart leaves nothing near the
+        # midpoint: follow the lower middle clock and its camp instead
+        median = ordered[mid - 1]
+        kept = [o for o in ordered if abs(o - median) <= MAX_SKEW]
+    outliers = {s for s, o in offsets.items() if abs(o - median) > MAX_SKEW}
+    return sum(kept) / len(kept), outliers
+
+def post_adjust(s, adj):
+    try:
+        session().post(f"http://localhost:{s}/adjust",
+                       json={"adjust_seconds": adj}, timeout=REQUEST_TIMEOUT)
+        return True
+    except:
+        return False
 
-    avg = sum(valid) / len(valid)
+def berkeley(servers):
+    """
+    One sync round. Returns {server: adjustment or None if unreachable},
+    {server: rtt of the sample used}, the servers whose clocks were left
+    out of the average (they are still adjusted to it) and {server: time
+    every entry it logs from now on lies past}.
+    """
+    samples = collect_times(servers, time.time() + ROUND_DEADLINE)
+    offsets = {s: smp[0] for s, smp in samples.items() if smp is not None}
+
+    if not offsets:
+        return {}, {}, set(), {}
+
+    avg, outliers = fault_tolerant_average(offsets)
     adjustments = {}
+    rtts = {}
+    marks = {}
+    posts = {}
 
-    for s, t in times.items():
-        if t is None:
+    for s, smp in samples.items():
+        if smp is None:
             adjustments[s] = None
             continue
 
-        adj = avg - t
+        offset, rtt, server_time = smp
+        adj = avg - offset
         adjustments[s] = adj
-        try:
-            requests.post(f"http://localhost:{s}/adjust",
-                          json={"adjust_seconds": adj})
-        except:
-            pass
-
-    return adjustments
-
-def collect_logs(servers):
-    merged = []
+        rtts[s] = rtt
+        # whether or not the adjust lands, the server's clock is now past both
+        marks[s] = server_time + min(0.0, adj)
+        posts[pool.submit(post_adjust, s, adj)] = s
+
+    wait(posts, timeout=REQUEST_TIMEOUT)
+    for f, s in posts.items():
+        if not (f.done() and f.result()):
+            print(f"[MASTER] Adjust to server {s} not delivered")
+
+    return adjustments, rtts, outliers, marks
+
+merger = StreamMerger(key=lambda x: x["timestamp"], clock=lambda x: x["timestamp"])
+detector = AnomalyDetector()
+
+def show(merged):
+    """Print merged entries and whatever the detector finds in them. Caller holds feed.lock."""
+    for entry, anomalies in detect(merged, detector,
+                                   lambda e: (e["server"], e["timestamp"], e["msg"], None)):
+        ts = datetime.fromtimestamp(entry["timestamp"], tz=timezone.utc).isoformat()
+        late = " (late)" if entry.get("late") else ""
+        print(f"[S{entry['server']}] {ts} → {entry['msg']}{late}")
+        for a in anomalies:
+            print(describe(a))
+
+def check(entry):
+    # show prints the timestamp as a UTC date
+    datetime.fromtimestamp(entry["timestamp"], tz=timezone.utc)
+
+# pulled and pushed batches; its lock also covers detector
+feed = LogIngest(merger, show, check)
+
+def collect_logs(servers, marks):
+    """Pull what each server that isn't pushing logged since the last pull; shows what the watermark releases."""
     for s in servers:
-        try:
-            server_logs = requests.get(f"http://localhost:{s}/logs").json()
-            for entry in server_logs:
-                entry["server"] = s
-                merged.append(entry)
-        except:
-            pass
+        if not feed.pushing(s):
+            # the pull has everything logged before the sync round
+            feed.pull(s, marks.get(s))
 
-    merged.sort(key=lambda x: x["timestamp"])
-    return merged
+    with feed.lock:
+        show(merger.release())
+
+# ----------------------
+# Push Mode
+# ----------------------
+@app.post("/ingest")
+def ingest():
+    return feed.offer(request.get_json(silent=True))
 
 # ----------------------
 # Master Loop
@@ -68,20 +172,24 @@ def master_loop(servers):
     print(f"[MASTER] Started on port {MASTER_PORT}")
     while True:
         print("\n========== BERKELEY SYNC ==========")
-        adjustments = berkeley(servers)
+        adjustments, rtts, outliers, marks = berkeley(servers)
 
         for s, adj in adjustments.items():
             if adj is None:
                 print(f"[MASTER] Server {s} unreachable")
             else:
-                print(f"[MASTER] Server {s} adjusted by {adj:.6f} seconds")
-
-        print("\n========== MERGED LOGS ==========")
-        merged = collect_logs(servers)
-
-        for entry in merged:
-            ts = datetime.fromtimestamp(entry["timestamp"], tz=timezone.utc).isoformat()
-            print(f"[S{entry['server']}] {ts} → {entry['msg']}")
+                note = ", outlier, not averaged" if s in outliers else ""
+                print(f"[MASTER] Server {s} adjusted by {adj:.6f} seconds (rtt {rtts[s] * 1000:.2f} ms{note})")
+                with feed.lock:
+                    found = detector.observe_adjust(s, adj, time.time())
+                for a in found:
+                    print(describe(a))
+        # unreachable servers don't hold the merged stream back; pushing ones do
+        with feed.lock:
+            merger.live = {s for s, adj in adjustments.items() if adj is not None} | feed.pushers()
+
+        print("\n========== MERGED LOGS (UP TO WATERMARK) ==========")
+        collect_logs(servers, marks)
 
         print("===================================\n")
         time.sleep(5)
@@ -95,8 +203,11 @@ def flask_thread():
 if __name__ == "__main__":
     MASTER_PORT = int(sys.argv[1])
     servers = list(map(int, sys.argv[2:]))
+    # until the first round, pushed batches must wait for these too
+    merger.live = set(servers)
 
     threading.Thread(target=flask_thread).start()
+    threading.Thread(target=feed.ingest_loop, daemon=True).start()
     time.sleep(1)
 
     master_loop(servers)
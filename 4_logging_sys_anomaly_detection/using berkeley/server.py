@@ -1,21 +1,55 @@
+import os
 import sys
 import time
+import uuid
+import argparse
 import threading
+from collections import deque
 from flask import Flask, request, jsonify
 from datetime import datetime, timezone
 
+# shipper.py (push mode) is shared by both variants, one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shipper import SHIP_BATCH, ship_logs
+
 app = Flask(__name__)
 
 offset = 0.0
-logs = []
+last_stamp = 0.0    # latest timestamp handed out (entries and progress marks)
+# Entries not yet acknowledged by the master, oldest first. Each carries its
+# position in this server's log ("offset"), which the master pulls by.
+logs = deque()
+next_offset = 0
+logs_lock = threading.Lock()
+ship_cond = threading.Condition(logs_lock)   # push mode: add_log wakes the shipper on a full batch
+MAX_RETAINED = 100000   # past this the oldest unacknowledged entries are dropped
 SERVER_PORT = None
+BOOT = uuid.uuid4().hex  # new on every start: a master's cursor from an earlier run is recognised
 
 def now():
     return time.time() + offset
 
+def stamp():
+    """
+    now(), but never below a timestamp already handed out: when /adjust
+    steps the clock back, stamps hold still until it catches up, so this
+    server's entries stay in timestamp order and its progress marks stay
+    true. Caller holds logs_lock.
+    """
+    global last_stamp
+    last_stamp = max(last_stamp, now())
+    return last_stamp
+
 def add_log(msg):
-    ts = now()
-    logs.append({"timestamp": ts, "msg": msg})
+    global next_offset
+    with logs_lock:
+        ts = stamp()
+        logs.append({"offset": next_offset, "timestamp": ts, "msg": msg})
+        next_offset += 1
+        if len(logs) > MAX_RETAINED:
+            logs.popleft()
+        if len(logs) == SHIP_BATCH:
+            ship_cond.notify()
     tstr = datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
     print(f"[SERVER-{SERVER_PORT}] {tstr} → {msg}")
 
@@ -33,20 +67,46 @@ def adjust():
 
 @app.get("/logs")
 def get_logs():
-    return jsonify(logs)
+    # /logs?after=N&boot=ID: entries past offset N. The master only asks for
+    # what follows what it already has, so entries up to N are acknowledged and
+    # dropped, but only if its cursor is from this run of the server (BOOT):
+    # a cursor from before a restart acknowledges nothing.
+    after = request.args.get("after", type=int)
+    with logs_lock:
+        if after is not None and request.args.get("boot") == BOOT:
+            while logs and logs[0]["offset"] <= after:
+                logs.popleft()
+        entries = list(logs)
+    return jsonify({"boot": BOOT, "entries": entries})
+
+def progress_mark():
+    # every entry logged later has a timestamp at least this. Called by the
+    # shipper under ship_cond, which holds logs_lock.
+    return stamp()
 
 def flask_thread():
     app.run(port=SERVER_PORT, debug=False, use_reloader=False)
 
 if __name__ == "__main__":
-    SERVER_PORT = int(sys.argv[1])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("port", type=int)
+    parser.add_argument("--push", type=int, default=None, metavar="MASTER_PORT",
+                        help="ship logs to the master on this port instead of waiting to be polled")
+    parser.add_argument("--interval", type=float, default=4.0,
+                        help="seconds between generated local events")
+    args = parser.parse_args()
+    SERVER_PORT = args.port
 
     threading.Thread(target=flask_thread).start()
     time.sleep(1)
 
+    if args.push is not None:
+        threading.Thread(target=ship_logs, daemon=True,
+                         args=(f"http://localhost:{args.push}", SERVER_PORT, BOOT, logs, ship_cond, progress_mark)).start()
+
     add_log("Server started")
 
-    # Generate a log every 4 seconds
+    # Generate a log every 4 seconds (--interval)
     while True:
-        time.sleep(4)
+        time.sleep(args.interval)
         add_log("Local event recorded")
@@ -1,8 +1,16 @@
+import os
 import sys
 import time
 import threading
 import requests
-from flask import Flask
+from flask import Flask, request
+from datetime import datetime
+
+# anomaly.py, merge.py and ingest.py are shared by both variants, one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from anomaly import AnomalyDetector, detect, describe
+from merge import StreamMerger
+from ingest import LogIngest
 
 app = Flask(__name__)
 
@@ -41,20 +49,58 @@ def get_clocks(servers):
     return clocks
 
 
-def merge_logs(servers):
-    merged = []
+# Sort by (Lamport Clock, Server ID)
+merger = StreamMerger(key=lambda x: (x["lamport"], x["server"]), clock=lambda x: x["lamport"])
+detector = AnomalyDetector()
+
+
+def detector_fields(entry):
+    t = datetime.fromisoformat(entry["timestamp"]).timestamp()
+    return entry["server"], t, entry["msg"], entry["lamport"]
+
+
+def show(merged):
+    """Print merged entries and whatever the detector finds in them. Caller holds feed.lock."""
+    for entry, anomalies in detect(merged, detector, detector_fields):
+        late = " (late)" if entry.get("late") else ""
+        print(f"[S{entry['server']}] LC={entry['lamport']} @ {entry['timestamp']} → {entry['msg']}{late}")
+        for a in anomalies:
+            print(describe(a))
+
+
+def check(entry):
+    # the detector reads the timestamp as an ISO date
+    datetime.fromisoformat(entry["timestamp"])
+
+
+def on_push(batch):
+    # a pushed batch is a message from the server → receive event
+    receive_clock(batch["progress"])
+
+
+# pulled and pushed batches; pulls continue after the last Lamport clock
+# received. Its lock also covers detector.
+feed = LogIngest(merger, show, check, after="lamport", on_push=on_push)
+
+
+def merge_logs(servers, clocks):
+    """Pull what each server that isn't pushing logged since the last pull; shows what the watermark releases."""
     for s in servers:
-        try:
-            logs = requests.get(f"http://localhost:{s}/logs").json()
-            for entry in logs:
-                entry["server"] = s
-                merged.append(entry)
-        except:
-            pass
+        if not feed.pushing(s):
+            # the pull has everything logged before the poll; its later
+            # events all carry a larger clock
+            feed.pull(s, clocks.get(s))
 
-    # Sort by (Lamport Clock, Server ID)
-    merged.sort(key=lambda x: (x["lamport"], x["server"]))
-    return merged
+    with feed.lock:
+        show(merger.release())
+
+
+# ---------------------------------------------------------
+# PUSH MODE
+# ---------------------------------------------------------
+@app.post("/ingest")
+def ingest():
+    return feed.offer(request.get_json(silent=True))
 
 
 # ---------------------------------------------------------
@@ -71,11 +117,12 @@ def master_loop(servers):
                 print(f"[MASTER] Server {s} unreachable")
             else:
                 print(f"[MASTER] Server {s} LC={lc}")
+        # unreachable servers don't hold the merged stream back; pushing ones do
+        with feed.lock:
+            merger.live = {s for s, lc in clocks.items() if lc is not None} | feed.pushers()
 
-        print("\n========== MERGED LOGS (LAMPORT ORDER) ==========")
-        merged = merge_logs(servers)
-        for entry in merged:
-            print(f"[S{entry['server']}] LC={entry['lamport']} @ {entry['timestamp']} → {entry['msg']}")
+        print("\n========== MERGED LOGS (LAMPORT ORDER, UP TO WATERMARK) ==========")
+        merge_logs(servers, clocks)
 
         print("=================================================\n")
         time.sleep(5)
@@ -91,8 +138,11 @@ def flask_thread():
 if __name__ == "__main__":
     MASTER_PORT = int(sys.argv[1])
     servers = list(map(int, sys.argv[2:]))
+    # until the first round, pushed batches must wait for these too
+    merger.live = set(servers)
 
     threading.Thread(target=flask_thread).start()
+    threading.Thread(target=feed.ingest_loop, daemon=True).start()
     time.sleep(1)
 
     master_loop(servers)
@@ -1,14 +1,29 @@
+import os
 import sys
 import time
+import uuid
+import argparse
 import threading
+from collections import deque
 from flask import Flask, jsonify, request
 from datetime import datetime, timezone
 
+# shipper.py (push mode) is shared by both variants, one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shipper import SHIP_BATCH, ship_logs
+
 app = Flask(__name__)
 
 lamport_clock = 0
-logs = []
+# Entries not yet acknowledged by the master, oldest first, in Lamport order.
+# "offset" is each entry's position in this server's log, so gaps show.
+logs = deque()
+next_offset = 0
+logs_lock = threading.Lock()
+ship_cond = threading.Condition(logs_lock)   # push mode: add_log wakes the shipper on a full batch
+MAX_RETAINED = 100000   # past this the oldest unacknowledged entries are dropped
 SERVER_PORT = None
+BOOT = uuid.uuid4().hex  # new on every start: a master's cursor from an earlier run is recognised
 
 
 # ---------------------------------------------------------
@@ -29,10 +44,18 @@ def receive_clock(remote_clock):
 # Logging Helper
 # ---------------------------------------------------------
 def add_log(msg):
-    lc = increment()
+    global next_offset
     ts = datetime.now(timezone.utc).isoformat()
 
-    logs.append({"lamport": lc, "timestamp": ts, "msg": msg})
+    with logs_lock:
+        # clock tick and append together, so logs stays in Lamport order
+        lc = increment()
+        logs.append({"offset": next_offset, "lamport": lc, "timestamp": ts, "msg": msg})
+        next_offset += 1
+        if len(logs) > MAX_RETAINED:
+            logs.popleft()
+        if len(logs) == SHIP_BATCH:
+            ship_cond.notify()
     print(f"[SERVER-{SERVER_PORT}] LC={lc} @ {ts} → {msg}")
 
 
@@ -47,7 +70,25 @@ def send_clock():
 
 @app.get("/logs")
 def get_logs():
-    return jsonify(logs)
+    # /logs?after=LC&boot=ID: entries with a Lamport clock past LC. The master
+    # only asks for what follows what it already has, so entries up to LC are
+    # acknowledged and dropped, but only if its cursor is from this run of
+    # the server (BOOT): a cursor from before a restart acknowledges nothing.
+    after = request.args.get("after", type=int)
+    with logs_lock:
+        if after is not None and request.args.get("boot") == BOOT:
+            while logs and logs[0]["lamport"] <= after:
+                logs.popleft()
+        entries = list(logs)
+    return jsonify({"boot": BOOT, "entries": entries})
+
+
+# ---------------------------------------------------------
+# Push Mode
+# ---------------------------------------------------------
+def progress_mark():
+    # every entry logged later has a larger Lamport clock
+    return lamport_clock
 
 
 # ---------------------------------------------------------
@@ -57,13 +98,24 @@ def flask_thread():
     app.run(port=SERVER_PORT, debug=False, use_reloader=False)
 
 if __name__ == "__main__":
-    SERVER_PORT = int(sys.argv[1])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("port", type=int)
+    parser.add_argument("--push", type=int, default=None, metavar="MASTER_PORT",
+                        help="ship logs to the master on this port instead of waiting to be polled")
+    parser.add_argument("--interval", type=float, default=4.0,
+                        help="seconds between generated local events")
+    args = parser.parse_args()
+    SERVER_PORT = args.port
 
     threading.Thread(target=flask_thread).start()
     time.sleep(1)
 
+    if args.push is not None:
+        threading.Thread(target=ship_logs, daemon=True,
+                         args=(f"http://localhost:{args.push}", SERVER_PORT, BOOT, logs, ship_cond, progress_mark)).start()
+
     add_log("Server started")
 
     while True:
-        time.sleep(4)
+        time.sleep(args.interval)
         add_log("Local event recorded")